@@ -1,61 +1,35 @@
 """ 
 combines all the JSON files into a single CSV file
 
+COMBINE_WORKERS / COMBINE_SHARDS: parallel, ordered combine as in
+combine-to-csv-at-each-10th-step.py
 """
 
 import os
-import json
-import csv
 import pandas as pd
 from pymatgen.core import Structure
 
-# Define paths
-base_dir = os.getcwd()
-output_csv = os.path.join(base_dir, 'consolidated_data_nc.csv')
-json_dir = os.path.join(base_dir, 'phosphorus_based_int_str')  # Path to intermediate JSON files
-
-# Define column headers for the CSV file
-headers = ["Structure", "Energy", "Forces", "Stress", "Directory", "Step"]
-
-# Open the CSV file in write mode
-with open(output_csv, mode='w', newline='') as csv_file:
-    writer = csv.writer(csv_file)
-    writer.writerow(headers)  # Write headers
-
-    # Process each JSON file in the all_intermediate_information directory
-    for json_filename in os.listdir(json_dir):
-        if json_filename.endswith('.json'):
-            json_path = os.path.join(json_dir, json_filename)
-            try:
-                with open(json_path, 'r') as json_file:
-                    data = json.load(json_file)
-                    if not isinstance(data, list):
-                        continue
-                    directory_name = json_filename.replace('.json', '')
-
-                    for step_data in data:
-                        structure_info = step_data.get('structure', {})
-                        if not structure_info:
-                            continue
-                        structure_str = json.dumps(structure_info)
-                        energy = step_data.get('energy', "N/A")
-
-                        forces = step_data.get('forces', [])
-                        forces_str = json.dumps(forces)
-                        stresses = step_data.get('stress', [])
-                        stresses_str = json.dumps(stresses)
-
-                        writer.writerow([
-                            structure_str,                # Structure in JSON format
-                            energy,                       # Energy
-                            forces_str,                   # Forces in JSON format
-                            stresses_str,                 # Stresses in JSON format
-                            directory_name,               # Directory
-                            step_data.get('step', 0)      # Step
-                        ])
-            except json.JSONDecodeError:
-                print(f"Error reading JSON file at {json_path}")
-            except Exception as e:
-                print(f"An error occurred: {e}")
-
-print(f"Consolidated data saved to {output_csv}")
\ No newline at end of file
+from geoopt_pipeline.combine import combine_parallel
+from geoopt_pipeline.dataset import write_rows
+from geoopt_pipeline.records import combine_rows
+from geoopt_pipeline.workers import default_workers
+
+def main():
+    # Define paths
+    base_dir = os.getcwd()
+    output_csv = os.path.join(base_dir, os.environ.get('OUTPUT_CSV', 'consolidated_data_nc.csv'))  # .gz/.zst suffix -> compressed, .parquet/.arrow -> columnar
+    json_dir = os.path.join(base_dir, 'phosphorus_based_int_str')  # Path to intermediate JSON (or .npz trajectory) files
+    n_workers = int(os.environ.get('COMBINE_WORKERS', 1)) or default_workers()   # 0: SLURM cpus / all cores
+    n_shards = int(os.environ.get('COMBINE_SHARDS', 0))
+
+    # Every step of each JSON file in the all_intermediate_information directory,
+    # written as CSV or as a columnar file depending on the output name
+    if n_workers > 1 or n_shards:
+        combine_parallel(json_dir, output_csv, n_workers, every_10th=False, shards=n_shards)
+    else:
+        write_rows(output_csv, combine_rows(json_dir, every_10th=False))
+
+    print(f"Consolidated data saved to {output_csv}")
+
+if __name__ == "__main__":
+    main()
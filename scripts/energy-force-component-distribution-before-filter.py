@@ -5,210 +5,290 @@ This will help us filter the range of energy, forces, or stress values we should
 We can set the bin sizes for energy and forces accordingly.
 
 Look into the result CSV file, and decide the range of energy and forces we should take for our dataset.
+
+The same pass also fills quantile sketches (t-digest, geoopt_pipeline.sketch)
+for the energy, the energy per atom and each force component, and writes
+the QUANTILES percentiles to OUT_QUANTILES_CSV: data-driven cut points
+(e.g. 0.1% / 99.9%) for EMIN/EMAX/FMIN/FMAX without another scan.
+
+STATS_DIR=all_intermediate_information answers from the extractor's
+per-step statistics sidecars instead (geoopt_pipeline.stepstats): energy
+histogram, energy quantiles and force ranges in milliseconds, but no
+force-component histograms (those need every component).
 """
 
 
 #!/usr/bin/env python3
 import os
 import json
-import math
 import csv
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from geoopt_pipeline.fileio import has_suffix, open_file
+from geoopt_pipeline.histogram import TABLE_HEADER, StreamingHistogram, table_rows
+from geoopt_pipeline.selection import make_selector, sampling_from_env
+from geoopt_pipeline.ranges import EnergyForceRanges
+from geoopt_pipeline.sketch import TDigest
+from geoopt_pipeline.stepstats import iter_stats, list_stats_files
+from geoopt_pipeline.trajectory import TRAJECTORY_SUFFIX, iter_steps
 
 # ==== Config ====
-JSON_DIR   = "phosphorus_based_int_str"          # folder with intermediate JSON files
-OUT_CSV    = "energy_force_component_distribution_before_filter.csv"
+JSON_DIR   = "phosphorus_based_int_str"          # folder with intermediate JSON (or .npz trajectory) files
+OUT_CSV    = "energy_force_component_distribution_before_filter.csv"   # add .gz/.zst to compress
 BIN_E      = 150.0   # energy bin width (eV)
 BIN_FC     = 10    # force-component bin width (eV/Å)
-
-# --- Helpers (same step-selection you use) ---
-def geo_idx(name: str) -> int:
-    if name == "geo_opt":
-        return 1
-    if name.startswith("geo_opt_"):
-        try:
-            return int(name.split("_")[2])
-        except Exception:
-            return 0
-    return 0
-
-def select_steps_for_folder(entries, is_highest: bool):
-    def parse_step(e):
-        try:
-            return int(e.get("step", -1))
-        except Exception:
-            return -1
-
-    entries_sorted = sorted(entries, key=parse_step)
-    if not entries_sorted:
-        return []
-
-    if len(entries_sorted) < 10:
-        return [entries_sorted[-1]]
-
-    first_two_steps = {parse_step(entries_sorted[0]), parse_step(entries_sorted[1])}
-    selected, seen = [], set()
-    for e in entries_sorted:
-        s = parse_step(e)
-        if s in (-1,): continue
-        if s in first_two_steps: continue
-        if s % 10 == 0 and s not in seen:
-            selected.append(e); seen.add(s)
-
-    if is_highest:
-        last_e = entries_sorted[-1]
-        if last_e not in selected:
-            selected.append(last_e)
-
-    return sorted(selected, key=parse_step)
-
+OUT_QUANTILES_CSV = "energy_force_quantiles_before_filter.csv"
+QUANTILES  = [float(q) for q in os.environ.get("QUANTILES", "0.001,0.01,0.05,0.5,0.95,0.99,0.999").split(",")]
+SAMPLING   = sampling_from_env()   # SAMPLING=adaptive: same steps as the combine script with it
+N_WORKERS  = int(os.environ.get("DIST_WORKERS", 1))   # files read in parallel, partial histograms merged
+FLUSH_VALUES = 1 << 20   # force components buffered per file before they are binned
+STATS_DIR  = os.environ.get("STATS_DIR")   # answer from the extractor's *_intermediate_stats.csv sidecars
+
+# --- Helpers (step selection: geoopt_pipeline.selection) ---
 def ffloat(x):
     try:
         return float(x)
     except Exception:
         return None
 
-def make_hist(values, bin_width):
-    vmin, vmax = min(values), max(values)
-    start_bin = math.floor(vmin / bin_width) * bin_width
-    end_bin   = math.ceil(vmax / bin_width) * bin_width
-    if end_bin == start_bin:
-        end_bin = start_bin + bin_width
-    num_bins = int(round((end_bin - start_bin) / bin_width))
-    edges = [start_bin + i * bin_width for i in range(num_bins + 1)]
-    counts = [0] * num_bins
-    for v in values:
-        idx = int((v - start_bin) // bin_width)
-        if idx < 0: idx = 0
-        if idx >= num_bins: idx = num_bins - 1
-        counts[idx] += 1
-    return edges, counts
-
-# --- Collect BEFORE filtering ---
-base_dir = os.getcwd()
-json_dir = os.path.join(base_dir, JSON_DIR)
-
-energies = []
-Fx, Fy, Fz = [], [], []
-
-num_files = 0
-invalid_energy = 0
-invalid_force_rows = 0
-force_components_parsed = 0
-
-for json_filename in os.listdir(json_dir):
-    if not json_filename.endswith(".json"):
-        continue
-
-    json_path = os.path.join(json_dir, json_filename)
-    try:
-        with open(json_path, "r") as f:
-            data = json.load(f)
-        if not isinstance(data, list):
-            continue
-
-        # group by geo_opt_folder
-        groups = {}
-        for step_data in data:
-            gof  = step_data.get("geo_opt_folder")
-            step = step_data.get("step", None)
-            if gof is None or step is None:
-                continue
-            groups.setdefault(gof, []).append(step_data)
-        if not groups:
+def force_components(forces):
+    """(fx, fy, fz) arrays of the parseable components of one step's forces."""
+    arr = np.array(forces) if forces else np.empty((0, 3))
+    if arr.ndim == 2 and arr.shape[1] >= 3 and arr.dtype.kind in "fi":
+        return arr[:, 0].astype(np.float64), arr[:, 1].astype(np.float64), arr[:, 2].astype(np.float64)
+    # Ragged or non-numeric entries: parse component by component
+    comps = ([], [], [])
+    for vec in forces:
+        if not (isinstance(vec, (list, tuple)) and len(vec) >= 3):
             continue
+        for j in range(3):
+            v = ffloat(vec[j])
+            if v is not None:
+                comps[j].append(v)
+    return tuple(np.asarray(c, dtype=np.float64) for c in comps)
+
+class Partial:
+    """Histograms and counters of some of the files; partials of parallel workers merge."""
+
+    def __init__(self):
+        self.energy = StreamingHistogram(BIN_E)
+        self.forces = [StreamingHistogram(BIN_FC) for _ in range(3)]
+        # quantity -> quantile sketch, in OUT_QUANTILES_CSV order
+        self.sketches = {name: TDigest() for name in
+                         ("energy_eV", "energy_per_atom_eV", "Fx_eV_per_A", "Fy_eV_per_A", "Fz_eV_per_A")}
+        self.num_files = 0
+        self.invalid_energy = 0
+        self.invalid_force_rows = 0
+        self.force_components_parsed = 0
+
+    def merge(self, other):
+        self.energy.merge(other.energy)
+        for h, o in zip(self.forces, other.forces):
+            h.merge(o)
+        for name, sketch in self.sketches.items():
+            sketch.merge(other.sketches[name])
+        self.num_files += other.num_files
+        self.invalid_energy += other.invalid_energy
+        self.invalid_force_rows += other.invalid_force_rows
+        self.force_components_parsed += other.force_components_parsed
+        return self
+
+def collect_file(json_path):
+    """Bin the selected steps of one structure file (steps read before an error are kept)."""
+    part = Partial()
+    energies = []
+    per_atom = []
+    buffers = ([], [], [])
+    n_buffered = 0
+    sketches = part.sketches
+    force_sketches = [sketches["Fx_eV_per_A"], sketches["Fy_eV_per_A"], sketches["Fz_eV_per_A"]]
+
+    def flush():
+        part.energy.add(energies)
+        sketches["energy_eV"].add(energies)
+        sketches["energy_per_atom_eV"].add(per_atom)
+        energies.clear()
+        per_atom.clear()
+        for h, sketch, buf in zip(part.forces, force_sketches, buffers):
+            if buf:
+                values = np.concatenate(buf)
+                h.add(values)
+                sketch.add(values)
+            buf.clear()
 
-        # highest geo_opt folder
-        folder_indices = {gof: geo_idx(gof) for gof in groups.keys()}
-        valid_folders  = {gof: idx for gof, idx in folder_indices.items() if idx > 0}
-        if not valid_folders:
-            continue
-        highest_folder = max(valid_folders, key=lambda k: valid_folders[k])
+    try:
+        # records are read one at a time and only the selected ones are kept;
+        # structures are only needed by the adaptive policy (positions),
+        # otherwise they are dropped as they are read
+        selector = make_selector(**SAMPLING)
+        selector.update(iter_steps(json_path, with_structure=SAMPLING["policy"] == "adaptive"))
+        # skip files without a recognized geo_opt folder
+        if selector.highest_folder() is None:
+            return part
 
         # select steps (no filtering)
-        for gof, entries in groups.items():
-            is_highest = (gof == highest_folder)
-            selected_entries = select_steps_for_folder(entries, is_highest=is_highest)
-
-            for step_data in selected_entries:
-                # energy
-                e = ffloat(step_data.get("energy", None))
-                if e is None:
-                    invalid_energy += 1
-                else:
-                    energies.append(e)
-
-                # component-wise forces
-                forces = step_data.get("forces", None)
-                if not isinstance(forces, list):
-                    invalid_force_rows += 1
-                    continue
-                any_component = False
-                for vec in forces:
-                    if not (isinstance(vec, (list, tuple)) and len(vec) >= 3):
-                        continue
-                    fx = ffloat(vec[0]); fy = ffloat(vec[1]); fz = ffloat(vec[2])
-                    if fx is not None: Fx.append(fx); any_component = True; force_components_parsed += 1
-                    if fy is not None: Fy.append(fy); any_component = True; force_components_parsed += 1
-                    if fz is not None: Fz.append(fz); any_component = True; force_components_parsed += 1
-                if not any_component:
-                    invalid_force_rows += 1
+        for step_data in selector.selected():
+            # energy
+            e = ffloat(step_data.get("energy", None))
+            if e is None:
+                part.invalid_energy += 1
+            else:
+                energies.append(e)
+
+            # component-wise forces
+            forces = step_data.get("forces", None)
+            # one force vector per atom: the atom count for the energy per atom
+            if e is not None and isinstance(forces, list) and forces:
+                per_atom.append(e / len(forces))
+            if not isinstance(forces, list):
+                part.invalid_force_rows += 1
+                continue
+            comps = force_components(forces)
+            n_comps = sum(len(c) for c in comps)
+            if not n_comps:
+                part.invalid_force_rows += 1
+                continue
+            part.force_components_parsed += n_comps
+            for buf, c in zip(buffers, comps):
+                buf.append(c)
+            n_buffered += n_comps
+            if n_buffered >= FLUSH_VALUES:
+                flush()
+                n_buffered = 0
 
-        num_files += 1
+        part.num_files += 1
 
     except json.JSONDecodeError:
         print(f"[WARN] Could not parse JSON: {json_path}")
     except Exception as exc:
         print(f"[WARN] Error in {json_path}: {exc}")
-
-if not energies and not (Fx or Fy or Fz):
-    print("No energies or forces found. Nothing to do.")
-    raise SystemExit(0)
-
-# --- Build histograms (long-form table) ---
-rows = []  # each row: [quantity, bin_start, bin_end, count]
-
-if energies:
-    e_edges, e_counts = make_hist(energies, BIN_E)
-    for i in range(len(e_counts)):
-        rows.append(["energy_eV", e_edges[i], e_edges[i+1], e_counts[i]])
-
-def add_force_hist(label, arr):
-    if not arr:
+    flush()
+    return part
+
+def write_quantiles(path, sketches, quantiles):
+    """Long-form quantile table (quantity, quantile, value, count); prints a short summary."""
+    with open_file(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["quantity", "quantile", "value", "count"])
+        for name, sketch in sketches.items():
+            if not len(sketch):
+                continue
+            for q, v in zip(quantiles, sketch.quantiles(quantiles)):
+                w.writerow([name, q, v, len(sketch)])
+
+    lo, hi = min(quantiles), max(quantiles)
+    print(f"Quantiles {lo:g} / {hi:g} (suggested filter window):")
+    for name, sketch in sketches.items():
+        if len(sketch):
+            v_lo, v_hi = sketch.quantiles([lo, hi])
+            print(f"  {name}: {v_lo:.6f} / {v_hi:.6f}")
+    forces = [s for n, s in sketches.items() if n.startswith("F") and len(s)]
+    if forces:
+        f_lo = min(s.quantile(lo) for s in forces)
+        f_hi = max(s.quantile(hi) for s in forces)
+        print(f"  all force components: {f_lo:.6f} / {f_hi:.6f}")
+
+def print_range(name, hist, unit, bin_width):
+    if len(hist):
+        print(f"{name} range (min, max): ({hist.min:.6f}, {hist.max:.6f}) {unit} ; bin width={bin_width}")
+    else:
+        print(f"No valid {name} values.")
+
+def main_from_stats(stats_dir):
+    """Energy histogram, quantiles and force ranges of the selected steps, from the sidecars only."""
+    if SAMPLING["policy"] == "adaptive":
+        raise SystemExit("SAMPLING=adaptive needs the atomic positions; run without STATS_DIR.")
+    energy = StreamingHistogram(BIN_E)
+    sketches = {name: TDigest() for name in ("energy_eV", "energy_per_atom_eV", "fmax_norm_eV_per_A")}
+    ranges = EnergyForceRanges()
+    num_files = 0
+    for name in list_stats_files(stats_dir):
+        selector = make_selector(**SAMPLING).update(iter_stats(os.path.join(stats_dir, name)))
+        if selector.highest_folder() is None:
+            continue
+        records = list(selector.selected())
+        num_files += 1
+        for rec in records:
+            ranges.add_stats(rec)
+        e = np.array([r["energy"] for r in records if r["energy"] is not None], dtype=np.float64)
+        energy.add(e)
+        sketches["energy_eV"].add(e)
+        sketches["energy_per_atom_eV"].add([r["energy"] / r["natoms"] for r in records
+                                            if r["energy"] is not None and r["natoms"]])
+        sketches["fmax_norm_eV_per_A"].add([r["fmax_norm"] for r in records if r["fmax_norm"] is not None])
+
+    base_dir = os.getcwd()
+    with open_file(os.path.join(base_dir, OUT_CSV), "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(TABLE_HEADER)
+        if len(energy):
+            w.writerows(table_rows("energy_eV", energy))
+
+    ranges.print_summary()
+    print(f"Files processed: {num_files}")
+    print(f"Histogram written to: {OUT_CSV} (energy only; force histograms need the full data)")
+    write_quantiles(os.path.join(base_dir, OUT_QUANTILES_CSV), sketches, QUANTILES)
+    print(f"Quantiles written to: {OUT_QUANTILES_CSV}")
+
+def main():
+    if STATS_DIR:
+        main_from_stats(STATS_DIR)
         return
-    f_edges, f_counts = make_hist(arr, BIN_FC)
-    for i in range(len(f_counts)):
-        rows.append([label, f_edges[i], f_edges[i+1], f_counts[i]])
-
-add_force_hist("Fx_eV_per_A", Fx)
-add_force_hist("Fy_eV_per_A", Fy)
-add_force_hist("Fz_eV_per_A", Fz)
-
-# --- Write CSV ---
-with open(os.path.join(base_dir, OUT_CSV), "w", newline="") as f:
-    w = csv.writer(f)
-    w.writerow(["quantity", "bin_start", "bin_end", "count"])
-    w.writerows(rows)
-
-# --- Print summary ---
-if energies:
-    print(f"Energy range (min, max): ({min(energies):.6f}, {max(energies):.6f}) eV ; bin width={BIN_E}")
-else:
-    print("No valid energies.")
-if Fx:
-    print(f"Fx range (min, max): ({min(Fx):.6f}, {max(Fx):.6f}) eV/Å ; bin width={BIN_FC}")
-else:
-    print("No valid Fx values.")
-if Fy:
-    print(f"Fy range (min, max): ({min(Fy):.6f}, {max(Fy):.6f}) eV/Å ; bin width={BIN_FC}")
-else:
-    print("No valid Fy values.")
-if Fz:
-    print(f"Fz range (min, max): ({min(Fz):.6f}, {max(Fz):.6f}) eV/Å ; bin width={BIN_FC}")
-else:
-    print("No valid Fz values.")
-
-print(f"Files processed: {num_files}")
-print(f"Invalid/missing energies skipped: {invalid_energy}")
-print(f"Force rows with no parseable components: {invalid_force_rows}")
-print(f"Total force components parsed: {force_components_parsed}")
-print(f"Histogram written to: {OUT_CSV}")
\ No newline at end of file
+
+    # --- Collect BEFORE filtering ---
+    base_dir = os.getcwd()
+    json_dir = os.path.join(base_dir, JSON_DIR)
+
+    json_paths = [os.path.join(json_dir, name) for name in os.listdir(json_dir)
+                  if has_suffix(name, (".json", TRAJECTORY_SUFFIX))]
+    total = Partial()
+    if N_WORKERS > 1:
+        with ProcessPoolExecutor(max_workers=N_WORKERS) as ex:
+            for part in ex.map(collect_file, json_paths):
+                total.merge(part)
+    else:
+        for json_path in json_paths:
+            total.merge(collect_file(json_path))
+
+    energy = total.energy
+    Fx, Fy, Fz = total.forces
+    if not len(energy) and not (len(Fx) or len(Fy) or len(Fz)):
+        print("No energies or forces found. Nothing to do.")
+        raise SystemExit(0)
+
+    # --- Build histograms (long-form table) ---
+    rows = []  # each row: [quantity, bin_start, bin_end, count]
+    if len(energy):
+        rows += table_rows("energy_eV", energy)
+    for label, hist in (("Fx_eV_per_A", Fx), ("Fy_eV_per_A", Fy), ("Fz_eV_per_A", Fz)):
+        if len(hist):
+            rows += table_rows(label, hist)
+
+    # --- Write CSV ---
+    with open_file(os.path.join(base_dir, OUT_CSV), "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(TABLE_HEADER)
+        w.writerows(rows)
+
+    # --- Print summary ---
+    if len(energy):
+        print(f"Energy range (min, max): ({energy.min:.6f}, {energy.max:.6f}) eV ; bin width={BIN_E}")
+    else:
+        print("No valid energies.")
+    print_range("Fx", Fx, "eV/Å", BIN_FC)
+    print_range("Fy", Fy, "eV/Å", BIN_FC)
+    print_range("Fz", Fz, "eV/Å", BIN_FC)
+
+    print(f"Files processed: {total.num_files}")
+    print(f"Invalid/missing energies skipped: {total.invalid_energy}")
+    print(f"Force rows with no parseable components: {total.invalid_force_rows}")
+    print(f"Total force components parsed: {total.force_components_parsed}")
+    print(f"Histogram written to: {OUT_CSV}")
+
+    write_quantiles(os.path.join(base_dir, OUT_QUANTILES_CSV), total.sketches, QUANTILES)
+    print(f"Quantiles written to: {OUT_QUANTILES_CSV}")
+
+if __name__ == "__main__":
+    main()
@@ -15,123 +15,994 @@ file contains each intermediate step.
 import os
 import json
 import re
+import itertools
+import argparse
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from lxml import etree
 
-# Get current working directory
-base_dir = os.getcwd()
+from geoopt_pipeline.geometry import frac_to_cart, lattice_parameters
+from geoopt_pipeline.vasprun import decode_varray
+from geoopt_pipeline.fileio import COMPRESSION_SUFFIXES, compression_suffix, open_file
+from geoopt_pipeline.selection import PROVISIONAL_KEY, finalize_preselected, is_candidate_step
+from geoopt_pipeline.stepstats import append_stats, stats_path_for, step_stats, write_stats
+from geoopt_pipeline.trajectory import TRAJECTORY_SUFFIX, save_trajectory, load_steps
+from geoopt_pipeline.workers import default_workers
 
-# Output directory for intermediate data
-output_dir = os.path.join(base_dir, "all_intermediate_information")
-os.makedirs(output_dir, exist_ok=True)
+def _free_element(elem):
+    """Release a processed element and any siblings already handled before it."""
+    elem.clear()
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
 
-# Function to process a vasprun.xml file
-def process_vasprun(vasprun_path):
-    intermediate_data = []
+# Elements of vasprun.xml the step parser needs end events for
+STEP_TAGS = ("atominfo", "structure", "calculation")
+CALC_START = b"<calculation>"
+CALC_END = b"</calculation>"
+# Prepended when parsing a byte range from the middle of a vasprun.xml
+XML_DECL = b'<?xml version="1.0" encoding="ISO-8859-1"?>\n'
 
+def new_parse_state(select_every=None):
+    """
+    Header data carried between calls of _steps_from_events.
+    select_every=N decodes only the steps the every-Nth selection can keep
+    (see geoopt_pipeline.selection.is_candidate_step).
+    """
+    return {"species_list": None, "initial_matrix": None, "step_index": 0, "select_every": select_every}
+
+def _steps_from_events(events, geo_opt_folder, state):
+    """
+    Turn lxml end events for STEP_TAGS into step records, one per
+    <calculation>. `state` (see new_parse_state) keeps the species list,
+    the initial cell and the next step index, so one vasprun.xml can be
+    parsed in several pieces (follow mode).
+    With state["select_every"] set, calculations that the selection cannot
+    keep are skipped without decoding, except the last one seen, which is
+    yielded at the end marked provisional (it may be the file's last step).
+    """
+    pending = None   # (element, step index) of a skipped calculation that may be the last one
     try:
-        with open(vasprun_path, 'rb') as f:
-            parser = etree.XMLParser(recover=True)
-            tree = etree.parse(f, parser)
-            root = tree.getroot()
-
-            atom_count = int(root.findtext(".//atominfo/atoms"))
-            elements = [el.text for el in root.findall(".//atominfo/array[@name='atoms']/set/rc/c[1]")]
-            species_list = elements * (atom_count // len(elements))
-
-            cell_parameters = root.findall(".//structure/crystal/varray[@name='basis']/v")
-            cell_parameters = [list(map(float, v.text.strip().split())) for v in cell_parameters[:3]]
-
-            a = (cell_parameters[0][0]**2 + cell_parameters[0][1]**2 + cell_parameters[0][2]**2)**0.5
-            b = (cell_parameters[1][0]**2 + cell_parameters[1][1]**2 + cell_parameters[1][2]**2)**0.5
-            c = (cell_parameters[2][0]**2 + cell_parameters[2][1]**2 + cell_parameters[2][2]**2)**0.5
-            alpha, beta, gamma = 90.0, 90.0, 90.0
-            volume = abs(a * b * c)
-
-            for step_index, calculation in enumerate(root.findall(".//calculation")):
-                energy_tags = calculation.findall(".//energy")
-                if energy_tags:
-                    last_energy_tag = energy_tags[-1]
-                    energy_elem = last_energy_tag.find(".//i[@name='e_fr_energy']") or \
-                                  last_energy_tag.find(".//i[@name='e_wo_entrp']") or \
-                                  last_energy_tag.find(".//i[@name='e_0_energy']")
-                    energy = float(energy_elem.text.strip()) if energy_elem is not None else None
-                else:
-                    energy = None
-
-                forces = calculation.findall(".//varray[@name='forces']/v")
-                forces = [list(map(float, v.text.strip().split())) for v in forces]
-
-                stress_values = calculation.findall(".//varray[@name='stress']/v")
-                stress = [list(map(float, v.text.strip().split())) for v in stress_values[:3]] if len(stress_values) >= 3 else []
-
-                coordinates = calculation.findall(".//varray[@name='positions']/v")
-                coordinates = [list(map(float, v.text.strip().split())) for v in coordinates]
-
-                sites = [
-                    {
-                        "species": [{"element": species_list[idx], "occu": 1}],
-                        "abc": coord,
-                        "properties": {},
-                        "label": species_list[idx],
-                        "xyz": [
-                            coord[0] * cell_parameters[0][0] + coord[1] * cell_parameters[1][0] + coord[2] * cell_parameters[2][0],
-                            coord[0] * cell_parameters[0][1] + coord[1] * cell_parameters[1][1] + coord[2] * cell_parameters[2][1],
-                            coord[0] * cell_parameters[0][2] + coord[1] * cell_parameters[1][2] + coord[2] * cell_parameters[2][2],
-                        ]
-                    }
-                    for idx, coord in enumerate(coordinates)
-                ]
-
-                intermediate_data.append({
-                    "geo_opt_folder": os.path.basename(os.path.dirname(vasprun_path)),
-                    "step": step_index,
-                    "structure": {
-                        "@module": "pymatgen.core.structure",
-                        "@class": "Structure",
-                        "charge": 0.0,
-                        "lattice": {
-                            "matrix": cell_parameters,
-                            "pbc": [True, True, True],
-                            "a": a,
-                            "b": b,
-                            "c": c,
-                            "alpha": alpha,
-                            "beta": beta,
-                            "gamma": gamma,
-                            "volume": volume
-                        },
-                        "properties": {},
-                        "sites": sites
-                    },
-                    "forces": forces,
-                    "stress": stress,
-                    "energy": energy
-                })
+        for elem in _calculation_elements(events, state):
+            step_index = state["step_index"]
+            every = state.get("select_every")
+            if every and not is_candidate_step(step_index, every):
+                # Keep it undecoded until the next calculation shows it is not the last one
+                if pending is not None:
+                    _free_element(pending[0])
+                pending = (elem, step_index)
+                state["step_index"] += 1
+                continue
+            pending = None   # freed together with this calculation
 
+            yield _decode_calculation(elem, geo_opt_folder, state, step_index)
+            state["step_index"] += 1
     except Exception:
-        pass
+        # Keep the last step parsed before an error, as without selection
+        if pending is not None:
+            yield _decode_provisional(pending, geo_opt_folder, state)
+        raise
+    if pending is not None:
+        yield _decode_provisional(pending, geo_opt_folder, state)
+
+def _calculation_elements(events, state):
+    """Record atominfo/structure end events in `state`; yield the <calculation> elements."""
+    for _, elem in events:
+        if elem.tag == "atominfo":
+            atom_count = int(elem.findtext("atoms"))
+            elements = [el.text for el in elem.findall("array[@name='atoms']/set/rc/c[1]")]
+            state["species_list"] = elements * (atom_count // len(elements))
+            continue
+
+        if elem.tag == "structure":
+            # The first structure in the file (initialpos) is the fallback cell
+            if state["initial_matrix"] is None:
+                state["initial_matrix"] = decode_varray(elem.find("crystal/varray[@name='basis']"))[:3]
+            continue
+
+        yield elem
+
+def _decode_provisional(pending, geo_opt_folder, state):
+    elem, step_index = pending
+    step_data = _decode_calculation(elem, geo_opt_folder, state, step_index)
+    step_data[PROVISIONAL_KEY] = True
+    return step_data
+
+def _decode_calculation(calculation, geo_opt_folder, state, step_index):
+    """Step record of one <calculation> element, which is freed afterwards."""
+    species_list = state["species_list"]
+    energy_tags = calculation.findall(".//energy")
+    if energy_tags:
+        last_energy_tag = energy_tags[-1]
+        energy_elem = last_energy_tag.find(".//i[@name='e_fr_energy']") or \
+                      last_energy_tag.find(".//i[@name='e_wo_entrp']") or \
+                      last_energy_tag.find(".//i[@name='e_0_energy']")
+        energy = float(energy_elem.text.strip()) if energy_elem is not None else None
+    else:
+        energy = None
+
+    # Each varray is decoded with one bulk NumPy parse
+    forces = decode_varray(calculation.find(".//varray[@name='forces']"))
+
+    stress = decode_varray(calculation.find(".//varray[@name='stress']"))
+    stress = stress[:3] if len(stress) >= 3 else stress[:0]
+
+    coordinates = decode_varray(calculation.find(".//varray[@name='positions']"))
+
+    matrix = decode_varray(calculation.find("structure/crystal/varray[@name='basis']"))
+    if len(matrix) >= 3:
+        matrix = matrix[:3]
+    else:
+        matrix = state["initial_matrix"]
+
+    _free_element(calculation)
+
+    (a, b, c), (alpha, beta, gamma), volume = (x.tolist() for x in lattice_parameters(matrix))
+    xyz = frac_to_cart(coordinates, matrix).tolist()
+    coordinates = coordinates.tolist()
+
+    sites = [
+        {
+            "species": [{"element": species_list[idx], "occu": 1}],
+            "abc": coord,
+            "properties": {},
+            "label": species_list[idx],
+            "xyz": xyz[idx]
+        }
+        for idx, coord in enumerate(coordinates)
+    ]
+
+    return {
+        "geo_opt_folder": geo_opt_folder,
+        "step": step_index,
+        "structure": {
+            "@module": "pymatgen.core.structure",
+            "@class": "Structure",
+            "charge": 0.0,
+            "lattice": {
+                "matrix": matrix.tolist(),
+                "pbc": [True, True, True],
+                "a": a,
+                "b": b,
+                "c": c,
+                "alpha": alpha,
+                "beta": beta,
+                "gamma": gamma,
+                "volume": volume
+            },
+            "properties": {},
+            "sites": sites
+        },
+        "forces": forces.tolist(),
+        "stress": stress.tolist(),
+        "energy": energy
+    }
+
+# Generator over the ionic steps of a vasprun.xml file
+def iter_vasprun_steps(vasprun_path, select_every=None):
+    """
+    Stream a vasprun.xml with lxml.etree.iterparse and yield one step
+    record per <calculation> as soon as that element is closed.
+    Each step uses the lattice of its own <structure> (falling back to
+    the initial cell when a calculation has none); Cartesian coordinates,
+    lattice lengths/angles and volume are computed with NumPy.
+    Each processed <calculation> is freed right away, so peak memory
+    does not grow with the number of ionic steps.
+    select_every=N yields only the candidate steps of the every-Nth
+    selection plus a provisional last step (see _steps_from_events).
+    Parse errors propagate to the caller.
+    """
+    geo_opt_folder = os.path.basename(os.path.dirname(vasprun_path))
+    state = new_parse_state(select_every)
+
+    with open_file(vasprun_path, 'rb') as f:
+        context = etree.iterparse(f, events=("end",), tag=STEP_TAGS, recover=True)
+        yield from _steps_from_events(context, geo_opt_folder, state)
+
+def _extract_vasprun(vasprun_path, select_every=None):
+    """
+    Parse one vasprun.xml and return (vasprun_path, steps, error).
+    Steps parsed before a failure are kept; error is None on success.
+    """
+    steps = []
+    try:
+        for step_data in iter_vasprun_steps(vasprun_path, select_every):
+            steps.append(step_data)
+    except Exception as exc:
+        return vasprun_path, steps, f"{type(exc).__name__}: {exc}"
+    return vasprun_path, steps, None
+
+# Function to process a vasprun.xml file
+def process_vasprun(vasprun_path):
+    return _extract_vasprun(vasprun_path)[1]
 
-    return intermediate_data
+def _format_step(step_data):
+    """One list item exactly as json.dump(list, f, indent=4) lays it out."""
+    return "    " + json.dumps(step_data, indent=4).replace("\n", "\n    ")
+
+def write_steps_json(output_json_path, steps):
+    """
+    Write step records as a JSON list, one record at a time.
+    The output is byte-identical to json.dump(list(steps), f, indent=4);
+    nothing is written when there are no steps. Returns the step count.
+    Data goes to a temporary file that replaces output_json_path only
+    once complete, so an interrupted run never leaves a truncated JSON.
+    A .gz/.xz/.bz2/.zst output path is compressed on the fly.
+    """
+    count = 0
+    json_file = None
+    tmp_path = output_json_path + ".tmp"
+    try:
+        for step_data in steps:
+            if json_file is None:
+                json_file = open_file(tmp_path, 'w', compression=compression_suffix(output_json_path))
+                json_file.write("[\n")
+            else:
+                json_file.write(",\n")
+            json_file.write(_format_step(step_data))
+            count += 1
+        if json_file is not None:
+            json_file.write("\n]")
+            json_file.close()
+            os.replace(tmp_path, output_json_path)
+    finally:
+        if json_file is not None and not json_file.closed:
+            json_file.close()
+            os.remove(tmp_path)
+    return count
+
+def append_steps_json(output_json_path, steps):
+    """
+    Append step records to a JSON list written by write_steps_json (or
+    create it). Only the closing bracket is rewritten, so the cost does
+    not depend on the size of the existing file. Returns the step count.
+    """
+    steps = list(steps)
+    if not steps:
+        return 0
+    body = ",\n".join(_format_step(step_data) for step_data in steps) + "\n]"
+    if not os.path.isfile(output_json_path) or os.path.getsize(output_json_path) == 0:
+        with open(output_json_path, 'w') as json_file:
+            json_file.write("[\n" + body)
+        return len(steps)
+    with open(output_json_path, 'r+b') as json_file:
+        json_file.seek(-2, os.SEEK_END)
+        if json_file.read(2) != b"\n]":
+            raise ValueError(f"{output_json_path} does not end like a JSON list written by this script")
+        json_file.seek(-2, os.SEEK_END)
+        json_file.write((",\n" + body).encode())
+    return len(steps)
 
 # Regex pattern to match folders starting with numbers
 folder_pattern = re.compile(r'^\d+')
 
-# List all folders in the current directory that start with numbers
-folders_to_process = [f for f in os.listdir(base_dir) if os.path.isdir(f) and folder_pattern.match(f)]
+def find_structure_folders(base_dir):
+    """List all folders in base_dir that start with numbers."""
+    return [f for f in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, f)) and folder_pattern.match(f)]
 
-for folder in folders_to_process:
-    folder_path = os.path.join(base_dir, folder)
+# vasprun.xml may also be archived compressed (vasprun.xml.gz, .xz, ...)
+VASPRUN_NAMES = ("vasprun.xml",) + tuple("vasprun.xml" + suffix for suffix in COMPRESSION_SUFFIXES)
+
+def find_vasprun_files(folder_path):
+    """vasprun.xml paths of the geo_opt* subfolders of one structure folder."""
     geo_opt_folders = [d for d in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, d)) and re.match(r'geo_opt(_\d+)?$', d)]
 
-    combined_data = []
+    vasprun_paths = []
     for geo_opt_folder in geo_opt_folders:
         geo_opt_path = os.path.join(folder_path, geo_opt_folder)
-        vasprun_path = os.path.join(geo_opt_path, "vasprun.xml")
+        for name in VASPRUN_NAMES:
+            vasprun_path = os.path.join(geo_opt_path, name)
+            if os.path.isfile(vasprun_path):
+                vasprun_paths.append(vasprun_path)
+                break
+    return vasprun_paths
 
-        if os.path.isfile(vasprun_path):
-            combined_data.extend(process_vasprun(vasprun_path))
+# ---- Manifest of processed vasprun files (incremental reruns) ----
+MANIFEST_NAME = "extraction_manifest.json"
+MANIFEST_SAVE_INTERVAL = 30.0   # seconds between manifest checkpoints
 
-    if combined_data:
-        output_json_path = os.path.join(output_dir, f"{folder}_intermediate_data.json")
-        with open(output_json_path, 'w') as json_file:
-            json.dump(combined_data, json_file, indent=4)
\ No newline at end of file
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_manifest(output_dir):
+    """
+    Manifest layout:
+      {"version": 1,
+       "files": {"<folder>/<geo_opt>/vasprun.xml": {"folder", "size", "mtime_ns",
+                 ["sha256"], "output", "steps", "error"}, ...}}
+    Paths are relative to the working directory.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if isinstance(manifest, dict) and isinstance(manifest.get("files"), dict):
+            return manifest
+        print(f"[WARN] Ignoring malformed manifest: {manifest_path}")
+    except FileNotFoundError:
+        pass
+    except json.JSONDecodeError:
+        print(f"[WARN] Ignoring unreadable manifest: {manifest_path}")
+    return {"version": 1, "files": {}}
+
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def file_signature(vasprun_path, use_hash, previous=None):
+    """Size and mtime of a vasprun file, plus its sha256 when use_hash is set."""
+    st = os.stat(vasprun_path)
+    sig = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if use_hash:
+        if previous and "sha256" in previous and \
+                previous.get("size") == sig["size"] and previous.get("mtime_ns") == sig["mtime_ns"]:
+            sig["sha256"] = previous["sha256"]
+        else:
+            sig["sha256"] = file_sha256(vasprun_path)
+    return sig
+
+def is_unchanged(sig, previous):
+    if previous is None or previous.get("error") is not None:
+        return False
+    if sig["size"] != previous.get("size"):
+        return False
+    if "sha256" in sig and "sha256" in previous:
+        return sig["sha256"] == previous["sha256"]
+    return sig["mtime_ns"] == previous.get("mtime_ns")
+
+def plan_folders(folders, base_dir, output_dir, manifest, use_hash=False, force=False,
+                 output_format="json", compress=None, select_every=None):
+    """
+    Compare each structure folder against the manifest.
+    Returns (plans, n_up_to_date). A plan is a dict with the folder name,
+    its vasprun paths (listing order), their signatures and the set of
+    paths that must be (re)parsed; up-to-date folders get no plan.
+    compress ('gz', 'xz', 'bz2', 'zst' or None) compresses JSON outputs;
+    for npz outputs any value selects np.savez_compressed.
+    select_every=N keeps only the every-Nth step selection; a file
+    extracted with another setting counts as changed.
+    """
+    previous_by_folder = {}
+    for key, entry in manifest["files"].items():
+        previous_by_folder.setdefault(entry.get("folder"), {})[key] = entry
+
+    plans = []
+    n_up_to_date = 0
+    for folder in folders:
+        vasprun_paths = find_vasprun_files(os.path.join(base_dir, folder))
+        previous = previous_by_folder.get(folder, {})
+        output_path = os.path.join(output_dir, f"{folder}_intermediate_data.{output_format}")
+        if compress and output_format == "json":
+            output_path += "." + compress
+        output_name = os.path.basename(output_path)
+        has_output = os.path.isfile(output_path)
+
+        signatures = {}
+        fresh = set()
+        for p in vasprun_paths:
+            key = os.path.relpath(p, base_dir)
+            sig = file_signature(p, use_hash, previous.get(key))
+            signatures[p] = sig
+            prev = previous.get(key)
+            if force or not is_unchanged(sig, prev) or prev.get("select_every") != select_every or \
+                    (prev.get("output") and (prev["output"] != output_name or not has_output)):
+                fresh.add(p)
+        if select_every and fresh:
+            # The selection of a folder depends on all of its files (highest geo_opt folder),
+            # and the previous output only holds the final selection
+            fresh = set(vasprun_paths)
+
+        current_keys = {os.path.relpath(p, base_dir) for p in vasprun_paths}
+        if not fresh and current_keys == set(previous):
+            # Refresh signatures in place, e.g. to record hashes on a first --hash run
+            for p in vasprun_paths:
+                previous[os.path.relpath(p, base_dir)].update(signatures[p])
+            n_up_to_date += 1
+            continue
+
+        plans.append({
+            "folder": folder,
+            "vasprun_paths": vasprun_paths,
+            "signatures": signatures,
+            "fresh": fresh,
+            "output_path": output_path,
+            "compress": bool(compress),
+            "select_every": select_every,
+        })
+    return plans, n_up_to_date
+
+def _load_previous_steps(output_path):
+    """Group the steps of an existing per-structure output by geo_opt_folder (None if unreadable)."""
+    try:
+        data = load_steps(output_path)
+    except Exception:
+        return None
+    if data is None:
+        return None
+    groups = {}
+    for step_data in data:
+        groups.setdefault(step_data.get("geo_opt_folder"), []).append(step_data)
+    return groups
+
+def folder_steps(plan, parsed, failures, counts):
+    """
+    Yield one folder's steps in geo_opt listing order. Files in
+    plan["fresh"] come from `parsed` (pool results) or are parsed here;
+    unchanged files are reused from the existing output when possible.
+    """
+    previous = None
+    if set(plan["vasprun_paths"]) - plan["fresh"]:
+        previous = _load_previous_steps(plan["output_path"])
+
+    for p in plan["vasprun_paths"]:
+        geo_opt_folder = os.path.basename(os.path.dirname(p))
+        if p in parsed:
+            steps, error = parsed[p]
+            if error is not None:
+                failures.append((p, error))
+        elif p not in plan["fresh"] and previous is not None and geo_opt_folder in previous:
+            steps = previous[geo_opt_folder]
+        else:
+            # Stream straight from the parser (serial mode or unreadable previous JSON)
+            counts[p] = 0
+            try:
+                for step_data in iter_vasprun_steps(p, plan["select_every"]):
+                    counts[p] += 1
+                    yield step_data
+            except Exception as exc:
+                failures.append((p, f"{type(exc).__name__}: {exc}"))
+            continue
+        counts[p] = len(steps)
+        yield from steps
+
+def write_folder(plan, parsed, base_dir, manifest):
+    """Write a folder's output file, update its manifest entries and print its summary."""
+    failures = []
+    counts = {}
+    output_path = plan["output_path"]
+    steps = folder_steps(plan, parsed, failures, counts)
+    every = plan["select_every"]
+    if every:
+        # Apply the rest of the selection rules, which need the whole folder
+        groups = {}
+        for step_data in steps:
+            groups.setdefault(step_data["geo_opt_folder"], []).append(step_data)
+        steps = finalize_preselected(groups, every)
+        path_of = {os.path.basename(os.path.dirname(p)): p for p in plan["vasprun_paths"]}
+        counts = dict.fromkeys(counts, 0)
+        for step_data in steps:
+            counts[path_of[step_data["geo_opt_folder"]]] += 1
+    # Per-step statistics sidecar, filled as the steps go by
+    stats_rows = []
+    steps = _collect_stats(steps, stats_rows)
+    if output_path.endswith(TRAJECTORY_SUFFIX):
+        n_steps = save_trajectory(output_path, steps, compress=plan["compress"])
+    else:
+        n_steps = write_steps_json(output_path, steps)
+    stats_path = stats_path_for(output_path)
+    if n_steps:
+        write_stats(stats_path, stats_rows)
+    else:
+        # stale output from files that no longer yield steps
+        for path in (output_path, stats_path):
+            if os.path.isfile(path):
+                os.remove(path)
+    # Only one output format per structure, otherwise the combine step would read it twice
+    stem = os.path.join(os.path.dirname(output_path), f"{plan['folder']}_intermediate_data")
+    others = [stem + ".json" + suffix for suffix in ("",) + COMPRESSION_SUFFIXES] + [stem + TRAJECTORY_SUFFIX]
+    for other in others:
+        if other != output_path and os.path.isfile(other):
+            os.remove(other)
+
+    errors = dict(failures)
+    folder = plan["folder"]
+    for key in [k for k, e in manifest["files"].items() if e.get("folder") == folder]:
+        del manifest["files"][key]
+    for p in plan["vasprun_paths"]:
+        entry = manifest["files"][os.path.relpath(p, base_dir)] = {
+            **plan["signatures"][p],
+            "folder": folder,
+            "output": os.path.basename(output_path) if n_steps else None,
+            "steps": counts.get(p, 0),
+            "error": errors.get(p),
+        }
+        if every:
+            entry["select_every"] = every
+
+    n_parsed = len(plan["fresh"])
+    report_folder(folder, len(plan["vasprun_paths"]), n_parsed, n_steps, failures)
+    return folder, failures
+
+def _collect_stats(steps, stats_rows):
+    for step_data in steps:
+        stats_rows.append(step_stats(step_data))
+        yield step_data
+
+def report_folder(folder, n_files, n_parsed, n_steps, failures):
+    """Print a one-line summary for a structure folder plus any failed vasprun files."""
+    status = "OK" if not failures else "FAIL"
+    print(f"[{status}] {folder}: files={n_files}, parsed={n_parsed}, failed={len(failures)}, steps={n_steps}")
+    for vasprun_path, error in failures:
+        print(f"    {os.path.relpath(vasprun_path)}: {error}")
+
+class _Checkpointer:
+    """Save the manifest at most every MANIFEST_SAVE_INTERVAL seconds."""
+    def __init__(self, output_dir, manifest):
+        self.output_dir = output_dir
+        self.manifest = manifest
+        self.last = time.monotonic()
+
+    def __call__(self, force=False):
+        now = time.monotonic()
+        if force or now - self.last >= MANIFEST_SAVE_INTERVAL:
+            save_manifest(self.output_dir, self.manifest)
+            self.last = now
+
+def run_serial(plans, base_dir, manifest, checkpoint):
+    """Stream each folder's steps straight from the parser into its JSON file."""
+    summary = []
+    for plan in plans:
+        summary.append(write_folder(plan, {}, base_dir, manifest))
+        checkpoint()
+    return summary
+
+# ---- Parallel parsing inside one large vasprun.xml ----
+SPLIT_BLOCK_SIZE = 16 << 20     # bytes read per block while scanning / feeding chunks
+MIN_CHUNK_BYTES = 32 << 20      # do not cut a file into chunks smaller than this
+
+def scan_calculation_bounds(vasprun_path, block_size=SPLIT_BLOCK_SIZE):
+    """
+    One sequential pass over an uncompressed vasprun.xml. Returns
+    (starts, ends): byte offsets of every '<calculation>' tag and of the
+    end of every '</calculation>' tag, in file order.
+    """
+    starts, ends = [], []
+    keep = max(len(CALC_START), len(CALC_END)) - 1
+    base = 0        # file offset of buf[0]
+    kept = 0        # bytes of buf carried over from the previous block
+    buf = b""
+    with open(vasprun_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            buf += block
+            for tag, out, shift in ((CALC_START, starts, 0), (CALC_END, ends, len(CALC_END))):
+                i = buf.find(tag)
+                while i >= 0:
+                    if i + len(tag) > kept:     # not already found in the previous block
+                        out.append(base + i + shift)
+                    i = buf.find(tag, i + 1)
+            kept = min(len(buf), keep)
+            base += len(buf) - kept
+            buf = buf[len(buf) - kept:]
+    return starts, ends
+
+def _feed_range(parser, vasprun_path, start, end, block_size=SPLIT_BLOCK_SIZE):
+    """Feed bytes [start, end) of a file to an XMLPullParser block by block, yielding its events."""
+    with open(vasprun_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            parser.feed(block)
+            yield from parser.read_events()
+
+def read_vasprun_header(vasprun_path, header_end, select_every=None):
+    """Parse everything before the first <calculation> (atominfo, initial cell) into a parse state."""
+    state = new_parse_state(select_every)
+    parser = etree.XMLPullParser(events=("end",), tag=STEP_TAGS, recover=True)
+    for _ in _steps_from_events(_feed_range(parser, vasprun_path, 0, header_end), None, state):
+        pass
+    return state
+
+def _extract_calculation_range(vasprun_path, chunk_idx, state, start, end):
+    """
+    Worker: parse the calculations in bytes [start, end) of vasprun_path,
+    with the header state (species, initial cell, first step index) of
+    the whole file. Returns (vasprun_path, chunk_idx, steps, error).
+    """
+    geo_opt_folder = os.path.basename(os.path.dirname(vasprun_path))
+    steps = []
+    try:
+        parser = etree.XMLPullParser(events=("end",), tag=STEP_TAGS, recover=True)
+        parser.feed(XML_DECL + b"<modeling>")
+        events = itertools.chain(_feed_range(parser, vasprun_path, start, end), _close_events(parser))
+        for step_data in _steps_from_events(events, geo_opt_folder, dict(state)):
+            steps.append(step_data)
+    except Exception as exc:
+        return vasprun_path, chunk_idx, steps, f"{type(exc).__name__}: {exc}"
+    return vasprun_path, chunk_idx, steps, None
+
+def _close_events(parser):
+    """Close the wrapper root (recovering a truncated last calculation) and yield the remaining events."""
+    parser.feed(b"</modeling>")
+    parser.close()
+    yield from parser.read_events()
+
+def plan_file_chunks(vasprun_path, n_workers, min_chunk_bytes=MIN_CHUNK_BYTES, select_every=None):
+    """
+    Cut a large vasprun.xml into at most n_workers byte ranges of whole
+    <calculation> blocks, balanced by size. Returns a list of
+    (state, start, end) tasks for _extract_calculation_range, or None when
+    the file is not worth splitting.
+    """
+    size = os.path.getsize(vasprun_path)
+    n_chunks = min(n_workers, size // min_chunk_bytes)
+    if n_chunks < 2:
+        return None
+    starts, ends = scan_calculation_bounds(vasprun_path)
+    n_complete = len(ends)
+    if n_complete < 2 or len(starts) < n_complete:
+        return None
+
+    header = read_vasprun_header(vasprun_path, starts[0], select_every)
+    n_chunks = min(n_chunks, n_complete)
+    target = (ends[-1] - starts[0]) / n_chunks
+    tasks = []
+    first = 0
+    for i in range(n_complete):
+        last_chunk = len(tasks) == n_chunks - 1
+        if i == n_complete - 1 or (not last_chunk and ends[i] - starts[first] >= target):
+            tasks.append((dict(header, step_index=first), starts[first], ends[i]))
+            first = i + 1
+    if len(starts) > n_complete:
+        # A truncated last calculation: parse it (with recovery) like the serial parser does
+        tasks.append((dict(header, step_index=n_complete), starts[n_complete], size))
+    return tasks
+
+def run_parallel(plans, base_dir, manifest, checkpoint, n_workers, split_bytes=None):
+    """
+    Spread the vasprun.xml files that need parsing across a process pool.
+    Uncompressed files of at least split_bytes are additionally cut into
+    ranges of <calculation> blocks that are parsed by several workers and
+    put back in step order. A folder's JSON is written as soon as its
+    last file comes back.
+    """
+    summary = []
+    pending = {}   # folder -> {vasprun_path: (steps, error)}
+    owner = {}     # vasprun_path -> plan
+    chunks = {}    # vasprun_path -> [(steps, error) or None per chunk]
+
+    def file_done(vasprun_path, steps, error):
+        plan = owner[vasprun_path]
+        parsed = pending[plan["folder"]]
+        parsed[vasprun_path] = (steps, error)
+        if len(parsed) < len(plan["fresh"]):
+            return
+        del pending[plan["folder"]]
+        summary.append(write_folder(plan, parsed, base_dir, manifest))
+        checkpoint()
+
+    with ProcessPoolExecutor(max_workers=n_workers) as ex:
+        futures = []
+        for plan in plans:
+            if not plan["fresh"]:
+                summary.append(write_folder(plan, {}, base_dir, manifest))
+                continue
+            pending[plan["folder"]] = {}
+            for p in plan["vasprun_paths"]:
+                if p not in plan["fresh"]:
+                    continue
+                owner[p] = plan
+                tasks = None
+                if split_bytes and not compression_suffix(p) and os.path.getsize(p) >= split_bytes:
+                    try:
+                        tasks = plan_file_chunks(p, n_workers, select_every=plan["select_every"])
+                    except Exception as exc:
+                        print(f"[WARN] Could not split {os.path.relpath(p)} ({exc}); parsing it in one piece")
+                if tasks:
+                    chunks[p] = [None] * len(tasks)
+                    for idx, (state, start, end) in enumerate(tasks):
+                        futures.append(ex.submit(_extract_calculation_range, p, idx, state, start, end))
+                else:
+                    futures.append(ex.submit(_extract_vasprun, p, plan["select_every"]))
+
+        for fut in as_completed(futures):
+            result = fut.result()
+            if len(result) == 3:
+                file_done(*result)
+                continue
+
+            vasprun_path, chunk_idx, steps, error = result
+            parts = chunks[vasprun_path]
+            parts[chunk_idx] = (steps, error)
+            if any(part is None for part in parts):
+                continue
+            del chunks[vasprun_path]
+            # Reassemble in step order; stop at the first failed chunk like a serial parse would
+            all_steps, first_error = [], None
+            for steps, error in parts:
+                all_steps.extend(steps)
+                if error is not None:
+                    first_error = error
+                    break
+            file_done(vasprun_path, all_steps, first_error)
+    return summary
+
+# ---- Live follow mode for running geo-opt jobs ----
+FOLLOW_STATE_NAME = "follow_state.json"
+FOLLOW_BLOCK_SIZE = 16 << 20    # bytes read per block while scanning for </calculation>
+
+def load_follow_state(output_dir):
+    """
+    Follow state layout:
+      {"version": 1,
+       "folders": {"<folder>": {"output_size", "output_mtime_ns",
+                   "files": {"<folder>/<geo_opt>/vasprun.xml": {"offset", "size", "mtime_ns",
+                             "ino", "species_list", "initial_matrix", "step_index"}},
+                   "skipped": ["<folder>/<geo_opt>/vasprun.xml.gz", ...]}}}
+    "offset" is the byte position right after the last complete </calculation>;
+    "skipped" lists the compressed vasprun files already warned about.
+    """
+    state_path = os.path.join(output_dir, FOLLOW_STATE_NAME)
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+        if isinstance(state, dict) and isinstance(state.get("folders"), dict):
+            return state
+        print(f"[WARN] Ignoring malformed follow state: {state_path}")
+    except FileNotFoundError:
+        pass
+    except json.JSONDecodeError:
+        print(f"[WARN] Ignoring unreadable follow state: {state_path}")
+    return {"version": 1, "folders": {}}
+
+def save_follow_state(output_dir, state):
+    state_path = os.path.join(output_dir, FOLLOW_STATE_NAME)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+def read_new_steps(vasprun_path, entry, emit, block_size=FOLLOW_BLOCK_SIZE):
+    """
+    Parse only the <calculation> blocks completed since entry["offset"]
+    and pass their step records to emit(steps), one batch per block read.
+    entry (offset and parse state) advances only after emit() returns, so
+    a failure never duplicates or skips steps. Bytes after the last
+    complete </calculation> (a calculation still running, or the closing
+    tags of a finished file) are left for the next poll.
+    Only a plain vasprun.xml can be followed: seeking in a compressed
+    one decompresses it again from the start.
+    Returns the number of steps emitted.
+    """
+    geo_opt_folder = os.path.basename(os.path.dirname(vasprun_path))
+    parse_state = {
+        "species_list": entry.get("species_list"),
+        "initial_matrix": None if entry.get("initial_matrix") is None else np.asarray(entry["initial_matrix"]),
+        "step_index": entry.get("step_index", 0),
+    }
+    parser = etree.XMLPullParser(events=("end",), tag=STEP_TAGS, recover=True)
+    if entry["offset"] > 0:
+        # Resume inside the document: give the new calculations a root element
+        parser.feed(XML_DECL + b"<modeling>")
+
+    n_steps = 0
+    with open(vasprun_path, 'rb') as f:
+        f.seek(entry["offset"])
+        carry = b""
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            buf = carry + block
+            end = buf.rfind(CALC_END)
+            if end < 0:
+                carry = buf
+                continue
+            end += len(CALC_END)
+            carry = buf[end:]
+            parser.feed(buf[:end])
+
+            pending = dict(parse_state)
+            steps = list(_steps_from_events(parser.read_events(), geo_opt_folder, pending))
+            emit(steps)
+            n_steps += len(steps)
+            parse_state = pending
+            entry["offset"] += end
+            entry["species_list"] = parse_state["species_list"]
+            if parse_state["initial_matrix"] is not None:
+                entry["initial_matrix"] = np.asarray(parse_state["initial_matrix"]).tolist()
+            entry["step_index"] = parse_state["step_index"]
+    return n_steps
+
+def poll_folder(folder, base_dir, output_dir, state):
+    """
+    Append the steps completed since the last poll for one structure
+    folder. Returns (n_new_steps, failures). The folder's JSON is rebuilt
+    from scratch when it is new to the follow state, when a vasprun.xml
+    was replaced/truncated, or when the JSON was rewritten by a normal run.
+    Compressed vasprun files (finished, archived jobs) are not followed;
+    each is reported once.
+    """
+    output_json_path = os.path.join(output_dir, f"{folder}_intermediate_data.json")
+    stats_path = stats_path_for(output_json_path)
+    vasprun_paths = find_vasprun_files(os.path.join(base_dir, folder))
+    compressed = [p for p in vasprun_paths if compression_suffix(p)]
+    vasprun_paths = [p for p in vasprun_paths if not compression_suffix(p)]
+    fstate = state["folders"].get(folder)
+
+    stats = {}
+    for p in vasprun_paths:
+        st = os.stat(p)
+        stats[p] = st
+    rebuild = fstate is None
+    if not rebuild:
+        if os.path.isfile(output_json_path):
+            ost = os.stat(output_json_path)
+            rebuild = (ost.st_size, ost.st_mtime_ns) != (fstate.get("output_size"), fstate.get("output_mtime_ns"))
+        else:
+            rebuild = fstate.get("output_size") is not None
+        for p, st in stats.items():
+            entry = fstate["files"].get(os.path.relpath(p, base_dir))
+            if entry and (st.st_ino != entry["ino"] or st.st_size < entry["size"]):
+                rebuild = True
+    if rebuild:
+        for path in (output_json_path, stats_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        fstate = {"output_size": None, "output_mtime_ns": None, "files": {}}
+        state["folders"][folder] = fstate
+
+    skipped = fstate.setdefault("skipped", [])
+    for p in compressed:
+        key = os.path.relpath(p, base_dir)
+        if key not in skipped:
+            skipped.append(key)
+            print(f"[WARN] Not following compressed {key}; extract it without --follow.")
+
+    def emit(steps):
+        append_steps_json(output_json_path, steps)
+        append_stats(stats_path, map(step_stats, steps))
+
+    n_new = 0
+    failures = []
+    for p in vasprun_paths:
+        st = stats[p]
+        key = os.path.relpath(p, base_dir)
+        entry = fstate["files"].get(key)
+        if entry is None:
+            entry = {"offset": 0, "size": -1, "mtime_ns": -1, "ino": st.st_ino, "step_index": 0}
+            fstate["files"][key] = entry
+        if st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime_ns"]:
+            continue   # nothing written since the last poll
+        try:
+            n_new += read_new_steps(p, entry, emit)
+        except Exception as exc:
+            failures.append((p, f"{type(exc).__name__}: {exc}"))
+            continue
+        entry["size"], entry["mtime_ns"], entry["ino"] = st.st_size, st.st_mtime_ns, st.st_ino
+
+    if os.path.isfile(output_json_path):
+        ost = os.stat(output_json_path)
+        fstate["output_size"], fstate["output_mtime_ns"] = ost.st_size, ost.st_mtime_ns
+    return n_new, failures
+
+def follow(base_dir, output_dir, interval, max_polls=0):
+    """
+    Poll all structure folders every `interval` seconds and append the
+    newly completed ionic steps of running jobs. Stops after max_polls
+    polls (0 = until interrupted).
+    """
+    state = load_follow_state(output_dir)
+    n_polls = 0
+    try:
+        while True:
+            n_polls += 1
+            t0 = time.monotonic()
+            present = set(find_structure_folders(base_dir))
+            for folder in [f for f in state["folders"] if f not in present]:
+                del state["folders"][folder]
+
+            total_new = 0
+            for folder in sorted(present):
+                n_new, failures = poll_folder(folder, base_dir, output_dir, state)
+                total_new += n_new
+                if n_new or failures:
+                    status = "OK" if not failures else "FAIL"
+                    print(f"[{status}] {folder}: new steps={n_new}")
+                    for vasprun_path, error in failures:
+                        print(f"    {os.path.relpath(vasprun_path, base_dir)}: {error}")
+            save_follow_state(output_dir, state)
+            print(f"[POLL {n_polls}] new steps: {total_new}  | folders: {len(present)}  | {time.monotonic() - t0:.2f} s", flush=True)
+
+            if max_polls and n_polls >= max_polls:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        save_follow_state(output_dir, state)
+        print("[INFO] Follow mode stopped; state saved.")
+
+def main():
+    ap = argparse.ArgumentParser(description="Extract all intermediate geo-opt steps from vasprun.xml files into per-structure JSON.")
+    ap.add_argument("--workers", type=int, nargs="?", const=0, default=1,
+                    help="Number of worker processes (default: 1, serial). "
+                         "'--workers' alone or 0 uses SLURM_CPUS_PER_TASK/SLURM_CPUS_ON_NODE, else all local cores.")
+    ap.add_argument("--hash", action="store_true",
+                    help=f"Record a sha256 of each vasprun.xml in {MANIFEST_NAME} and use it to detect changes "
+                         "(files whose mtime changed but content did not are skipped).")
+    ap.add_argument("--full", action="store_true",
+                    help="Ignore the manifest and re-extract every vasprun.xml.")
+    ap.add_argument("--format", choices=("json", "npz"), default="json",
+                    help="Per-structure output: indent=4 JSON (default) or a compact NumPy .npz trajectory "
+                         "(see geoopt_pipeline/trajectory.py).")
+    ap.add_argument("--compress", choices=("gz", "xz", "bz2", "zst"), default=None,
+                    help="Compress the JSON outputs (<folder>_intermediate_data.json.<ext>); gz/zst use "
+                         "multithreaded compression. With --format npz, writes compressed .npz files.")
+    ap.add_argument("--split-mb", type=float, default=512.0,
+                    help="With --workers > 1, vasprun.xml files of at least this size (MB, uncompressed) are "
+                         "split into ranges of <calculation> blocks parsed in parallel (default: 512; 0 disables).")
+    ap.add_argument("--follow", action="store_true",
+                    help="Keep polling running jobs and append each newly completed ionic step to the "
+                         f"per-structure JSON (state kept in {FOLLOW_STATE_NAME}). Only plain vasprun.xml "
+                         "files are followed; compressed ones are skipped with a warning.")
+    ap.add_argument("--interval", type=float, default=60.0,
+                    help="Seconds between polls in --follow mode (default: 60).")
+    ap.add_argument("--max-polls", type=int, default=0,
+                    help="Stop --follow mode after this many polls (default: 0, run until interrupted).")
+    ap.add_argument("--select-every", type=int, default=0, metavar="N",
+                    help="Only decode and write the steps the combine selection keeps (every Nth step, plus "
+                         "the last step of the highest geo_opt folder); other calculations are skipped "
+                         "without decoding (default: 0, all steps).")
+    args = ap.parse_args()
+    if args.select_every and args.follow:
+        ap.error("--select-every needs whole vasprun.xml files; it cannot be combined with --follow.")
+    if args.select_every < 0:
+        ap.error("--select-every must be >= 0.")
+    if args.follow and (args.format != "json" or args.compress):
+        ap.error("--follow appends to plain JSON outputs; it cannot be combined with --format npz or --compress.")
+
+    # Get current working directory
+    base_dir = os.getcwd()
+
+    # Output directory for intermediate data
+    output_dir = os.path.join(base_dir, "all_intermediate_information")
+    os.makedirs(output_dir, exist_ok=True)
+
+    if args.follow:
+        follow(base_dir, output_dir, args.interval, args.max_polls)
+        return
+
+    manifest = load_manifest(output_dir)
+    folders = find_structure_folders(base_dir)
+    plans, n_up_to_date = plan_folders(folders, base_dir, output_dir, manifest,
+                                       use_hash=args.hash, force=args.full,
+                                       output_format=args.format, compress=args.compress,
+                                       select_every=args.select_every or None)
+
+    # Forget structure folders that disappeared since the last run
+    present = set(folders)
+    for key in [k for k, e in manifest["files"].items() if e.get("folder") not in present]:
+        del manifest["files"][key]
+
+    n_workers = args.workers if args.workers > 0 else default_workers()
+    checkpoint = _Checkpointer(output_dir, manifest)
+    try:
+        if n_workers > 1:
+            split_bytes = int(args.split_mb * (1 << 20)) if args.split_mb > 0 else None
+            summary = run_parallel(plans, base_dir, manifest, checkpoint, n_workers, split_bytes)
+        else:
+            summary = run_serial(plans, base_dir, manifest, checkpoint)
+    finally:
+        checkpoint(force=True)
+
+    n_failed = sum(1 for _, failures in summary if failures)
+    print(f"[INFO] Folders extracted: {len(summary)}  | up to date: {n_up_to_date}  | with failures: {n_failed}  | workers: {n_workers}")
+    print(f"[INFO] Manifest -> {os.path.join(output_dir, MANIFEST_NAME)}")
+
+if __name__ == "__main__":
+    main()
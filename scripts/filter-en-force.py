@@ -5,98 +5,87 @@ Force values that we decided from the previous code
 "energy_force_component_distribution_before_filter.py"
 
 We can plot the energy and force distributions. 
-"""
-
-#!/usr/bin/env python3
-import csv, os, sys, json
 
-# === Config ===
-IN_CSV  = "consolidated_data_10th_step.csv"   # or pass as first CLI arg
-EMIN    = -1050.0
-EMAX    = -500.0
-FMIN    = -100.0
-FMAX    =  100.0
+Sweep mode evaluates a grid of windows in one pass and prints the
+kept/dropped counts of each; no filtered file is written unless --write
+is given (then for the --emin/--emax/--fmin/--fmax window):
 
-if len(sys.argv) > 1:
-    IN_CSV = sys.argv[1]
+python filter-en-force.py consolidated_data_10th_step.csv --sweep \
+        --emin-grid=-1100,-1050,-1000 --emax-grid=-550,-500 \
+        --fmin-grid=-100,-50 --fmax-grid=50,100
 
-base, ext = os.path.splitext(IN_CSV)
-OUT_CSV = f"{base}_filtered_E{int(EMIN)}_to_{int(EMAX)}__F{int(FMIN)}_to_{int(FMAX)}{ext}"
+(write negative grids with "=", as above, so they are not taken for options)
+"""
 
-def parse_float(x):
-    try:
-        return float(x)
-    except Exception:
-        return None
+#!/usr/bin/env python3
+import argparse
 
-def forces_components_in_range(forces_json_str, fmin, fmax):
-    """
-    forces_json_str: JSON string of [[Fx,Fy,Fz], ...]
-    Returns (ok, count_components). ok=True iff EVERY parsed component is within [fmin,fmax].
-    """
-    try:
-        data = json.loads(forces_json_str)
-    except Exception:
-        return (False, 0)
+from geoopt_pipeline.columnar import is_columnar
+from geoopt_pipeline.filters import CHUNK_ROWS, EMAX, EMIN, FMAX, FMIN, FilterSweep, filter_columnar, filter_csv, filtered_csv_name, new_filter_counts, print_filter_summary
 
-    total = 0
-    for vec in data if isinstance(data, list) else []:
-        if not (isinstance(vec, (list, tuple)) and len(vec) >= 3):
-            continue
-        for comp in (vec[0], vec[1], vec[2]):
-            val = parse_float(comp)
-            if val is None:
-                return (False, total)
-            total += 1
-            if not (fmin <= val <= fmax):
-                return (False, total)
-    return (total > 0, total)
+# === Config ===  (window defaults live in geoopt_pipeline.filters)
+IN_CSV  = "consolidated_data_10th_step.csv"   # or pass as first CLI arg (.gz/.xz/.bz2/.zst read transparently; .parquet/.arrow -> columnar)
 
-kept = 0
-dropped_energy = 0
-dropped_force  = 0
-invalid_energy = 0
-invalid_forces = 0
-total_rows = 0
+def float_list(text):
+    try:
+        return [float(v) for v in text.split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma-separated numbers, got {text!r}")
 
-with open(IN_CSV, "r", newline="") as fin, open(OUT_CSV, "w", newline="") as fout:
-    r = csv.DictReader(fin)
-    fieldnames = r.fieldnames or []
-    if "Energy" not in fieldnames or "Forces" not in fieldnames:
-        raise ValueError("Input CSV must contain 'Energy' and 'Forces' columns.")
-    w = csv.DictWriter(fout, fieldnames=fieldnames)
-    w.writeheader()
+def main():
+    ap = argparse.ArgumentParser(description="Keep the rows whose energy and every force component lie in the window.")
+    ap.add_argument("input", nargs="?", default=IN_CSV, help=f"Input CSV or .parquet/.arrow dataset (default: {IN_CSV})")
+    ap.add_argument("--emin", type=float, default=EMIN, help=f"Lowest energy kept, eV (default: {EMIN})")
+    ap.add_argument("--emax", type=float, default=EMAX, help=f"Highest energy kept, eV (default: {EMAX})")
+    ap.add_argument("--fmin", type=float, default=FMIN, help=f"Lowest force component kept, eV/Å (default: {FMIN})")
+    ap.add_argument("--fmax", type=float, default=FMAX, help=f"Highest force component kept, eV/Å (default: {FMAX})")
+    ap.add_argument("--output", help="Output file (default: <input>_filtered_E..__F..<same extension>)")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                    help=f"CSV rows whose forces are decoded and tested together (default: {CHUNK_ROWS})")
+    ap.add_argument("--sweep", action="store_true",
+                    help="Count every combination of the --*-grid windows in one pass instead of filtering")
+    ap.add_argument("--emin-grid", type=float_list, help="Sweep: comma-separated EMIN values (default: --emin)")
+    ap.add_argument("--emax-grid", type=float_list, help="Sweep: comma-separated EMAX values (default: --emax)")
+    ap.add_argument("--fmin-grid", type=float_list, help="Sweep: comma-separated FMIN values (default: --fmin)")
+    ap.add_argument("--fmax-grid", type=float_list, help="Sweep: comma-separated FMAX values (default: --fmax)")
+    ap.add_argument("--sweep-csv", help="Sweep: also write the table to this CSV")
+    ap.add_argument("--write", action="store_true",
+                    help="Sweep: also write the filtered file for --emin/--emax/--fmin/--fmax in the same pass")
+    args = ap.parse_args()
+    if args.chunk_rows < 1:
+        ap.error("--chunk-rows must be at least 1")
 
-    for row in r:
-        total_rows += 1
+    sweep = None
+    if args.sweep:
+        sweep = FilterSweep(args.emin_grid or [args.emin], args.emax_grid or [args.emax],
+                            args.fmin_grid or [args.fmin], args.fmax_grid or [args.fmax])
+        if not sweep.windows:
+            ap.error("the grids give no window with min <= max")
 
-        # Energy filter
-        e = parse_float(row.get("Energy", ""))
-        if e is None:
-            invalid_energy += 1
-            continue
-        if not (EMIN <= e <= EMAX):
-            dropped_energy += 1
-            continue
+    # Output keeps the input's format: x.csv.gz -> x_filtered_....csv.gz, x.parquet -> x_filtered_....parquet
+    out_csv = args.output or filtered_csv_name(args.input, args.emin, args.emax, args.fmin, args.fmax)
+    if sweep is not None and not args.write:
+        out_csv = None
+    counts = new_filter_counts()
 
-        # Force per-component filter
-        ok, ncomp = forces_components_in_range(row.get("Forces", ""), FMIN, FMAX)
-        if not ok:
-            if ncomp == 0:
-                invalid_forces += 1
-            else:
-                dropped_force += 1
-            continue
+    if is_columnar(args.input):
+        # Only the Energy and Forces arrays are read; structures are copied through
+        filter_columnar(args.input, out_csv, args.emin, args.emax, args.fmin, args.fmax, counts, sweep)
+    else:
+        # Chunks of rows: energies and forces are tested as NumPy arrays, kept rows streamed out
+        filter_csv(args.input, out_csv, args.emin, args.emax, args.fmin, args.fmax, counts, args.chunk_rows, sweep)
 
-        # Passed both filters
-        w.writerow(row)
-        kept += 1
+    if sweep is not None:
+        print(f"Input:            {args.input}")
+        print(f"Windows:          {len(sweep.windows)}\n")
+        sweep.print_table()
+        if args.sweep_csv:
+            sweep.write_csv(args.sweep_csv)
+            print(f"\nSweep table written to: {args.sweep_csv}")
+        if out_csv is None:
+            return
+        print()
+    print_filter_summary(args.input, out_csv, counts, args.emin, args.emax, args.fmin, args.fmax)
 
-print(f"Input:            {IN_CSV}")
-print(f"Output:           {OUT_CSV}")
-print(f"Total rows read:  {total_rows}")
-print(f"Kept rows:        {kept}")
-print(f"Dropped (energy): {dropped_energy}  [Energy not in [{EMIN}, {EMAX}] eV]")
-print(f"Dropped (forces): {dropped_force}   [Some Fx/Fy/Fz outside [{FMIN}, {FMAX}] eV/Å]")
-print(f"Invalid Energy:   {invalid_energy}  [non-numeric or missing]")
-print(f"Invalid Forces:   {invalid_forces}  [missing/invalid JSON or no components]")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+"""
+Shared helpers for the geo-opt dataset scripts in this folder.
+
+The scripts are run directly (python <script>.py), so this package is
+importable from them as long as it sits next to the scripts.
+"""
@@ -0,0 +1,297 @@
+"""
+Columnar dataset files (Parquet / Arrow IPC) as an alternative to the
+consolidated CSV with JSON strings in the Structure/Forces/Stress cells.
+
+  .parquet  zstd-compressed Parquet, smallest on disk
+  .arrow    uncompressed Arrow IPC file, memory-mapped with zero copy
+
+Columns:
+
+  Energy         float64, null when missing
+  Directory      string
+  Step           int64
+  Forces         list<[3] float64>    eV/Å, one entry per atom
+  Stress         list<[3] float64>    kB
+  Species        list<string>         site labels
+  Lattice        [9] float64          lattice matrix rows (Å)
+  LatticeABC     [3] float64          a, b, c as written by the extractor
+  LatticeAngles  [3] float64          alpha, beta, gamma
+  Volume         float64
+  Positions      list<[3] float64>    fractional coordinates
+
+The Structure dict is rebuilt from the last six columns only when it is
+asked for (trajectory.build_structure_dict), so a reader that needs the
+energies alone never touches the force or structure arrays.
+A row these columns cannot hold (unparsable Structure, Step that is not
+an integer, Forces/Stress that are not [[x, y, z], ...]) raises
+ValueError naming its Directory and Step; write a CSV to keep such rows.
+Needs the optional 'pyarrow' package.
+"""
+
+import os
+
+import numpy as np
+
+from .records import HEADERS, json_field
+from .trajectory import build_structure_dict
+
+COLUMNAR_SUFFIXES = (".parquet", ".arrow")
+BATCH_ROWS = 1024
+
+STRUCTURE_COLUMNS = ["Species", "Lattice", "LatticeABC", "LatticeAngles", "Volume", "Positions"]
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Reading or writing .parquet/.arrow files needs the 'pyarrow' package (pip install pyarrow).")
+    return pyarrow
+
+def is_columnar(path):
+    return path.endswith(COLUMNAR_SUFFIXES)
+
+def schema():
+    pa = _pyarrow()
+    vec3 = pa.list_(pa.float64(), 3)
+    return pa.schema([
+        ("Energy", pa.float64()),
+        ("Directory", pa.string()),
+        ("Step", pa.int64()),
+        ("Forces", pa.list_(vec3)),
+        ("Stress", pa.list_(vec3)),
+        ("Species", pa.list_(pa.string())),
+        ("Lattice", pa.list_(pa.float64(), 9)),
+        ("LatticeABC", vec3),
+        ("LatticeAngles", vec3),
+        ("Volume", pa.float64()),
+        ("Positions", pa.list_(vec3)),
+    ])
+
+def physical_columns(headers):
+    """File columns holding the given dataset headers (Structure -> its six columns)."""
+    cols = []
+    for h in headers:
+        cols.extend(STRUCTURE_COLUMNS if h == "Structure" else [h])
+    return cols
+
+# ---------------- writing ----------------
+
+def _float_or_none(x):
+    try:
+        return float(x)
+    except Exception:
+        return None
+
+def _row_label(row):
+    return f"Directory {row.get('Directory')!r}, Step {row.get('Step')!r}"
+
+def _rows3(value, row, column):
+    """Parsed [[x,y,z], ...] -> (n, 3) float64 array; missing or [] -> empty, malformed -> ValueError."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return np.empty((0, 3))
+    try:
+        arr = np.asarray(json_field(value), dtype=np.float64)
+    except Exception:
+        arr = None
+    if arr is not None and arr.size == 0:
+        return np.empty((0, 3))
+    if arr is None or arr.ndim != 2 or arr.shape[1] != 3:
+        raise ValueError(f"Malformed {column} in row {_row_label(row)}: expected [[x, y, z], ...]")
+    return arr
+
+def _step(row):
+    try:
+        return int(row["Step"])
+    except Exception:
+        raise ValueError(f"Step is not an integer in row {_row_label(row)}") from None
+
+def _vec3_lists(blocks):
+    """list of (n_i, 3) arrays -> list<[3] float64> Arrow array."""
+    pa = _pyarrow()
+    offsets = np.zeros(len(blocks) + 1, dtype=np.int32)
+    np.cumsum([len(b) for b in blocks], out=offsets[1:])
+    flat = np.concatenate(blocks).reshape(-1) if blocks else np.empty(0)
+    values = pa.FixedSizeListArray.from_arrays(pa.array(flat, type=pa.float64()), 3)
+    return pa.ListArray.from_arrays(pa.array(offsets), values)
+
+def _fixed(rows, width):
+    pa = _pyarrow()
+    flat = np.asarray(rows, dtype=np.float64).reshape(-1)
+    return pa.FixedSizeListArray.from_arrays(pa.array(flat, type=pa.float64()), width)
+
+def rows_to_batch(rows):
+    """
+    In-memory/CSV rows (records.HEADERS keys) -> one Arrow RecordBatch.
+    Raises ValueError, naming the row, for a row the schema cannot hold.
+    """
+    pa = _pyarrow()
+    species, lattice, abc, angles, volume, positions = [], [], [], [], [], []
+    for row in rows:
+        try:
+            sd = json_field(row["Structure"])
+            lat = sd["lattice"]
+            sites = sd.get("sites", [])
+            labels = [str(site["label"]) for site in sites]
+            matrix = np.asarray(lat["matrix"], dtype=np.float64).reshape(9)
+            cell = [float(lat[k]) for k in ("a", "b", "c", "alpha", "beta", "gamma", "volume")]
+            frac = np.asarray([site["abc"] for site in sites], dtype=np.float64).reshape(-1, 3)
+        except Exception as e:
+            raise ValueError(f"Unparsable Structure in row {_row_label(row)}: {e!r}") from None
+        species.append(labels)
+        lattice.append(matrix)
+        abc.append(cell[0:3])
+        angles.append(cell[3:6])
+        volume.append(cell[6])
+        positions.append(frac)
+    n = len(rows)
+    arrays = [
+        pa.array([_float_or_none(r["Energy"]) for r in rows], type=pa.float64()),
+        pa.array([r["Directory"] for r in rows], type=pa.string()),
+        pa.array([_step(r) for r in rows], type=pa.int64()),
+        _vec3_lists([_rows3(r["Forces"], r, "Forces") for r in rows]),
+        _vec3_lists([_rows3(r["Stress"], r, "Stress") for r in rows]),
+        pa.array(species, type=pa.list_(pa.string())),
+        _fixed(lattice if n else np.empty((0, 9)), 9),
+        _fixed(abc if n else np.empty((0, 3)), 3),
+        _fixed(angles if n else np.empty((0, 3)), 3),
+        pa.array(volume, type=pa.float64()),
+        _vec3_lists(positions),
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema())
+
+class ColumnarWriter:
+    """
+    Write dataset rows to a .parquet or .arrow file in batches of
+    BATCH_ROWS. The file is written to a temporary name and moved into
+    place on close().
+    """
+
+    def __init__(self, path, batch_rows=BATCH_ROWS):
+        pa = _pyarrow()
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.batch_rows = batch_rows
+        self.pending = []
+        self.n_rows = 0
+        if path.endswith(".parquet"):
+            self._writer = pa.parquet.ParquetWriter(self.tmp_path, schema(), compression="zstd")
+        else:
+            self._sink = pa.OSFile(self.tmp_path, "wb")
+            self._writer = pa.ipc.new_file(self._sink, schema())
+
+    def write_row(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= self.batch_rows:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def write_batch(self, batch):
+        """Write an Arrow RecordBatch that already has schema()."""
+        self.flush()
+        if batch.num_rows:
+            self._write(batch)
+
+    def _write(self, batch):
+        self._writer.write_batch(batch)
+        self.n_rows += batch.num_rows
+
+    def flush(self):
+        if self.pending:
+            self._write(rows_to_batch(self.pending))
+            self.pending = []
+
+    def _close_writer(self):
+        self._writer.close()
+        if hasattr(self, "_sink"):
+            self._sink.close()
+
+    def close(self):
+        try:
+            self.flush()
+        except BaseException:
+            self.abort()
+            raise
+        self._close_writer()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Close without writing the output file."""
+        self._close_writer()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+# ---------------- reading ----------------
+
+def iter_batches(path, columns=None, batch_rows=BATCH_ROWS):
+    """
+    Yield Arrow RecordBatches holding only `columns` (file column names,
+    see physical_columns). Both formats are memory-mapped.
+    """
+    pa = _pyarrow()
+    if path.endswith(".parquet"):
+        pf = pa.parquet.ParquetFile(path, memory_map=True)
+        yield from pf.iter_batches(batch_size=batch_rows, columns=columns)
+        return
+    reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        yield batch.select(columns) if columns is not None else batch
+
+def read_columns(path, columns):
+    """Arrow Table holding only `columns` (file column names), memory-mapped."""
+    pa = _pyarrow()
+    if path.endswith(".parquet"):
+        return pa.parquet.read_table(path, columns=columns, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all().select(columns)
+
+def energy_array(column):
+    """Energy column -> (float64 array with NaN for nulls, valid mask)."""
+    valid = np.asarray(column.is_valid())
+    return np.asarray(column.to_numpy(zero_copy_only=False), dtype=np.float64), valid
+
+def vec3_arrays(column):
+    """
+    list<[3] float64> column -> (counts, values): number of vectors per row
+    and all vectors as one (n_total, 3) array (zero copy where possible).
+    """
+    pa = _pyarrow()
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    offsets = np.asarray(column.offsets)
+    counts = np.diff(offsets)
+    flat = column.flatten().flatten().to_numpy(zero_copy_only=False)
+    return counts, np.asarray(flat, dtype=np.float64).reshape(-1, 3)
+
+def iter_rows(path, headers=HEADERS, batch_rows=BATCH_ROWS):
+    """
+    Yield dataset rows (dicts with the requested records.HEADERS keys) with
+    parsed values: Structure dict, Forces/Stress lists, float/None Energy.
+    Only the columns behind `headers` are read.
+    """
+    headers = list(headers)
+    for batch in iter_batches(path, physical_columns(headers), batch_rows):
+        cols = {name: batch.column(name).to_pylist() for name in batch.schema.names}
+        for i in range(batch.num_rows):
+            row = {}
+            for h in headers:
+                if h == "Structure":
+                    matrix = np.asarray(cols["Lattice"][i]).reshape(3, 3)
+                    row[h] = build_structure_dict(
+                        cols["Species"][i], matrix, cols["Positions"][i],
+                        cols["LatticeABC"][i], cols["LatticeAngles"][i], cols["Volume"][i],
+                    )
+                else:
+                    row[h] = cols[h][i]
+            yield row
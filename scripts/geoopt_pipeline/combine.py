@@ -0,0 +1,156 @@
+"""
+Parallel combine stage: worker processes load, select and encode the rows
+of one structure file each, and the output is written in a fixed order
+(Directory in natural order, i.e. 2_ before 10_, then geo_opt folder,
+then Step) instead of the filesystem listing order, so two runs over the
+same data give identical files, and the same file as the serial
+records.combine_rows().
+
+  combine_parallel(..., shards=0)  one merged CSV / .parquet / .arrow file
+  combine_parallel(..., shards=N)  N shard files written by the workers
+                                   themselves, plus <output>.manifest.json
+
+Concatenating the shards in manifest order gives the merged file.
+"""
+
+import contextlib
+import csv
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .columnar import ColumnarWriter, is_columnar, rows_to_batch
+from .fileio import compression_suffix, open_file, strip_compression_suffix
+from .records import CSV_HEADERS, directory_name_of, ordered_file_rows, sorted_structure_files, to_csv_row
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+def _ordered_rows(json_dir, json_filename, every_10th, sampling):
+    """
+    Rows of one file (records.ordered_file_rows) and the text the combine
+    stage printed for it (errors are reported by the parent, in file order).
+    """
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        rows = list(ordered_file_rows(json_dir, json_filename, every_10th, sampling))
+    return rows, out.getvalue()
+
+def _encode_csv(rows):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    for row in rows:
+        w.writerow(to_csv_row(row))
+    return buf.getvalue()
+
+def _encode_file(args):
+    """Worker: one structure file -> (n_rows, CSV text or Arrow batch, messages)."""
+    json_dir, json_filename, every_10th, sampling, columnar = args
+    rows, messages = _ordered_rows(json_dir, json_filename, every_10th, sampling)
+    payload = rows_to_batch(rows) if columnar else _encode_csv(rows)
+    return len(rows), payload, messages
+
+def _write_shard(args):
+    """Worker: write the rows of a group of structure files to one shard file."""
+    json_dir, filenames, every_10th, sampling, path = args
+    n_rows = 0
+    messages = []
+    if is_columnar(path):
+        with ColumnarWriter(path) as w:
+            for name in filenames:
+                rows, text = _ordered_rows(json_dir, name, every_10th, sampling)
+                w.write_rows(rows)
+                messages.append(text)
+        n_rows = w.n_rows
+    else:
+        tmp_path = path + ".tmp"
+        with open_file(tmp_path, "w", newline="", compression=compression_suffix(path)) as f:
+            w = csv.writer(f)
+            w.writerow(CSV_HEADERS)
+            for name in filenames:
+                rows, text = _ordered_rows(json_dir, name, every_10th, sampling)
+                for row in rows:
+                    w.writerow(to_csv_row(row))
+                n_rows += len(rows)
+                messages.append(text)
+        os.replace(tmp_path, path)
+    return n_rows, "".join(messages)
+
+def shard_path(output, index, n_shards):
+    """consolidated.csv.gz, 1, 4 -> consolidated.shard-001-of-004.csv.gz"""
+    plain = strip_compression_suffix(output)
+    stem, ext = os.path.splitext(plain)
+    return f"{stem}.shard-{index:03d}-of-{n_shards:03d}{ext}{output[len(plain):]}"
+
+def _split_by_size(json_dir, filenames, n_shards):
+    """Cut the ordered file list into n_shards contiguous groups of similar total file size."""
+    sizes = [os.path.getsize(os.path.join(json_dir, n)) for n in filenames]
+    target = sum(sizes) / n_shards if n_shards else 0
+    groups, current, acc = [], [], 0
+    for name, size in zip(filenames, sizes):
+        current.append(name)
+        acc += size
+        if acc >= target * (len(groups) + 1) and len(groups) < n_shards - 1:
+            groups.append(current)
+            current = []
+    groups.append(current)
+    return [g for g in groups if g]
+
+def combine_parallel(json_dir, output, n_workers, every_10th=True, sampling=None, shards=0):
+    """
+    Combine the structure files of json_dir with n_workers processes into
+    `output` (or, with shards=N, into N shard files and a manifest).
+    Rows are the same as records.combine_rows(), in deterministic order.
+    Returns the number of rows written.
+    """
+    filenames = sorted_structure_files(json_dir)
+    if shards:
+        return _combine_shards(json_dir, filenames, output, n_workers, every_10th, sampling, shards)
+
+    columnar = is_columnar(output)
+    tasks = [(json_dir, name, every_10th, sampling, columnar) for name in filenames]
+    n_rows = 0
+    with ProcessPoolExecutor(max_workers=n_workers) as ex:
+        # map() hands the results back in file order while workers run ahead
+        results = ex.map(_encode_file, tasks)
+        if columnar:
+            with ColumnarWriter(output) as w:
+                for n, batch, messages in results:
+                    print(messages, end="")
+                    w.write_batch(batch)
+                    n_rows += n
+        else:
+            with open_file(output, "w", newline="") as f:
+                csv.writer(f).writerow(CSV_HEADERS)
+                for n, text, messages in results:
+                    print(messages, end="")
+                    f.write(text)
+                    n_rows += n
+    return n_rows
+
+def _combine_shards(json_dir, filenames, output, n_workers, every_10th, sampling, n_shards):
+    groups = _split_by_size(json_dir, filenames, n_shards)
+    paths = [shard_path(output, i, len(groups)) for i in range(len(groups))]
+    tasks = [(json_dir, group, every_10th, sampling, path) for group, path in zip(groups, paths)]
+    with ProcessPoolExecutor(max_workers=n_workers) as ex:
+        results = list(ex.map(_write_shard, tasks))
+    shards = []
+    for path, group, (n, messages) in zip(paths, groups, results):
+        print(messages, end="")
+        shards.append({
+            "path": os.path.basename(path),
+            "rows": n,
+            "first": directory_name_of(group[0]),
+            "last": directory_name_of(group[-1]),
+        })
+    manifest = {
+        "version": 1,
+        "order": ["Directory", "geo_opt_folder", "Step"],
+        "rows": sum(s["rows"] for s in shards),
+        "shards": shards,
+    }
+    manifest_path = output + MANIFEST_SUFFIX
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest["rows"]
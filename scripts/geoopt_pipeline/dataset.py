@@ -0,0 +1,41 @@
+"""
+Read and write the consolidated dataset in either format, picked from
+the file name: CSV (optionally compressed, see fileio) or columnar
+.parquet/.arrow (see columnar).
+"""
+
+import csv
+
+from .columnar import ColumnarWriter, is_columnar, iter_rows
+from .fileio import open_file
+from .records import CSV_HEADERS, HEADERS, to_csv_row
+
+def read_rows(path, headers=HEADERS):
+    """
+    Yield dataset rows. CSV rows are the csv.DictReader dicts (JSON
+    strings in Structure/Forces/Stress); columnar rows hold only `headers`,
+    with parsed values.
+    """
+    if is_columnar(path):
+        yield from iter_rows(path, headers)
+        return
+    with open_file(path, "r", newline="") as f:
+        yield from csv.DictReader(f)
+
+def write_rows(path, rows):
+    """
+    Write rows (records.HEADERS keys, parsed or JSON-string values); returns
+    the row count. CSV files get the summary columns as well (records.to_csv_row).
+    """
+    if is_columnar(path):
+        with ColumnarWriter(path) as w:
+            w.write_rows(rows)
+        return w.n_rows
+    n = 0
+    with open_file(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_HEADERS)
+        for row in rows:
+            w.writerow(to_csv_row(row))
+            n += 1
+    return n
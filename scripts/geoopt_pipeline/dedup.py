@@ -0,0 +1,341 @@
+"""
+StructureMatcher deduplication (structure-matcher.py, run-pipeline.py).
+
+Rows are first bucketed by (composition, number of sites), then by a
+coarse lattice key inside each bucket; only structures sharing both are
+compared, and only pairs whose invariant fingerprints are close enough
+(geoopt_pipeline.fingerprint) go to StructureMatcher.fit. The coarse
+lattice sub-buckets are deduplicated in parallel, largest first, with the
+structures passed to the workers in shared memory
+(geoopt_pipeline.sharedstructs).
+"""
+
+import csv
+import math
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from pymatgen.core import Lattice, Structure
+from pymatgen.analysis.structure_matcher import StructureMatcher
+
+from .columnar import is_columnar, iter_rows
+from .fileio import open_file
+from .filters import parse_float
+from .fingerprint import PREFILTER, FingerprintFilter, structure_fingerprint
+from .records import HEADERS, SUMMARY_COLUMNS, json_field
+from .sharedstructs import attach, pack_structures, share, species_objects, structure_at
+from .workers import default_workers
+
+# StructureMatcher parameters (yours)
+SM_KW = dict(
+    ltol=1, stol=0.01, angle_tol=5,
+    primitive_cell=False, scale=False,
+    attempt_supercell=False, allow_subset=False,
+)
+
+# NOTE: "more negative energy" == numerically smaller float -> keep the minimum
+PREFER_MORE_NEGATIVE_ENERGY = True   # keep the more negative (lower) energy
+
+parse_energy = parse_float
+
+# --- fast composition signature from structure dict (no Structure() yet) ---
+def comp_signature_from_sdict(sd):
+    counts = {}
+    for site in sd.get("sites", []):
+        for sp in site.get("species", []):
+            el  = sp.get("element")
+            occ = sp.get("occu", sp.get("occupancy", 1.0))
+            if el is None:
+                continue
+            counts[el] = counts.get(el, 0.0) + float(occ)
+    return tuple(sorted((el, round(cnt, 6)) for el, cnt in counts.items()))
+
+def load_rows(csv_path):
+    if is_columnar(csv_path):
+        return list(iter_rows(csv_path, HEADERS))
+    rows = []
+    with open_file(csv_path, "r", newline="") as f:
+        r = csv.DictReader(f)
+        missing = [h for h in HEADERS if h not in r.fieldnames]
+        if missing:
+            raise ValueError(f"Missing columns in {csv_path}: {missing}")
+        # summary columns are carried over to the output instead of being recomputed
+        columns = HEADERS + SUMMARY_COLUMNS if all(c in r.fieldnames for c in SUMMARY_COLUMNS) else HEADERS
+        for row in r:
+            rows.append({h: row.get(h, "") for h in columns})
+    return rows
+
+def bucket_globally(rows):
+    """
+    First-pass bucketing by (composition signature, nsites).
+    Parse JSON once; store sd in row["_sdict"] to avoid re-parsing.
+    Structure may be a JSON string (CSV rows) or an already parsed dict.
+    """
+    buckets = defaultdict(list)
+    unparsable = []
+    for row in rows:
+        try:
+            sd = json_field(row["Structure"])
+            if not isinstance(sd, dict):
+                raise ValueError("Structure is not a dict")
+        except Exception:
+            row["_sdict"]  = None
+            row["_energy"] = parse_energy(row.get("Energy"))
+            unparsable.append(row)
+            continue
+
+        row["_sdict"]  = sd
+        row["_energy"] = parse_energy(row.get("Energy"))
+        nsites   = len(sd.get("sites", []))
+        comp_sig = comp_signature_from_sdict(sd)
+        buckets[(comp_sig, nsites)].append(row)
+    return buckets, unparsable
+
+def coarse_lattice_key(lattice):
+    """Key of the second, coarse lattice bucketing (lengths to 0.01 Å, angles to 0.1°)."""
+    a, b, c = lattice.abc
+    al, be, ga = lattice.angles
+    return (round(a, 2), round(b, 2), round(c, 2),
+            round(al, 1), round(be, 1), round(ga, 1))
+
+def dedup_group(structures, energies, matcher, prefer_more_negative_energy=PREFER_MORE_NEGATIVE_ENERGY):
+    """
+    Deduplicate the structures of one coarse lattice sub-bucket, in order
+    (None: unparseable, always kept; energies: float or None).
+    Returns (kept positions, matches) with one
+    (rms, max, kept position, other position, decision) per matched pair.
+    """
+    reps = []  # positions of the current representatives
+    fps = FingerprintFilter(matcher.stol, matcher.ltol, matcher.angle_tol)  # their fingerprints, same order
+    matches = []
+
+    for i, sc in enumerate(structures):
+        if sc is None:
+            reps.append(i)
+            fps.add(None)
+            continue
+
+        # only representatives the fingerprint bound does not rule out
+        fp = None
+        if PREFILTER:
+            try:
+                fp = structure_fingerprint(sc)
+            except Exception:
+                fp = None
+        candidates = range(len(reps)) if fp is None else fps.candidates(fp).tolist()
+
+        match_idx = None
+        for j in candidates:
+            sr = structures[reps[j]]
+            if sr is None:
+                continue
+            try:
+                if matcher.fit(sc, sr):
+                    match_idx = j
+                    break
+            except Exception:
+                pass
+
+        if match_idx is None:
+            reps.append(i)
+            fps.add(fp)
+            continue
+
+        # compute RMS and MAX displacement between the pair
+        rms, maxd = (None, None)
+        try:
+            rms, maxd = matcher.get_rms_dist(sc, structures[reps[match_idx]])
+        except Exception:
+            pass
+
+        # decide which one to keep: MORE NEGATIVE energy (smaller float)
+        action = "kept_old"
+        if prefer_more_negative_energy:
+            e_new = energies[i]
+            e_old = energies[reps[match_idx]]
+            if e_new is not None and (e_old is None or e_new < e_old):
+                reps[match_idx] = i
+                fps.replace(match_idx, fp)
+                action = "replaced_with_new"
+
+        kept = reps[match_idx]
+        matches.append((rms, maxd, kept, i if action == "kept_old" else kept, action))
+
+    return reps, matches
+
+def _match_log(coarse_key, match, rows):
+    """Log dict (printed by print_match_logs) of one dedup_group() match; rows by position."""
+    rms, maxd, kept, other, action = match
+    kept_row, other_row = rows[kept], rows[other]
+    return {
+        "coarse": coarse_key,
+        "rms": rms, "max": maxd,
+        "kept_dir":  kept_row.get("Directory"), "kept_step":  kept_row.get("Step"), "kept_E":  kept_row.get("Energy"),
+        "other_dir": other_row.get("Directory"), "other_step": other_row.get("Step"), "other_E": other_row.get("Energy"),
+        "decision": action
+    }
+
+def _strip_helpers(rows):
+    for r in rows:
+        r.pop("_structure", None)
+        r.pop("_sdict", None)
+        r.pop("_energy", None)
+
+def dedup_bucket(items, sm_kw=SM_KW, prefer_more_negative_energy=PREFER_MORE_NEGATIVE_ENERGY):
+    """
+    Deduplicate a single bucket (same composition + site count).
+    Do a second coarse lattice bucketing to reduce O(n^2) comparisons.
+    Returns (kept_rows, match_logs)
+    """
+    matcher = StructureMatcher(**sm_kw)
+    sub = defaultdict(list)
+
+    # Build sub-buckets by coarse lattice
+    for r in items:
+        try:
+            s = Structure.from_dict(r["_sdict"])
+        except Exception:
+            sub[("UNPARSEABLE", id(r))].append((r, None))
+            continue
+        sub[coarse_lattice_key(s.lattice)].append((r, s))
+
+    kept = []
+    logs = []  # rows of dicts for printing later
+    for coarse_key, grp in sub.items():
+        rows = [r for r, _ in grp]
+        reps, matches = dedup_group([s for _, s in grp], [r["_energy"] for r in rows],
+                                    matcher, prefer_more_negative_energy)
+        kept.extend(rows[k] for k in reps)
+        logs.extend(_match_log(coarse_key, m, rows) for m in matches)
+
+    _strip_helpers(kept)
+    return kept, logs
+
+# --- scheduling: coarse lattice sub-buckets as tasks, structures in shared memory ---
+
+TASKS_PER_WORKER = 4   # small sub-buckets are packed into about this many tasks per worker
+
+_WORKER = {}   # per process: packed arrays, species objects, matcher
+
+def _init_worker(name, layout, species_table, sm_kw):
+    block, arrays = attach(name, layout)
+    _WORKER.update(block=block, arrays=arrays, species=species_objects(species_table),
+                   matcher=StructureMatcher(**sm_kw))
+
+def _dedup_groups(groups, prefer_more_negative_energy):
+    """dedup_group() of lists of row positions into the packed arrays of this process."""
+    arrays, species, matcher = _WORKER["arrays"], _WORKER["species"], _WORKER["matcher"]
+    out = []
+    for positions in groups:
+        structures = []
+        for i in positions:
+            try:
+                structures.append(structure_at(arrays, species, i))
+            except Exception:
+                structures.append(None)
+        energies = [float(arrays["energy"][i]) if arrays["has_energy"][i] else None for i in positions]
+        out.append(dedup_group(structures, energies, matcher, prefer_more_negative_energy))
+    return out
+
+def group_cost(n_structures, nsites):
+    """Relative cost estimate of deduplicating one sub-bucket (n log n lookups, nsites^2 per structure)."""
+    return n_structures * math.log2(n_structures + 1) * max(nsites, 1) ** 2
+
+def plan_tasks(costs, n_workers):
+    """
+    Group indices packed into tasks, most expensive first: a group above
+    the target cost is a task of its own, smaller ones are packed until
+    they reach it, so no worker is left with a long tail.
+    """
+    order = sorted(range(len(costs)), key=lambda g: -costs[g])
+    target = sum(costs) / max(1, n_workers * TASKS_PER_WORKER)
+    tasks, current, current_cost = [], [], 0.0
+    for g in order:
+        current.append(g)
+        current_cost += costs[g]
+        if current_cost >= target:
+            tasks.append(current)
+            current, current_cost = [], 0.0
+    if current:
+        tasks.append(current)
+    return tasks
+
+def deduplicate(rows, n_workers=None, sm_kw=SM_KW, prefer_more_negative_energy=PREFER_MORE_NEGATIVE_ENERGY):
+    """
+    Deduplicate all rows. Every coarse lattice sub-bucket is deduplicated on
+    its own, so sub-buckets (not whole buckets) are the unit of work: they
+    are packed into tasks by estimated cost and submitted largest first, and
+    the structures reach the workers as arrays in shared memory.
+    Returns (kept_rows, match_logs) in bucket order; unparsable rows are kept
+    verbatim at the end.
+    """
+    n_workers = n_workers or default_workers()
+    buckets, unparsable = bucket_globally(rows)
+
+    items = [r for bucket in buckets.values() for r in bucket]
+    bucket_of = [key for key, bucket in buckets.items() for _ in bucket]
+    arrays, species_table, ok = pack_structures([r["_sdict"] for r in items])
+    arrays["energy"] = np.array([np.nan if r["_energy"] is None else r["_energy"] for r in items], dtype=np.float64)
+    arrays["has_energy"] = np.array([r["_energy"] is not None for r in items], dtype=np.bool_)
+
+    # coarse lattice sub-buckets (positions in items), keyed as dedup_bucket() keys them
+    groups = defaultdict(list)
+    for i, bucket_key in enumerate(bucket_of):
+        key = coarse_lattice_key(Lattice(arrays["lattice"][i])) if ok[i] else ("UNPARSEABLE", i)
+        groups[(bucket_key, key)].append(i)
+    group_keys = list(groups)
+    group_rows = [groups[k] for k in group_keys]
+    # bucket key = (composition, nsites)
+    tasks = plan_tasks([group_cost(len(g), k[0][1]) for k, g in zip(group_keys, group_rows)], n_workers)
+
+    results = [None] * len(group_keys)
+    if n_workers <= 1 or len(tasks) <= 1:
+        _WORKER.update(arrays=arrays, species=species_objects(species_table), matcher=StructureMatcher(**sm_kw))
+        try:
+            for task in tasks:
+                for g, res in zip(task, _dedup_groups([group_rows[g] for g in task], prefer_more_negative_energy)):
+                    results[g] = res
+        finally:
+            _WORKER.clear()
+    else:
+        block, layout = share(arrays)
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                     initargs=(block.name, layout, species_table, sm_kw)) as ex:
+                futures = {ex.submit(_dedup_groups, [group_rows[g] for g in task], prefer_more_negative_energy): task
+                           for task in tasks}
+                for fut in as_completed(futures):
+                    for g, res in zip(futures[fut], fut.result()):
+                        results[g] = res
+        finally:
+            block.close()
+            block.unlink()
+
+    kept_all = []
+    logs_all = []
+    for (bucket_key, coarse_key), positions, (reps, matches) in zip(group_keys, group_rows, results):
+        grp = [items[i] for i in positions]
+        kept_all.extend(grp[k] for k in reps)
+        logs_all.extend(_match_log(coarse_key, m, grp) for m in matches)
+    _strip_helpers(kept_all)
+
+    # add unparsable rows verbatim
+    _strip_helpers(unparsable)
+    kept_all.extend(unparsable)
+    return kept_all, logs_all
+
+def print_match_logs(logs_all):
+    """Print match details (one line per matched pair) to SLURM stdout."""
+    if not logs_all:
+        return
+    print("\n[Match details] (one line per matched pair)")
+    for L in logs_all:
+        rms  = "nan" if L["rms"] is None else f"{L['rms']:.4f}"
+        mxd  = "nan" if L["max"] is None else f"{L['max']:.4f}"
+        print(
+            f"coarse={L['coarse']} | RMS={rms} Å, MAX={mxd} Å | "
+            f"kept=({L['kept_dir']}, step {L['kept_step']}, E={L['kept_E']}) | "
+            f"other=({L['other_dir']}, step {L['other_step']}, E={L['other_E']}) | "
+            f"decision={L['decision']}"
+        )
@@ -0,0 +1,130 @@
+"""
+Transparent (de)compression for every file the pipeline reads or writes.
+
+open_file() picks the codec from the file extension, so
+vasprun.xml.gz, *_intermediate_data.json.xz or
+consolidated_data_10th_step.csv.zst are streamed without a
+decompress-to-scratch step:
+
+  .gz   gzip  (written with `pigz` when it is on PATH -> multithreaded)
+  .xz   lzma
+  .bz2  bz2
+  .zst  zstandard (optional dependency; multithreaded when writing)
+
+Anything else is opened as a plain file. The number of compression
+threads defaults to SLURM_CPUS_PER_TASK / all local cores and can be set
+with the COMPRESS_THREADS environment variable.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import shutil
+import subprocess
+
+from .workers import default_workers
+
+COMPRESSION_SUFFIXES = (".gz", ".xz", ".bz2", ".zst")
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+def compression_threads():
+    v = os.environ.get("COMPRESS_THREADS")
+    if v and v.isdigit() and int(v) > 0:
+        return int(v)
+    return default_workers()
+
+def compression_suffix(path):
+    """'.gz', '.xz', '.bz2', '.zst' or '' for an uncompressed path."""
+    for suffix in COMPRESSION_SUFFIXES:
+        if path.endswith(suffix):
+            return suffix
+    return ""
+
+def strip_compression_suffix(path):
+    """'a.json.gz' -> 'a.json'; uncompressed paths are returned unchanged."""
+    suffix = compression_suffix(path)
+    return path[:-len(suffix)] if suffix else path
+
+def has_suffix(path, suffixes):
+    """endswith() that looks through a compression suffix: has_suffix('a.csv.gz', '.csv') is True."""
+    return strip_compression_suffix(path).endswith(suffixes)
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst files needs the 'zstandard' package (pip install zstandard).")
+    return zstandard
+
+class _PigzWriter(io.RawIOBase):
+    """Binary sink that pipes into a `pigz` subprocess writing `path`."""
+
+    def __init__(self, path, threads):
+        self._out = open(path, "wb")
+        self._proc = subprocess.Popen(
+            ["pigz", f"-{GZIP_LEVEL}", "-p", str(threads), "-c"],
+            stdin=subprocess.PIPE, stdout=self._out,
+        )
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self._proc.stdin.write(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._proc.stdin.close()
+            rc = self._proc.wait()
+        finally:
+            self._out.close()
+            super().close()
+        if rc != 0:
+            raise OSError(f"pigz exited with status {rc}")
+
+def _open_binary(path, mode, suffix):
+    """Binary stream for mode 'rb' / 'wb' / 'ab' with the codec of `suffix`."""
+    if suffix == "":
+        return open(path, mode)
+    if suffix == ".xz":
+        return lzma.open(path, mode)
+    if suffix == ".bz2":
+        return bz2.open(path, mode)
+    if suffix == ".gz":
+        if mode == "wb":
+            threads = compression_threads()
+            if threads > 1 and shutil.which("pigz"):
+                return io.BufferedWriter(_PigzWriter(path, threads))
+            return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+        return gzip.open(path, mode)
+
+    zstandard = _zstd()
+    if mode == "rb":
+        return zstandard.open(path, "rb")
+    params = zstandard.ZstdCompressionParameters.from_level(ZSTD_LEVEL, threads=compression_threads())
+    cctx = zstandard.ZstdCompressor(compression_params=params)
+    return zstandard.open(path, mode, cctx=cctx)
+
+def open_file(path, mode="r", encoding=None, newline=None, compression=None):
+    """
+    Drop-in replacement for open() that handles compressed files.
+    Supported modes: 'r', 'rt', 'rb', 'w', 'wt', 'wb', 'a', 'at', 'ab'.
+    `compression` overrides the suffix detection (e.g. when writing to a
+    temporary name that is renamed to `path` afterwards).
+    """
+    suffix = compression_suffix(path) if compression is None else compression
+    binary = "b" in mode
+    bmode = mode.replace("t", "").replace("b", "") + "b"
+    if not suffix:
+        if binary:
+            return open(path, bmode)
+        return open(path, bmode[0], encoding=encoding, newline=newline)
+    stream = _open_binary(path, bmode, suffix)
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding or "utf-8", newline=newline)
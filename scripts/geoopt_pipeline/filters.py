@@ -0,0 +1,388 @@
+"""
+Energy / force-component window filter (filter-en-force.py, run-pipeline.py).
+"""
+
+import os
+import contextlib
+import csv
+import json
+import warnings
+
+import numpy as np
+
+from .columnar import ColumnarWriter, energy_array, iter_batches, vec3_arrays
+from .fileio import compression_suffix, open_file, strip_compression_suffix
+from .records import FORCE_BOUND_COLUMNS, force_bounds
+
+# Default window, decided from the distribution before filtering
+EMIN = -1050.0
+EMAX = -500.0
+FMIN = -100.0
+FMAX = 100.0
+
+FILTER_COUNTERS = ("total_rows", "kept", "dropped_energy", "dropped_force", "invalid_energy", "invalid_forces")
+
+def parse_float(x):
+    try:
+        return float(x)
+    except Exception:
+        return None
+
+def forces_in_range(data, fmin, fmax):
+    """
+    data: parsed forces, [[Fx,Fy,Fz], ...]
+    Returns (ok, count_components). ok=True iff EVERY parsed component is within [fmin,fmax].
+    """
+    total = 0
+    for vec in data if isinstance(data, list) else []:
+        if not (isinstance(vec, (list, tuple)) and len(vec) >= 3):
+            continue
+        for comp in (vec[0], vec[1], vec[2]):
+            val = parse_float(comp)
+            if val is None:
+                return (False, total)
+            total += 1
+            if not (fmin <= val <= fmax):
+                return (False, total)
+    return (total > 0, total)
+
+def forces_components_in_range(forces_json_str, fmin, fmax):
+    """
+    forces_json_str: JSON string of [[Fx,Fy,Fz], ...]
+    Returns (ok, count_components). ok=True iff EVERY parsed component is within [fmin,fmax].
+    """
+    try:
+        data = json.loads(forces_json_str)
+    except Exception:
+        return (False, 0)
+    return forces_in_range(data, fmin, fmax)
+
+def new_filter_counts():
+    return dict.fromkeys(FILTER_COUNTERS, 0)
+
+def filter_rows(rows, emin=EMIN, emax=EMAX, fmin=FMIN, fmax=FMAX, counts=None):
+    """
+    Yield the rows whose Energy lies in [emin, emax] and whose every force
+    component lies in [fmin, fmax]. Forces may be a JSON string (CSV rows)
+    or the parsed list (in-memory rows). `counts` (new_filter_counts())
+    is updated with the reason each dropped row was dropped.
+    """
+    if counts is None:
+        counts = new_filter_counts()
+    for row in rows:
+        counts["total_rows"] += 1
+
+        # Energy filter
+        e = parse_float(row.get("Energy", ""))
+        if e is None:
+            counts["invalid_energy"] += 1
+            continue
+        if not (emin <= e <= emax):
+            counts["dropped_energy"] += 1
+            continue
+
+        # Force per-component filter
+        forces = row.get("Forces", "")
+        if isinstance(forces, str):
+            ok, ncomp = forces_components_in_range(forces, fmin, fmax)
+        else:
+            ok, ncomp = forces_in_range(forces, fmin, fmax)
+        if not ok:
+            if ncomp == 0:
+                counts["invalid_forces"] += 1
+            else:
+                counts["dropped_force"] += 1
+            continue
+
+        # Passed both filters
+        counts["kept"] += 1
+        yield row
+
+# ---- Vectorized CSV filter ----
+
+CHUNK_ROWS = 4096
+
+# Forces cells as the combine step writes them: [[fx, fy, fz], [fx, fy, fz], ...].
+# With the number characters removed such a cell is exactly this skeleton, so
+# it is checked with one str.translate(); the numbers of all such cells in a
+# chunk are then read by a single np.fromstring(). Any other cell goes through
+# forces_extent(), and so does the whole chunk when NumPy cannot
+# read every number (NaN/Infinity are caught by the skeleton already). NumPy
+# also reads a few spellings JSON does not (".5", "+1"), which json.dumps in
+# the combine step never writes.
+_NUMBER_CHARS = str.maketrans("", "", "0123456789.-+eE")
+_BRACKETS_SPACES = str.maketrans("", "", "[] ")
+
+def _forces_skeleton(n_vec):
+    return "[" + "[, , ], " * (n_vec - 1) + "[, , ]]"
+
+def forces_extent(data):
+    """
+    (n_components, lo, hi) of parsed forces: the smallest and largest
+    component, so that forces_in_range(data, fmin, fmax) is ok exactly
+    when n_components > 0 and fmin <= lo and hi <= fmax. lo/hi are NaN
+    (never in range) when a component after the first is NaN or not a
+    number; n_components is 0 when forces_in_range() finds none.
+    """
+    lo, hi, total = np.inf, -np.inf, 0
+    for vec in data if isinstance(data, list) else []:
+        if not (isinstance(vec, (list, tuple)) and len(vec) >= 3):
+            continue
+        for comp in (vec[0], vec[1], vec[2]):
+            val = parse_float(comp)
+            if val is None:
+                return (total, np.nan, np.nan)
+            total += 1
+            if val != val:
+                return (total, np.nan, np.nan)
+            lo = val if val < lo else lo
+            hi = val if val > hi else hi
+    return (total, lo, hi)
+
+def decode_plain_forces(cells):
+    """
+    (indices, n_values, values) for the cells of a list of Forces JSON
+    cells that are in the combine layout: their positions in `cells`, the
+    number of components of each, and all those components as one flat
+    float64 array. The other cells are left to the caller.
+    """
+    plain, n_values = [], []
+    for i, cell in enumerate(cells):
+        n_vec = cell.count("[") - 1
+        if n_vec > 0 and cell.translate(_NUMBER_CHARS) == _forces_skeleton(n_vec):
+            plain.append(i)
+            n_values.append(3 * n_vec)
+    if plain:
+        text = ",".join(cells[i].translate(_BRACKETS_SPACES) for i in plain)
+        # a number NumPy cannot read ends the array early or raises
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            try:
+                values = np.fromstring(text, sep=",")
+            except ValueError:
+                values = ()
+        if len(values) == sum(n_values):
+            return np.array(plain), np.array(n_values), values
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+def forces_chunk_extent(cells):
+    """forces_extent() of a list of Forces JSON cells, as three arrays."""
+    n = len(cells)
+    ncomp = np.zeros(n, dtype=np.int64)
+    lo = np.full(n, np.nan)
+    hi = np.full(n, np.nan)
+    idx, n_values, values = decode_plain_forces(cells)
+    if len(idx):
+        starts = np.concatenate(([0], np.cumsum(n_values)[:-1]))
+        ncomp[idx] = n_values
+        lo[idx] = np.minimum.reduceat(values, starts)
+        hi[idx] = np.maximum.reduceat(values, starts)
+    plain_set = set(idx.tolist())
+    for i, cell in enumerate(cells):
+        if i not in plain_set:
+            try:
+                data = json.loads(cell)
+            except Exception:
+                continue
+            ncomp[i], lo[i], hi[i] = forces_extent(data)
+    return ncomp, lo, hi
+
+def _summary_extent(rows):
+    """forces_extent() from the summary cells: (ncomp, lo, hi, has_summary) arrays."""
+    bounds = [force_bounds(row) for row in rows]
+    has = np.array([b is not None for b in bounds], dtype=bool)
+    table = np.array([b[1] for b in bounds if b is not None], dtype=np.float64).reshape(-1, 6)
+    ncomp = np.zeros(len(rows), dtype=np.int64)
+    lo = np.full(len(rows), np.nan)
+    hi = np.full(len(rows), np.nan)
+    ncomp[has] = [3 * b[0] for b in bounds if b is not None]
+    lo[has] = table[:, 0::2].min(axis=1)
+    hi[has] = table[:, 1::2].max(axis=1)
+    return ncomp, lo, hi, has
+
+def window_mask(energy, valid, ncomp, lo, hi, emin=EMIN, emax=EMAX, fmin=FMIN, fmax=FMAX, counts=None):
+    """
+    Keep-mask of one window from the per-row energies and force extents
+    (forces_extent), adding to `counts` as filter_rows() does.
+    """
+    with np.errstate(invalid="ignore"):
+        e_ok = valid & (energy >= emin) & (energy <= emax)
+        f_ok = (ncomp > 0) & (lo >= fmin) & (hi <= fmax)
+    if counts is not None:
+        counts["total_rows"] += len(energy)
+        counts["invalid_energy"] += int((~valid).sum())
+        counts["dropped_energy"] += int((valid & ~e_ok).sum())
+        counts["invalid_forces"] += int((e_ok & (ncomp == 0)).sum())
+        counts["dropped_force"] += int((e_ok & (ncomp > 0) & ~f_ok).sum())
+        counts["kept"] += int((e_ok & f_ok).sum())
+    return e_ok & f_ok
+
+class FilterSweep:
+    """
+    Counters of every (emin, emax, fmin, fmax) combination of the given
+    grids, filled from the same chunks as the filter itself, so choosing a
+    window takes one pass over the data. Combinations with min > max are
+    skipped.
+    """
+
+    def __init__(self, emins, emaxs, fmins, fmaxs):
+        self.windows = [(emin, emax, fmin, fmax)
+                        for emin in emins for emax in emaxs if emin <= emax
+                        for fmin in fmins for fmax in fmaxs if fmin <= fmax]
+        self.counts = [new_filter_counts() for _ in self.windows]
+        # rows outside this energy span fail every window before forces are looked at
+        self.emin = min((w[0] for w in self.windows), default=np.inf)
+        self.emax = max((w[1] for w in self.windows), default=-np.inf)
+
+    def add(self, energy, valid, ncomp, lo, hi):
+        for window, counts in zip(self.windows, self.counts):
+            window_mask(energy, valid, ncomp, lo, hi, *window, counts=counts)
+        return self
+
+    def table(self):
+        """One dict per window: the window, its counters and the kept percentage."""
+        out = []
+        for (emin, emax, fmin, fmax), counts in zip(self.windows, self.counts):
+            total = counts["total_rows"]
+            out.append(dict(emin=emin, emax=emax, fmin=fmin, fmax=fmax, **counts,
+                            kept_pct=100.0 * counts["kept"] / total if total else 0.0))
+        return out
+
+    def print_table(self):
+        print(f"{'EMIN':>10} {'EMAX':>10} {'FMIN':>9} {'FMAX':>9} {'kept':>9} {'kept%':>7} "
+              f"{'drop_E':>9} {'drop_F':>9} {'inv_E':>7} {'inv_F':>7}")
+        for t in self.table():
+            print(f"{t['emin']:>10g} {t['emax']:>10g} {t['fmin']:>9g} {t['fmax']:>9g} {t['kept']:>9} "
+                  f"{t['kept_pct']:>7.2f} {t['dropped_energy']:>9} {t['dropped_force']:>9} "
+                  f"{t['invalid_energy']:>7} {t['invalid_forces']:>7}")
+
+    def write_csv(self, path):
+        with open_file(path, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=["emin", "emax", "fmin", "fmax", *FILTER_COUNTERS, "kept_pct"])
+            w.writeheader()
+            for t in self.table():
+                w.writerow({**t, "kept_pct": f"{t['kept_pct']:.4f}"})
+
+def filter_csv(in_path, out_path, emin=EMIN, emax=EMAX, fmin=FMIN, fmax=FMAX, counts=None,
+               chunk_rows=CHUNK_ROWS, sweep=None):
+    """
+    Same result and counters as filter_rows() over a CSV, chunk by chunk:
+    energies are compared as one array per chunk. For the rows that pass
+    the energy window, the force window is checked on the FxMin ... FzMax
+    summary cells when the CSV has them (records.SUMMARY_COLUMNS); the
+    Forces cells of the remaining rows are decoded together into NumPy
+    arrays (forces_chunk_extent). Kept rows are streamed to out_path;
+    out_path=None only counts. A FilterSweep is filled in the same pass.
+    """
+    if counts is None:
+        counts = new_filter_counts()
+    with open_file(in_path, "r", newline="") as fin, \
+            (open_file(out_path, "w", newline="") if out_path else contextlib.nullcontext()) as fout:
+        r = csv.DictReader(fin)
+        fieldnames = r.fieldnames or []
+        if "Energy" not in fieldnames or "Forces" not in fieldnames:
+            raise ValueError("Input CSV must contain 'Energy' and 'Forces' columns.")
+        w = None
+        if fout is not None:
+            w = csv.DictWriter(fout, fieldnames=fieldnames)
+            w.writeheader()
+        summary = all(c in fieldnames for c in FORCE_BOUND_COLUMNS)
+
+        chunk = []
+        for row in r:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                kept = _filter_chunk(chunk, emin, emax, fmin, fmax, counts, summary, sweep)
+                if w is not None:
+                    w.writerows(kept)
+                chunk = []
+        if chunk:
+            kept = _filter_chunk(chunk, emin, emax, fmin, fmax, counts, summary, sweep)
+            if w is not None:
+                w.writerows(kept)
+    return counts
+
+def _filter_chunk(rows, emin, emax, fmin, fmax, counts, summary=False, sweep=None):
+    parsed = [parse_float(row.get("Energy", "")) for row in rows]
+    valid = np.array([e is not None for e in parsed], dtype=bool)
+    energy = np.array([np.nan if e is None else e for e in parsed], dtype=np.float64)
+
+    # force extents are only needed where some energy window passes
+    with np.errstate(invalid="ignore"):
+        need = valid & (energy >= emin) & (energy <= emax)
+        if sweep is not None:
+            need |= valid & (energy >= sweep.emin) & (energy <= sweep.emax)
+    idx = np.flatnonzero(need)
+    ncomp = np.zeros(len(rows), dtype=np.int64)
+    lo = np.full(len(rows), np.nan)
+    hi = np.full(len(rows), np.nan)
+    todo = idx
+    if summary and len(idx):
+        ncomp[idx], lo[idx], hi[idx], has = _summary_extent([rows[i] for i in idx])
+        todo = idx[~has]
+    if len(todo):
+        # rows without usable summary cells: decode their Forces JSON
+        ncomp[todo], lo[todo], hi[todo] = forces_chunk_extent([rows[i].get("Forces", "") or "" for i in todo])
+
+    if sweep is not None:
+        sweep.add(energy, valid, ncomp, lo, hi)
+    keep = window_mask(energy, valid, ncomp, lo, hi, emin, emax, fmin, fmax, counts)
+    return [rows[i] for i in np.flatnonzero(keep)]
+
+def filtered_csv_name(in_csv, emin=EMIN, emax=EMAX, fmin=FMIN, fmax=FMAX):
+    """Output name of the filter stage; keeps the input's compression (x.csv.gz -> x_filtered_....csv.gz)."""
+    base, ext = os.path.splitext(strip_compression_suffix(in_csv))
+    return f"{base}_filtered_E{int(emin)}_to_{int(emax)}__F{int(fmin)}_to_{int(fmax)}{ext}{compression_suffix(in_csv)}"
+
+def print_filter_summary(in_csv, out_csv, counts, emin=EMIN, emax=EMAX, fmin=FMIN, fmax=FMAX):
+    print(f"Input:            {in_csv}")
+    print(f"Output:           {out_csv}")
+    print(f"Total rows read:  {counts['total_rows']}")
+    print(f"Kept rows:        {counts['kept']}")
+    print(f"Dropped (energy): {counts['dropped_energy']}  [Energy not in [{emin}, {emax}] eV]")
+    print(f"Dropped (forces): {counts['dropped_force']}   [Some Fx/Fy/Fz outside [{fmin}, {fmax}] eV/Å]")
+    print(f"Invalid Energy:   {counts['invalid_energy']}  [non-numeric or missing]")
+    print(f"Invalid Forces:   {counts['invalid_forces']}  [missing/invalid JSON or no components]")
+
+def batch_extent(batch):
+    """(energy, valid, ncomp, lo, hi) arrays of an Arrow RecordBatch with Energy and Forces columns."""
+    energy, valid = energy_array(batch.column("Energy"))
+    n_vec, forces = vec3_arrays(batch.column("Forces"))
+    lo = np.full(len(n_vec), np.nan)
+    hi = np.full(len(n_vec), np.nan)
+    rows = n_vec > 0
+    if rows.any():
+        # a NaN component propagates to lo/hi and counts as out of range, like parse_float('nan') does
+        starts = (np.cumsum(n_vec) - n_vec)[rows]
+        lo[rows] = np.minimum.reduceat(forces.min(axis=1), starts)
+        hi[rows] = np.maximum.reduceat(forces.max(axis=1), starts)
+    return energy, valid, 3 * n_vec, lo, hi
+
+def batch_filter_mask(batch, emin=EMIN, emax=EMAX, fmin=FMIN, fmax=FMAX, counts=None, sweep=None):
+    """
+    Columnar version of filter_rows for one Arrow RecordBatch with Energy
+    and Forces columns: the same predicates and counters, as array
+    operations. Returns the boolean keep-mask.
+    """
+    extent = batch_extent(batch)
+    if sweep is not None:
+        sweep.add(*extent)
+    return window_mask(*extent, emin, emax, fmin, fmax, counts)
+
+def filter_columnar(in_path, out_path, emin=EMIN, emax=EMAX, fmin=FMIN, fmax=FMAX, counts=None, sweep=None):
+    """
+    Filter a .parquet/.arrow dataset batch by batch into out_path
+    (out_path=None only counts). Only the Energy and Forces arrays are
+    inspected; the structure columns are copied through without being
+    decoded. A FilterSweep is filled in the same pass.
+    """
+    if counts is None:
+        counts = new_filter_counts()
+    if out_path is None:
+        for batch in iter_batches(in_path, ["Energy", "Forces"]):
+            batch_filter_mask(batch, emin, emax, fmin, fmax, counts, sweep)
+        return counts
+    with ColumnarWriter(out_path) as w:
+        for batch in iter_batches(in_path):
+            w.write_batch(batch.filter(batch_filter_mask(batch, emin, emax, fmin, fmax, counts, sweep)))
+    return counts
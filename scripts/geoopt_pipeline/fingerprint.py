@@ -0,0 +1,279 @@
+"""
+Rotation- and order-invariant structure fingerprints that rule out
+StructureMatcher pairs before fit() is called (dedup.dedup_bucket).
+
+The fingerprint of a structure is, for each species in sorted order, the
+sorted nearest-neighbour distances of its sites (periodic images
+included). fit() accepts a pair when, on the average of the two
+lattices, every site lies within d = stol * (V / nsites) ** (1/3) of a
+partner of the same species. A nearest-neighbour distance then moves by
+at most 2d, plus the strain from each cell to the average lattice (at
+most eps times the distance), and sorting keeps that bound, so a pair
+with
+
+    max |fp1 - fp2| > 2d + eps * (max fp1 + max fp2)
+
+cannot match. eps is the largest stretch of the deformation fit() may
+use between the two cells (with the volume of the larger cell grown by it
+for d). fit() does not only map the cells onto each other in their own
+bases: it tries every basis of the candidate cell whose lengths and
+angles agree with the Niggli basis of the representative within ltol and
+angle_tol, e.g. (a, b, a + c) for a long c axis. So for each
+representative the stretches of all those maps are enumerated once, with
+the tolerances widened to cover any candidate cell within MAP_MARGIN
+strain of its own; the stretch of a pair is bounded from them and the
+strain between the two cells, and a pair further apart than MAP_MARGIN
+is always kept. Set PREFILTER=0 to call fit() for every pair.
+
+The representatives are kept in KD-trees over a short descriptor of the
+fingerprint, queried with a radius that bounds the pair bound of every
+representative, so a candidate is only checked against its neighbours.
+"""
+
+import itertools
+import os
+
+import numpy as np
+from pymatgen.core import Lattice
+from scipy.spatial import cKDTree
+
+PREFILTER = os.environ.get("PREFILTER", "1") != "0"
+
+# largest strain between a candidate and a representative cell that the
+# enumerated basis maps cover; pairs further apart are always kept
+MAP_MARGIN = 0.02
+
+# the 26 lattice translations next to the origin
+_NEIGHBOUR_CELLS = np.array([n for n in itertools.product((-1, 0, 1), repeat=3) if any(n)], dtype=np.float64)
+
+def nearest_neighbour_distances(structure):
+    """Distance from every site to its nearest other site or periodic image."""
+    lll = structure.lattice.lll_matrix
+    self_image = float(np.linalg.norm(_NEIGHBOUR_CELLS @ lll, axis=1).min())
+    if len(structure) < 2:
+        return np.full(len(structure), self_image)
+    dist = np.array(structure.distance_matrix, dtype=np.float64)
+    np.fill_diagonal(dist, np.inf)
+    return np.minimum(dist.min(axis=1), self_image)
+
+def structure_fingerprint(structure):
+    """
+    (key, vector, lattice matrix, volume) of a Structure: key is the
+    sorted (species, count) tuple, vector the per-species sorted
+    nearest-neighbour distances in key order.
+    """
+    nn = nearest_neighbour_distances(structure)
+    species = np.array([str(site.species) for site in structure])
+    key, parts = [], []
+    for sp in sorted(set(species.tolist())):
+        sel = np.sort(nn[species == sp])
+        key.append((sp, len(sel)))
+        parts.append(sel)
+    vector = np.concatenate(parts) if parts else np.empty(0)
+    return tuple(key), vector, np.array(structure.lattice.matrix, dtype=np.float64), float(structure.volume)
+
+def descriptor(key, vector):
+    """
+    Short summary of a fingerprint for the spatial index: min, mean and
+    max of each species' distances. Its Chebyshev distance between two
+    structures never exceeds max |fp1 - fp2|.
+    """
+    out, start = [], 0
+    for _, count in key:
+        seg = vector[start:start + count]
+        out += [seg[0], seg.mean(), seg[-1]]
+        start += count
+    return np.array(out, dtype=np.float64)
+
+def _stretches(matrices):
+    """(largest, smallest) singular values of a stack of 3x3 matrices."""
+    sv = np.linalg.svd(matrices, compute_uv=False)
+    return sv[..., 0], sv[..., -1]
+
+def _strain(smax, smin):
+    """Largest relative length change, either way, of a map with these stretches."""
+    return np.maximum(smax, 1.0 / smin) - 1.0
+
+def mapping_stretches(lattice, ltol, angle_tol):
+    """
+    (largest, smallest) stretch over the basis maps fit() may use to put a
+    structure onto one with this cell: from any basis of the candidate cell
+    that fits the Niggli basis of this one within ltol and angle_tol, for
+    every candidate cell within MAP_MARGIN strain of this one.
+    """
+    source = Lattice(lattice)
+    target = source.get_niggli_reduced_lattice()
+    # a strain of MAP_MARGIN moves lengths by that factor and angles by at most 2 asin of it
+    ltol = (1.0 + ltol) / (1.0 - MAP_MARGIN) - 1.0
+    angle_tol = angle_tol + 2.0 * np.degrees(np.arcsin(MAP_MARGIN))
+    smax, smin = 1.0, 1.0
+    for _, _, scale in source.find_all_mappings(target, ltol=ltol, atol=angle_tol, skip_rotation_matrix=True):
+        if not 0.5 < abs(np.linalg.det(scale)) < 1.5:
+            continue   # fit() only keeps unimodular maps without supercells
+        hi, lo = _stretches(np.linalg.solve(scale @ source.matrix, target.matrix))
+        smax, smin = max(smax, float(hi)), min(smin, float(lo))
+    return smax, smin
+
+class _KeyIndex:
+    """
+    Representatives of one species key: their fingerprints by rep index,
+    and the descriptors in KD-trees (scipy cKDTree) that are rebuilt like
+    a binary counter, so an insert costs O(log n) amortized and a query
+    visits O(log n) trees. Replaced fingerprints are dropped lazily.
+    """
+
+    BUFFER = 32
+
+    def __init__(self, lattice, ltol, angle_tol):
+        self.ref_inv = np.linalg.inv(lattice)   # reference cell for the strain bound
+        self.ltol = ltol
+        self.angle_tol = angle_tol
+        self.entries = {}   # rep index -> (vector, lattice, volume, version, map stretches)
+        self.trees = []     # (cKDTree, rep indices, versions), largest first
+        self.buffer = []    # (rep index, version, descriptor) not in a tree yet
+        # running bounds over every fingerprint ever added (stay valid after replacements)
+        self.max_volume = 0.0
+        self.max_top = 0.0
+        self.ref_smax = 1.0   # largest / smallest stretch rep cell -> reference cell
+        self.ref_smin = 1.0
+        self.map_smax = 1.0   # largest / smallest stretch of a basis map fit() may use
+        self.map_smin = 1.0
+        self.version = 0
+
+    def put(self, j, key, vector, lattice, volume):
+        smax, smin = _stretches(np.linalg.solve(lattice, np.linalg.inv(self.ref_inv)))
+        try:
+            stretch = mapping_stretches(lattice, self.ltol, self.angle_tol)
+        except Exception:
+            stretch = (np.inf, 0.0)   # no bound: the pair is always kept
+        self.version += 1
+        self.entries[j] = (vector, lattice, volume, self.version, stretch)
+        self.max_volume = max(self.max_volume, volume)
+        self.max_top = max(self.max_top, float(vector.max(initial=0.0)))
+        self.ref_smax = max(self.ref_smax, float(smax))
+        self.ref_smin = min(self.ref_smin, float(smin))
+        self.map_smax = max(self.map_smax, stretch[0])
+        self.map_smin = min(self.map_smin, stretch[1])
+        self.buffer.append((j, self.version, descriptor(key, vector)))
+        if len(self.buffer) >= self.BUFFER:
+            self._flush()
+
+    def remove(self, j):
+        self.entries.pop(j, None)
+
+    def _live(self, j, version):
+        entry = self.entries.get(j)
+        return entry is not None and entry[3] == version
+
+    def _flush(self):
+        points = [(j, v, desc) for j, v, desc in self.buffer if self._live(j, v)]
+        self.buffer = []
+        while self.trees and len(self.trees[-1][1]) <= len(points):
+            tree, ids, versions = self.trees.pop()
+            points += [(j, v, tree.data[k]) for k, (j, v) in enumerate(zip(ids, versions)) if self._live(j, v)]
+        if points:
+            self.trees.append((cKDTree(np.stack([p[2] for p in points])),
+                               [p[0] for p in points], [p[1] for p in points]))
+
+    def radius(self, vector, lattice, volume):
+        """Upper bound of the pair bound of this structure with any representative."""
+        smax, smin = _stretches(self.ref_inv @ lattice)
+        # stretches of the deformation rep cell -> this cell
+        hi, lo = self.ref_smax * float(smax), self.ref_smin * float(smin)
+        eps = _strain(self.map_smax / lo, self.map_smin / hi) if _strain(hi, lo) <= MAP_MARGIN else np.inf
+        return eps, max(self.max_volume, volume), self.max_top
+
+    def query(self, key, fp_vector, r):
+        """Rep indices whose descriptor lies within Chebyshev distance r."""
+        desc = descriptor(key, fp_vector)
+        found = []
+        for tree, ids, versions in self.trees:
+            for k in tree.query_ball_point(desc, r, p=np.inf):
+                if self._live(ids[k], versions[k]):
+                    found.append(ids[k])
+        if self.buffer:
+            near = np.abs(np.stack([b[2] for b in self.buffer]) - desc).max(axis=1) <= r
+            found += [j for (j, v, _), ok in zip(self.buffer, near) if ok and self._live(j, v)]
+        return found
+
+class FingerprintFilter:
+    """
+    Fingerprints of the representatives of one sub-bucket, by their index
+    in the reps list; candidates() gives, in that order, the ones a new
+    structure may match. Representatives are looked up in a spatial index
+    (_KeyIndex) instead of being scanned, so a sub-bucket of n structures
+    costs about n log n lookups rather than n^2 comparisons.
+    """
+
+    def __init__(self, stol, ltol, angle_tol):
+        self.stol = stol
+        self.ltol = ltol
+        self.angle_tol = angle_tol
+        self.n = 0
+        self.key_of = {}    # rep index -> key
+        self.indexes = {}   # key -> _KeyIndex
+        self.unknown = []   # rep indices without a fingerprint: always candidates
+
+    def add(self, fp):
+        """Append the fingerprint of a new representative (None: unknown, always a candidate)."""
+        self.n += 1
+        self.replace(self.n - 1, fp)
+
+    def replace(self, j, fp):
+        """Representative j was replaced by the structure of fingerprint fp (or None)."""
+        old = self.key_of.pop(j, None)
+        if old is not None:
+            self.indexes[old].remove(j)
+        elif j in self.unknown:
+            self.unknown.remove(j)
+        if fp is None:
+            self.unknown.append(j)
+            return
+        key, vector, lattice, volume = fp
+        try:
+            if key not in self.indexes:
+                self.indexes[key] = _KeyIndex(lattice, self.ltol, self.angle_tol)
+            self.indexes[key].put(j, key, vector, lattice, volume)
+        except np.linalg.LinAlgError:
+            self.unknown.append(j)   # singular cell
+            return
+        self.key_of[j] = key
+
+    def candidates(self, fp):
+        """Indices of the representatives the structure of fingerprint fp may match, ascending."""
+        key, vector, lattice, volume = fp
+        unknown = np.array(self.unknown, dtype=np.int64)
+        index = self.indexes.get(key)
+        if index is None:
+            return np.sort(unknown)
+        nsites = max(len(vector), 1)
+        top = float(vector.max(initial=0.0))
+        try:
+            with np.errstate(all="ignore"):
+                eps, vmax, rep_top = index.radius(vector, lattice, volume)
+                d = self.stol * (1.0 + eps) * (vmax / nsites) ** (1.0 / 3.0)
+                r = 2.0 * d + eps * (rep_top + top)
+            near = index.query(key, vector, r * (1.0 + 1e-9) + 1e-9) if np.isfinite(r) else list(index.entries)
+        except np.linalg.LinAlgError:
+            near = list(index.entries)
+        if not near:
+            return np.sort(unknown)
+
+        # exact bound for the representatives the index returned
+        idx = np.array(sorted(near), dtype=np.int64)
+        vectors = np.stack([index.entries[j][0] for j in idx])
+        lattices = np.stack([index.entries[j][1] for j in idx])
+        volumes = np.array([index.entries[j][2] for j in idx])
+        map_smax, map_smin = np.array([index.entries[j][4] for j in idx]).T
+        try:
+            with np.errstate(all="ignore"):
+                smax, smin = _stretches(np.linalg.solve(lattices, lattice[None, :, :]))
+                # the basis map of fit() is a rep map composed with this deformation
+                eps = np.where(_strain(smax, smin) <= MAP_MARGIN, _strain(map_smax / smin, map_smin / smax), np.inf)
+        except np.linalg.LinAlgError:
+            return np.union1d(idx, unknown)
+        d = self.stol * (1.0 + eps) * (np.maximum(volumes, volume) / nsites) ** (1.0 / 3.0)
+        bound = 2.0 * d + eps * (vectors.max(axis=1, initial=0.0) + top) + 1e-9
+        gap = np.abs(vectors - vector[None, :]).max(axis=1, initial=0.0)
+        # NaN (singular or broken cells) keeps the pair
+        return np.union1d(idx[~(gap > bound)], unknown)
@@ -0,0 +1,33 @@
+"""
+Vectorized lattice geometry (NumPy).
+
+Lattice matrices hold the a, b, c vectors as rows (the vasprun.xml
+`basis` layout and pymatgen's Lattice.matrix). All functions accept a
+single (3, 3) matrix or a stack of shape (..., 3, 3).
+"""
+
+import numpy as np
+
+def lattice_parameters(matrix):
+    """
+    Return (abc, angles, volume) for lattice matrix/matrices:
+      abc     (..., 3)  vector lengths a, b, c
+      angles  (..., 3)  alpha (b^c), beta (a^c), gamma (a^b) in degrees
+      volume  (...)     |det(matrix)|
+    """
+    m = np.asarray(matrix, dtype=np.float64)
+    abc = np.linalg.norm(m, axis=-1)
+    a, b, c = m[..., 0, :], m[..., 1, :], m[..., 2, :]
+    dots = np.stack([
+        np.einsum("...i,...i->...", b, c),
+        np.einsum("...i,...i->...", a, c),
+        np.einsum("...i,...i->...", a, b),
+    ], axis=-1)
+    norms = np.stack([abc[..., 1] * abc[..., 2], abc[..., 0] * abc[..., 2], abc[..., 0] * abc[..., 1]], axis=-1)
+    angles = np.degrees(np.arccos(np.clip(dots / norms, -1.0, 1.0)))
+    volume = np.abs(np.linalg.det(m))
+    return abc, angles, volume
+
+def frac_to_cart(frac, matrix):
+    """Fractional coordinates (..., n_atoms, 3) -> Cartesian, one matrix multiply per lattice."""
+    return np.asarray(frac, dtype=np.float64) @ np.asarray(matrix, dtype=np.float64)
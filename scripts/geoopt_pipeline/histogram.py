@@ -0,0 +1,156 @@
+"""
+Fixed-memory histograms for the distribution script.
+
+Bins sit on the global grid [k*w, (k+1)*w) of the bin width w, so values
+can be binned batch by batch with NumPy before the overall minimum and
+maximum are known; only the per-bin counts, the running min/max and the
+number of values are kept. edges_counts() then gives exactly the table
+the former list-based make_hist() built from all values (bins from the
+bin below the minimum to the bin above the maximum, top edge value in the
+last bin). Histograms of the same width merge by adding counts, so
+partial results of parallel workers can be combined.
+
+The long-form table (TABLE_HEADER: quantity, bin_start, bin_end, count)
+is what the distribution script writes (table_rows(), the make_hist()
+bins) and the plotting script saves (grid_rows(), the bins it draws), and
+what the plotting script reads back with read_table() to redraw figures
+without the dataset.
+"""
+
+import csv
+import math
+
+import numpy as np
+
+from .fileio import open_file
+
+TABLE_HEADER = ["quantity", "bin_start", "bin_end", "count"]
+
+# Values this close to a bin edge (in bin units) are counted per distinct
+# value and binned at the end exactly like make_hist() did, since floating
+# point rounding can put them on either side of the edge
+EDGE_TOL = 1e-6
+
+class StreamingHistogram:
+    def __init__(self, bin_width):
+        self.bin_width = bin_width
+        self.counts = {}      # global bin index k -> count
+        self.edge_values = {}  # value -> count, for values at or next to a bin edge
+        self.n = 0
+        self.min = None
+        self.max = None
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return self
+        self.n += len(values)
+        vmin, vmax = float(values.min()), float(values.max())
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+
+        q = values / self.bin_width
+        k = np.floor(q)
+        near = np.abs(q - np.round(q)) < EDGE_TOL
+        if near.any():
+            edge, edge_counts = np.unique(values[near], return_counts=True)
+            for v, count in zip(edge.tolist(), edge_counts.tolist()):
+                self.edge_values[v] = self.edge_values.get(v, 0) + count
+            k = k[~near]
+        keys, counts = np.unique(k.astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.counts[key] = self.counts.get(key, 0) + count
+        return self
+
+    def merge(self, other):
+        if other.bin_width != self.bin_width:
+            raise ValueError("Cannot merge histograms with different bin widths")
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        for v, count in other.edge_values.items():
+            self.edge_values[v] = self.edge_values.get(v, 0) + count
+        self.n += other.n
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+        return self
+
+    def __len__(self):
+        return self.n
+
+    def edges_counts(self):
+        """(edges, counts) lists as make_hist(values, bin_width) returned them."""
+        bin_width = self.bin_width
+        start_bin = math.floor(self.min / bin_width) * bin_width
+        end_bin = math.ceil(self.max / bin_width) * bin_width
+        if end_bin == start_bin:
+            end_bin = start_bin + bin_width
+        num_bins = int(round((end_bin - start_bin) / bin_width))
+        edges = [start_bin + i * bin_width for i in range(num_bins + 1)]
+        counts = [0] * num_bins
+        first = math.floor(self.min / bin_width)
+        for key, count in self.counts.items():
+            idx = min(max(key - first, 0), num_bins - 1)
+            counts[idx] += count
+        for v, count in self.edge_values.items():
+            idx = int((v - start_bin) // bin_width)
+            idx = min(max(idx, 0), num_bins - 1)
+            counts[idx] += count
+        return edges, counts
+
+    def bin_counts(self):
+        """{global bin index k: count}; a value on an edge counts in the bin it starts."""
+        counts = dict(self.counts)
+        for v, count in self.edge_values.items():
+            key = int(round(v / self.bin_width))
+            counts[key] = counts.get(key, 0) + count
+        return counts
+
+def table_rows(label, hist):
+    """Rows of the long-form table (TABLE_HEADER) for one histogram."""
+    edges, counts = hist.edges_counts()
+    return [[label, edges[i], edges[i+1], counts[i]] for i in range(len(counts))]
+
+def grid_rows(label, hist):
+    """
+    Rows of the long-form table for the global grid bins of bin_counts(),
+    from the lowest to the highest non-empty bin: the bins a figure drawn
+    from the histogram shows (a value on an edge in the bin it starts).
+    """
+    counts = hist.bin_counts()
+    if not counts:
+        return []
+    w = hist.bin_width
+    return [[label, k * w, (k + 1) * w, counts.get(k, 0)] for k in range(min(counts), max(counts) + 1)]
+
+def read_table(path):
+    """
+    {quantity: (bin_width, {global bin index k: count})} of a long-form
+    table; the width of each quantity is taken from its first row, and
+    bins are mapped onto the global grid of that width.
+    """
+    out = {}
+    with open_file(path, "r", newline="") as f:
+        for rec in csv.DictReader(f):
+            start, end = float(rec["bin_start"]), float(rec["bin_end"])
+            name = rec["quantity"]
+            if name not in out:
+                out[name] = (end - start, {})
+            width, counts = out[name]
+            key = int(round(start / width))
+            counts[key] = counts.get(key, 0) + int(float(rec["count"]))
+    return out
+
+def rebin(counts, width, new_width):
+    """
+    Counts of the grid of `width` merged into bins of the nearest whole
+    multiple of it to `new_width`: (counts, actual width).
+    """
+    factor = max(1, int(round(new_width / width)))
+    if factor == 1:
+        return dict(counts), width
+    merged = {}
+    for key, count in counts.items():
+        merged[key // factor] = merged.get(key // factor, 0) + count
+    return merged, width * factor
@@ -0,0 +1,91 @@
+"""
+Incremental reader for the top-level JSON list of an intermediate data
+file: yields one element at a time, so a file is never held in memory
+as a whole (json.load would build every step of every geo_opt folder).
+"""
+
+import json
+
+CHUNK_CHARS = 1 << 20
+_WS = " \t\n\r"
+_NUMBER_CHARS = "0123456789+-.eE"
+# Longest token a chunk border can cut so that the decoder reports an error
+# before the end of the buffer: '-Infinit' (8 chars), a '\uXXXX' escape
+_CUT_TOKEN_CHARS = 8
+
+def _cut_at_end(exc, buf):
+    """
+    True when a raw_decode error can come from the element continuing past
+    the end of buf (retry with more text), False for malformed input.
+    """
+    return exc.pos >= len(buf) - _CUT_TOKEN_CHARS or exc.msg.startswith("Unterminated string")
+
+def iter_json_array(f, chunk_chars=CHUNK_CHARS):
+    """
+    Yield the elements of the JSON array read from text stream `f`.
+    A document that is valid JSON but not an array yields nothing;
+    malformed input raises json.JSONDecodeError like json.load.
+    """
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_chars)
+    pos = 0
+    eof = not buf
+
+    def fill():
+        # Drop what has been consumed and append the next chunk
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_chars)
+        buf = buf[pos:] + chunk
+        pos = 0
+        eof = not chunk
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WS:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    skip_ws()
+    if pos >= len(buf) or buf[pos] != "[":
+        # Not an array: validate the document the way json.load would, yield nothing
+        rest = buf[pos:] + f.read()
+        json.loads(rest)
+        return
+    pos += 1
+
+    first = True
+    while True:
+        skip_ws()
+        if pos >= len(buf):
+            raise json.JSONDecodeError("Unterminated array", buf, pos)
+        if buf[pos] == "]":
+            pos += 1
+            skip_ws()
+            if pos < len(buf):
+                raise json.JSONDecodeError("Extra data", buf, pos)
+            return
+        if not first:
+            if buf[pos] != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+            pos += 1
+            skip_ws()
+        first = False
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as exc:
+                # a corrupt element is reported at once instead of buffering the rest of the file
+                if eof or not _cut_at_end(exc, buf):
+                    raise
+                fill()  # element continues in the next chunk
+                continue
+            if not eof and not buf[end:].strip(_NUMBER_CHARS):
+                # A number may be cut at the chunk border ('1.' + '5'): decode again with more text
+                fill()
+                continue
+            break
+        pos = end
+        yield value
@@ -0,0 +1,204 @@
+"""
+Energy and component-wise force ranges (range_energy_force_from_csv.py,
+run-pipeline.py), from dataset rows or from the extractor's per-step
+statistics sidecars (stepstats).
+"""
+
+import csv
+import math
+from typing import Iterable, Tuple
+
+import numpy as np
+
+from .columnar import energy_array, is_columnar, iter_batches, vec3_arrays
+from .fileio import open_file
+from .filters import parse_float
+from .records import force_bounds, json_field
+from .selection import StepSelector
+from .stepstats import iter_stats
+
+def iter_force_triplets(forces_field) -> Iterable[Tuple[float, float, float]]:
+    """
+    Yield (fx, fy, fz) tuples from a forces field (JSON string or already parsed).
+    Accepts formats like:
+      [[fx, fy, fz], ...]  or  [{"fx":..,"fy":..,"fz":..}, ...]  or {"x":..,"y":..,"z":..}
+    """
+    try:
+        data = json_field(forces_field)
+    except Exception:
+        return  # malformed JSON -> no yields
+
+    # Normalize to a list of triplets (even if it's a single dict)
+    if isinstance(data, dict):
+        data = [data]
+
+    if not isinstance(data, list):
+        return
+
+    for item in data:
+        fx = fy = fz = None
+        if isinstance(item, (list, tuple)) and len(item) >= 3:
+            fx, fy, fz = item[0], item[1], item[2]
+        elif isinstance(item, dict):
+            # try common keys
+            for kx, ky, kz in (("fx", "fy", "fz"), ("x", "y", "z")):
+                if kx in item and ky in item and kz in item:
+                    fx, fy, fz = item[kx], item[ky], item[kz]
+                    break
+        # Convert to floats if possible
+        fx = parse_float(fx)
+        fy = parse_float(fy)
+        fz = parse_float(fz)
+        if fx is not None and fy is not None and fz is not None:
+            yield (fx, fy, fz)
+
+class EnergyForceRanges:
+    """Running min/max of Energy and of each force component over rows."""
+
+    def __init__(self):
+        self.E_min = math.inf
+        self.E_max = -math.inf
+        self.n_energy = 0
+        self.n_energy_invalid = 0
+
+        self.Fx_min = math.inf; self.Fx_max = -math.inf
+        self.Fy_min = math.inf; self.Fy_max = -math.inf
+        self.Fz_min = math.inf; self.Fz_max = -math.inf
+        self.n_force_vecs = 0
+        self.n_rows_forces_missing = 0
+
+    def add(self, row):
+        # ENERGY
+        e = parse_float(row.get("Energy", None))
+        if e is None:
+            self.n_energy_invalid += 1
+        else:
+            self.E_min = e if e < self.E_min else self.E_min
+            self.E_max = e if e > self.E_max else self.E_max
+            self.n_energy += 1
+
+        # FORCES: from the summary cells when the row has them (records.SUMMARY_COLUMNS)
+        summary = force_bounds(row)
+        if summary is not None:
+            natoms, (fx_lo, fx_hi, fy_lo, fy_hi, fz_lo, fz_hi) = summary
+            self.Fx_min = min(self.Fx_min, fx_lo); self.Fx_max = max(self.Fx_max, fx_hi)
+            self.Fy_min = min(self.Fy_min, fy_lo); self.Fy_max = max(self.Fy_max, fy_hi)
+            self.Fz_min = min(self.Fz_min, fz_lo); self.Fz_max = max(self.Fz_max, fz_hi)
+            self.n_force_vecs += natoms
+            return
+        forces_field = row.get("Forces", "")
+        had_any = False
+        for fx, fy, fz in iter_force_triplets(forces_field):
+            had_any = True
+            self.Fx_min = fx if fx < self.Fx_min else self.Fx_min
+            self.Fx_max = fx if fx > self.Fx_max else self.Fx_max
+            self.Fy_min = fy if fy < self.Fy_min else self.Fy_min
+            self.Fy_max = fy if fy > self.Fy_max else self.Fy_max
+            self.Fz_min = fz if fz < self.Fz_min else self.Fz_min
+            self.Fz_max = fz if fz > self.Fz_max else self.Fz_max
+            self.n_force_vecs += 1
+        if not had_any:
+            self.n_rows_forces_missing += 1
+
+    def update(self, rows):
+        for row in rows:
+            self.add(row)
+        return self
+
+    def add_batch(self, batch):
+        """Same as add() for every row of an Arrow RecordBatch with Energy and Forces columns."""
+        energy, valid = energy_array(batch.column("Energy"))
+        n_vec, forces = vec3_arrays(batch.column("Forces"))
+
+        self.n_energy_invalid += int((~valid).sum())
+        energy = energy[valid]
+        self.n_energy += len(energy)
+        energy = energy[~np.isnan(energy)]  # NaN never wins a comparison in add()
+        if len(energy):
+            self.E_min = min(self.E_min, float(energy.min()))
+            self.E_max = max(self.E_max, float(energy.max()))
+
+        self.n_force_vecs += len(forces)
+        self.n_rows_forces_missing += int((n_vec == 0).sum())
+        for k, comp in enumerate(("Fx", "Fy", "Fz")):
+            col = forces[:, k]
+            col = col[~np.isnan(col)]
+            if len(col):
+                setattr(self, comp + "_min", min(getattr(self, comp + "_min"), float(col.min())))
+                setattr(self, comp + "_max", max(getattr(self, comp + "_max"), float(col.max())))
+        return self
+
+    def update_file(self, path):
+        """Add every row of a dataset file; columnar files are read as Energy/Forces arrays only."""
+        if is_columnar(path):
+            for batch in iter_batches(path, ["Energy", "Forces"]):
+                self.add_batch(batch)
+            return self
+        with open_file(path, "r", newline="") as f:
+            return self.update(csv.DictReader(f))
+
+    def add_stats(self, rec):
+        """Same as add() for one step of a statistics sidecar (stepstats.iter_stats)."""
+        e = rec["energy"]
+        if e is None:
+            self.n_energy_invalid += 1
+        else:
+            self.E_min = min(self.E_min, e)
+            self.E_max = max(self.E_max, e)
+            self.n_energy += 1
+        if not rec["natoms"]:
+            self.n_rows_forces_missing += 1
+            return
+        self.n_force_vecs += int(rec["natoms"])
+        for comp in ("Fx", "Fy", "Fz"):
+            lo, hi = rec[comp.lower() + "_min"], rec[comp.lower() + "_max"]
+            setattr(self, comp + "_min", min(getattr(self, comp + "_min"), lo))
+            setattr(self, comp + "_max", max(getattr(self, comp + "_max"), hi))
+
+    def update_stats_files(self, paths, selected=False):
+        """
+        Add the steps of statistics sidecars; selected=True only those the
+        every-10th selection of the combine step keeps (steps the extractor
+        already selected with --select-every are all kept). No force array is read.
+        """
+        for path in paths:
+            records = iter_stats(path)
+            if selected:
+                records = StepSelector().update(records).selected()
+            for rec in records:
+                self.add_stats(rec)
+        return self
+
+    def print_summary(self):
+        print("=== Summary: Energy & Force Ranges ===")
+        if self.n_energy > 0:
+            print(f"Energy range (eV): min={self.E_min:.6f}, max={self.E_max:.6f}  | parsed={self.n_energy}, invalid/missing={self.n_energy_invalid}")
+        else:
+            print(f"Energy: no valid values found. invalid/missing rows={self.n_energy_invalid}")
+
+        if self.n_force_vecs > 0:
+            print(f"Force component ranges (eV/Å):")
+            print(f"  Fx: min={self.Fx_min:.6e}, max={self.Fx_max:.6e}")
+            print(f"  Fy: min={self.Fy_min:.6e}, max={self.Fy_max:.6e}")
+            print(f"  Fz: min={self.Fz_min:.6e}, max={self.Fz_max:.6e}")
+            print(f"Total force vectors parsed: {self.n_force_vecs}  | rows with no/invalid forces: {self.n_rows_forces_missing}")
+        else:
+            print(f"Forces: no valid vectors found. rows with no/invalid forces: {self.n_rows_forces_missing}")
+
+    def write_csv(self, out_csv):
+        """Write a tiny CSV summary."""
+        with open_file(out_csv, "w", newline="") as fout:
+            w = csv.writer(fout)
+            w.writerow(["metric", "min", "max", "count_or_note"])
+            if self.n_energy > 0:
+                w.writerow(["Energy (eV)", f"{self.E_min:.6f}", f"{self.E_max:.6f}", f"parsed={self.n_energy}; invalid={self.n_energy_invalid}"])
+            else:
+                w.writerow(["Energy (eV)", "", "", f"parsed=0; invalid={self.n_energy_invalid}"])
+            if self.n_force_vecs > 0:
+                w.writerow(["Fx (eV/Å)", f"{self.Fx_min:.6e}", f"{self.Fx_max:.6e}", f"vectors={self.n_force_vecs}"])
+                w.writerow(["Fy (eV/Å)", f"{self.Fy_min:.6e}", f"{self.Fy_max:.6e}", f"vectors={self.n_force_vecs}"])
+                w.writerow(["Fz (eV/Å)", f"{self.Fz_min:.6e}", f"{self.Fz_max:.6e}", f"vectors={self.n_force_vecs}"])
+            else:
+                w.writerow(["Fx (eV/Å)", "", "", f"vectors=0"])
+                w.writerow(["Fy (eV/Å)", "", "", f"vectors=0"])
+                w.writerow(["Fz (eV/Å)", "", "", f"vectors=0"])
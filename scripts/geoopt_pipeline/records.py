@@ -0,0 +1,224 @@
+"""
+Dataset rows shared by the combine, filter, dedup and range stages.
+
+A row is a dict keyed by HEADERS. When read from a consolidated CSV the
+Structure/Forces/Stress values are JSON strings; rows built in memory
+(combine_rows, run-pipeline.py) hold the parsed dict/lists instead, and
+every stage accepts both. to_csv_row() serializes either kind.
+
+CSV files also carry the SUMMARY_COLUMNS after HEADERS: numbers derived
+from Forces (and Energy) when the row is written, so filters and range
+checks can compare a few numeric cells instead of decoding the Forces
+JSON of every row (see force_bounds()):
+
+  NAtoms                    number of force vectors (one per atom)
+  FxMin ... FzMax           per-component force min/max, eV/Å
+  FxAbsMax ... FzAbsMax     largest |Fx|, |Fy|, |Fz|, eV/Å
+  FNormMax                  largest atomic force norm, eV/Å
+  EnergyPerAtom             Energy / NAtoms, eV
+
+They are empty when Forces is not a finite [[fx, fy, fz], ...] array;
+readers then fall back to the Forces JSON of that row.
+"""
+
+import os
+import json
+import re
+
+import numpy as np
+
+from .fileio import has_suffix, strip_compression_suffix
+from .selection import geo_idx, make_selector, select_steps
+from .trajectory import TRAJECTORY_SUFFIX, iter_steps
+
+# CSV headers (unchanged)
+HEADERS = ["Structure", "Energy", "Forces", "Stress", "Directory", "Step"]
+
+JSON_FIELDS = ("Structure", "Forces", "Stress")
+
+FORCE_BOUND_COLUMNS = ["FxMin", "FxMax", "FyMin", "FyMax", "FzMin", "FzMax"]
+SUMMARY_COLUMNS = (["NAtoms"] + FORCE_BOUND_COLUMNS
+                   + ["FxAbsMax", "FyAbsMax", "FzAbsMax", "FNormMax", "EnergyPerAtom"])
+
+# Header of the consolidated CSV files
+CSV_HEADERS = HEADERS + SUMMARY_COLUMNS
+
+def row_from_step(step_data, directory_name):
+    """In-memory row for one step record; None when it has no structure."""
+    structure_info = step_data.get('structure', {})
+    if not structure_info:
+        return None
+    return {
+        "Structure": structure_info,
+        "Energy": step_data.get('energy', "N/A"),
+        "Forces": step_data.get('forces', []),
+        "Stress": step_data.get('stress', []),
+        "Directory": directory_name,
+        "Step": step_data.get('step', 0),
+    }
+
+def to_csv_row(row):
+    """
+    List of CSV cells in CSV_HEADERS order; parsed JSON fields are dumped.
+    Summary cells the row already has (read from a CSV) are kept, the
+    others are computed from its Forces and Energy.
+    """
+    cells = [json.dumps(row[h]) if h in JSON_FIELDS and not isinstance(row[h], str) else row[h]
+             for h in HEADERS]
+    if all(c in row for c in SUMMARY_COLUMNS):
+        return cells + [row[c] for c in SUMMARY_COLUMNS]
+    summary = row_summary(row)
+    return cells + ["" if summary[c] is None else summary[c] for c in SUMMARY_COLUMNS]
+
+def json_field(value):
+    """Parsed value of a Structure/Forces/Stress cell (JSON string or already parsed)."""
+    return json.loads(value) if isinstance(value, str) else value
+
+def row_summary(row):
+    """SUMMARY_COLUMNS values of a row (None where not available)."""
+    summary = dict.fromkeys(SUMMARY_COLUMNS)
+    try:
+        forces = np.asarray(json_field(row.get("Forces")), dtype=np.float64)
+    except Exception:
+        return summary
+    if forces.ndim != 2 or forces.shape[1] != 3 or not len(forces) or not np.isfinite(forces).all():
+        return summary
+    lo, hi = forces.min(axis=0).tolist(), forces.max(axis=0).tolist()
+    abs_max = np.abs(forces).max(axis=0).tolist()
+    summary.update(
+        NAtoms=len(forces),
+        FxMin=lo[0], FxMax=hi[0], FyMin=lo[1], FyMax=hi[1], FzMin=lo[2], FzMax=hi[2],
+        FxAbsMax=abs_max[0], FyAbsMax=abs_max[1], FzAbsMax=abs_max[2],
+        FNormMax=float(np.sqrt((forces ** 2).sum(axis=1)).max()),
+    )
+    try:
+        summary["EnergyPerAtom"] = float(row.get("Energy")) / len(forces)
+    except (TypeError, ValueError):
+        pass
+    return summary
+
+def force_bounds(row):
+    """
+    (NAtoms, [FxMin, FxMax, FyMin, FyMax, FzMin, FzMax]) from the summary
+    cells of a row, or None when the row has none (older CSV, in-memory
+    row, forces that were not a finite array) and Forces must be read.
+    """
+    try:
+        natoms = int(row["NAtoms"])
+        bounds = [float(row[c]) for c in FORCE_BOUND_COLUMNS]
+    except (KeyError, TypeError, ValueError):
+        return None
+    return natoms, bounds
+
+def list_structure_files(json_dir):
+    """Intermediate data files (.json, .npz, optionally compressed) in json_dir, in listing order."""
+    return [name for name in os.listdir(json_dir) if has_suffix(name, ('.json', TRAJECTORY_SUFFIX))]
+
+def directory_name_of(filename):
+    """'12_intermediate_data.json.gz' -> '12_intermediate_data' (the Directory column)."""
+    return os.path.splitext(strip_compression_suffix(filename))[0]
+
+def directory_sort_key(name):
+    """Natural order of Directory names: numeric prefix first ('2_...' < '10_...')."""
+    m = re.match(r"\d+", name)
+    return (0, int(m.group()), name) if m else (1, 0, name)
+
+def sorted_structure_files(json_dir):
+    """list_structure_files() in output order."""
+    return sorted(list_structure_files(json_dir), key=lambda n: directory_sort_key(directory_name_of(n)))
+
+def _row_order_key(step_data, row):
+    try:
+        step = int(row["Step"])
+    except Exception:
+        step = -1
+    return geo_idx(step_data.get("geo_opt_folder") or ""), step
+
+def file_rows(json_dir, json_filename, every_10th=True, sampling=None):
+    """
+    (step record, row) pairs of one intermediate data file, selected as in
+    combine_rows(). An unreadable file is reported and ends the iteration;
+    with every_10th=False the rows read before the error are kept.
+    """
+    json_path = os.path.join(json_dir, json_filename)
+    directory_name = directory_name_of(json_filename)
+    try:
+        if every_10th:
+            selector = make_selector(**sampling) if sampling else None
+            steps = list(select_steps(iter_steps(json_path), selector=selector))
+        else:
+            steps = iter_steps(json_path)
+        for step_data in steps:
+            row = row_from_step(step_data, directory_name)
+            if row is not None:
+                yield step_data, row
+    except json.JSONDecodeError:
+        print(f"Error reading JSON file at {json_path}")
+    except Exception as e:
+        print(f"An error occurred for {json_path}: {e}")
+
+def combine_rows(json_dir, every_10th=True, sampling=None):
+    """
+    Rows of every intermediate data file in json_dir: the selected steps
+    (selection.select_steps) or, with every_10th=False, all steps.
+    sampling: make_selector() keyword arguments for another sampling
+    policy, e.g. {"policy": "adaptive"} (default: every 10th step).
+    Files are read incrementally (trajectory.iter_steps): with selection
+    only the selected records are held in memory, without it the rows
+    are streamed (ordered_file_rows). Unreadable files are reported and
+    skipped; with every_10th=False the rows read before the error are kept.
+    Rows come in a fixed order, the same as combine.combine_parallel():
+    Directory in natural order (2_ before 10_), then geo_opt folder, then
+    Step (ordered_file_rows).
+    """
+    for json_filename in sorted_structure_files(json_dir):
+        yield from ordered_file_rows(json_dir, json_filename, every_10th, sampling)
+
+def _folder_row_counts(json_path):
+    """Rows per geo_opt folder index of one file (as many as read without error)."""
+    counts = {}
+    try:
+        for step_data in iter_steps(json_path):
+            if step_data.get("structure"):
+                key = geo_idx(step_data.get("geo_opt_folder") or "")
+                counts[key] = counts.get(key, 0) + 1
+    except Exception:
+        pass   # reported by file_rows()
+    return counts
+
+def ordered_file_rows(json_dir, json_filename, every_10th=True, sampling=None):
+    """
+    Rows of file_rows() sorted by (geo_opt folder index, Step): the order
+    select_steps() yields when the geo_opt folders of the file are listed
+    in order, whatever order the extractor found them in.
+    The selected rows are sorted in memory. With every_10th=False the rows
+    are streamed: the extractor writes the steps of a folder in order, so
+    a first pass counts the rows of each folder and the second yields the
+    rows of the folder whose turn it is, holding only those of folders
+    that come before their turn.
+    """
+    if every_10th:
+        keyed = [(_row_order_key(step_data, row), row) for step_data, row in file_rows(json_dir, json_filename, every_10th, sampling)]
+        keyed.sort(key=lambda kr: kr[0])
+        for _, row in keyed:
+            yield row
+        return
+
+    remaining = _folder_row_counts(os.path.join(json_dir, json_filename))
+    order = sorted(remaining)
+    turn = 0
+    held = {}   # folder index -> rows read before its turn
+    for step_data, row in file_rows(json_dir, json_filename, every_10th, sampling):
+        key = geo_idx(step_data.get("geo_opt_folder") or "")
+        if turn < len(order) and key == order[turn]:
+            yield row
+        else:
+            held.setdefault(key, []).append(row)
+        remaining[key] = remaining.get(key, 0) - 1
+        while turn < len(order) and remaining[order[turn]] <= 0:
+            turn += 1
+            if turn < len(order):
+                yield from held.pop(order[turn], [])
+    # rows the first pass did not see (file changed or cut short in between)
+    for key in sorted(held):
+        yield from held[key]
@@ -0,0 +1,424 @@
+"""
+Step selection shared by the combine and distribution scripts:
+every 10th ionic step of each geo_opt folder, plus the last step of the
+highest geo_opt_N folder. The sampling interval (SELECT_EVERY) can be
+changed with the `every` arguments.
+
+The extractor can apply the same rules while parsing
+(extract-all-intermediate-info.py --select-every N): the steps that are
+not selected are never decoded, and every written record carries
+"selected_every": N (PRESELECTED_KEY). Such records are already the
+selection and are passed through unchanged by select_steps/StepSelector.
+
+Sampling policies (SAMPLING_POLICIES, make_selector):
+  every     the rules above (StepSelector)
+  adaptive  keep a step when its energy, max force norm or atomic
+            positions moved far enough from the previously kept step
+            (AdaptiveSelector), so the fast-changing start of a relaxation
+            is sampled densely and the converged tail sparsely
+"""
+
+import os
+
+import numpy as np
+
+SELECT_EVERY = 10
+PRESELECTED_KEY = "selected_every"
+# Marks a step decoded only because it may be the last of its vasprun.xml
+PROVISIONAL_KEY = "_provisional"
+
+def geo_idx(name: str) -> int:
+    """
+    Map geo_opt folder name to an index:
+      'geo_opt' -> 1
+      'geo_opt_2' -> 2, etc.
+    Unknown formats return 0.
+    """
+    if name == "geo_opt":
+        return 1
+    if name.startswith("geo_opt_"):
+        try:
+            return int(name.split("_")[2])
+        except Exception:
+            return 0
+    return 0
+
+def select_steps_for_folder(entries, is_highest: bool, every: int = SELECT_EVERY):
+    """
+    entries: list of step_data dicts (must include 'step')
+    Returns a filtered list according to the rules (every=10 by default):
+      - If len(entries) < every: take only the last step (override skip-first-two).
+      - Else: take every 10th step by 'step' value (step % every == 0),
+              skipping the first two steps of this folder.
+      - If is_highest: always include the last step.
+    """
+    # Normalize and sort by step (ensure integers)
+    def parse_step(e):
+        try:
+            return int(e.get("step", -1))
+        except Exception:
+            return -1
+
+    entries_sorted = sorted(entries, key=parse_step)
+    if not entries_sorted:
+        return []
+
+    # < 10 steps: take last only
+    if len(entries_sorted) < every:
+        return [entries_sorted[-1]]
+
+    # ≥ 10 steps case
+    first_two_steps = {parse_step(entries_sorted[0]), parse_step(entries_sorted[1])}
+    selected = []
+    seen = set()
+    for e in entries_sorted:
+        s = parse_step(e)
+        if s in (-1,):
+            continue
+        if s in first_two_steps:
+            continue
+        if s % every == 0:
+            key = s
+            if key not in seen:
+                selected.append(e)
+                seen.add(key)
+
+    # Always include the last step for the highest folder
+    if is_highest:
+        last_e = entries_sorted[-1]
+        if last_e not in selected:
+            selected.append(last_e)
+
+    # Keep order by step
+    selected = sorted(selected, key=parse_step)
+    return selected
+
+def group_by_geo_opt(data):
+    """
+    Group step records by geo_opt_folder (records without a folder or step
+    are dropped). Returns (groups, highest_folder); highest_folder is None
+    when no folder name is recognized by geo_idx.
+    """
+    groups = {}
+    for step_data in data:
+        gof = step_data.get("geo_opt_folder")
+        step = step_data.get("step", None)
+        # Guard against missing essentials
+        if gof is None or step is None:
+            continue
+        groups.setdefault(gof, []).append(step_data)
+
+    # Determine the highest geo_opt folder present
+    folder_indices = {gof: geo_idx(gof) for gof in groups.keys()}
+    # Filter out unknown (idx==0) names
+    valid_folders = {gof: idx for gof, idx in folder_indices.items() if idx > 0}
+    if not valid_folders:
+        return groups, None
+    return groups, max(valid_folders, key=lambda k: valid_folders[k])
+
+class StepSelector:
+    """
+    Streaming form of group_by_geo_opt + select_steps_for_folder: feed the
+    step records one at a time with add(); per geo_opt folder only the
+    step numbers, the step % every == 0 candidates and the current last
+    step are kept, so memory follows the selected steps, not the file.
+    selected() then yields exactly what select_steps() gives for the same
+    records. Records selected by the extractor (PRESELECTED_KEY) are kept
+    as they are.
+    """
+
+    def __init__(self, every=SELECT_EVERY):
+        self.every = every
+        self.folders = {}  # gof -> {"steps": [...], "candidates": [...], "last": record, "last_step": int}
+        self.preselected = []
+
+    @staticmethod
+    def _parse_step(e):
+        try:
+            return int(e.get("step", -1))
+        except Exception:
+            return -1
+
+    def add(self, step_data):
+        gof = step_data.get("geo_opt_folder")
+        step = step_data.get("step", None)
+        # Guard against missing essentials
+        if gof is None or step is None:
+            return
+        if step_data.get(PRESELECTED_KEY):
+            self.preselected.append(step_data)
+            return
+        s = self._parse_step(step_data)
+        f = self.folders.get(gof)
+        if f is None:
+            f = self.folders[gof] = {"steps": [], "candidates": [], "last": None, "last_step": None}
+        f["steps"].append(s)
+        if s != -1 and s % self.every == 0:
+            f["candidates"].append(step_data)
+        # Stable sort order: the last record with the largest step is the folder's last step
+        if f["last_step"] is None or s >= f["last_step"]:
+            f["last"], f["last_step"] = step_data, s
+
+    def update(self, records):
+        for step_data in records:
+            self.add(step_data)
+        return self
+
+    @staticmethod
+    def _highest(folders):
+        valid_folders = {gof: geo_idx(gof) for gof in folders}
+        valid_folders = {gof: idx for gof, idx in valid_folders.items() if idx > 0}
+        if not valid_folders:
+            return None
+        return max(valid_folders, key=lambda k: valid_folders[k])
+
+    def highest_folder(self):
+        """Highest geo_opt folder fed so far (None when no name is recognized by geo_idx)."""
+        return self._highest(list(self.folders) + [e["geo_opt_folder"] for e in self.preselected])
+
+    def _select_folder(self, f, is_highest):
+        # Same rules as select_steps_for_folder
+        if len(f["steps"]) < self.every:
+            return [f["last"]]
+        first_two_steps = set(sorted(f["steps"])[:2])
+        parse_step = self._parse_step
+        selected = []
+        seen = set()
+        for e in sorted(f["candidates"], key=parse_step):
+            s = parse_step(e)
+            if s in first_two_steps:
+                continue
+            if s not in seen:
+                selected.append(e)
+                seen.add(s)
+        if is_highest:
+            last_e = f["last"]
+            if last_e not in selected:
+                selected.append(last_e)
+        return sorted(selected, key=parse_step)
+
+    def selected(self):
+        """Yield the selected records folder by folder, each folder in step order."""
+        highest_folder = self._highest(self.folders)
+        if highest_folder is not None:
+            for gof, f in self.folders.items():
+                yield from self._select_folder(f, is_highest=(gof == highest_folder))
+        yield from self.preselected
+
+# ---- Adaptive sampling ----
+
+# Default thresholds of the adaptive policy, measured from the last kept step
+ENERGY_TOL = 0.05   # eV, change of the total energy
+FORCE_TOL = 0.2     # eV/Å, change of the largest atomic force norm
+DISP_TOL = 0.05     # Å, RMS displacement of the atoms (minimum image)
+ADAPTIVE_BLOCK = 256
+
+def step_features(records):
+    """
+    Per-step arrays of a list of step records, for vectorized sampling:
+    (energy (n,), max force norm (n,), fractional positions (n, n_atoms, 3),
+    lattice matrices (n, 3, 3)). Missing values are NaN.
+    """
+    n = len(records)
+    n_atoms = max((len(r.get("structure", {}).get("sites", [])) for r in records), default=0)
+    energy = np.full(n, np.nan)
+    fmax = np.full(n, np.nan)
+    frac = np.full((n, n_atoms, 3), np.nan)
+    matrix = np.full((n, 3, 3), np.nan)
+    for i, r in enumerate(records):
+        if r.get("energy") is not None:
+            energy[i] = r["energy"]
+        forces = np.asarray(r.get("forces") or [], dtype=np.float64)
+        if forces.ndim == 2 and len(forces):
+            fmax[i] = np.sqrt((forces ** 2).sum(axis=1)).max()
+        structure = r.get("structure") or {}
+        sites = structure.get("sites", [])
+        if sites and len(sites) == n_atoms:
+            frac[i] = [site["abc"] for site in sites]
+        if structure:
+            matrix[i] = structure["lattice"]["matrix"]
+    return energy, fmax, frac, matrix
+
+def deviation_mask(features, ref, energy_tol=ENERGY_TOL, force_tol=FORCE_TOL, disp_tol=DISP_TOL):
+    """
+    Boolean mask of the steps in `features` (see step_features) that moved
+    at least one threshold away from the single reference step `ref`
+    (same tuple layout, one step). A threshold of None disables its test;
+    NaN values never pass a test.
+    """
+    energy, fmax, frac, matrix = features
+    e0, f0, frac0, _ = ref
+    mask = np.zeros(len(energy), dtype=bool)
+    with np.errstate(invalid="ignore"):
+        if energy_tol is not None:
+            mask |= np.abs(energy - e0) >= energy_tol
+        if force_tol is not None:
+            mask |= np.abs(fmax - f0) >= force_tol
+        if disp_tol is not None and frac.shape[1] and frac0.shape[0] == frac.shape[1]:
+            d = frac - frac0
+            d -= np.round(d)                          # minimum image in fractional coordinates
+            cart = np.einsum("sai,sij->saj", d, matrix)
+            rms = np.sqrt((cart ** 2).sum(axis=2).mean(axis=1))
+            mask |= rms >= disp_tol
+    return mask
+
+def adaptive_keep(features, ref, energy_tol=ENERGY_TOL, force_tol=FORCE_TOL, disp_tol=DISP_TOL):
+    """
+    Greedy adaptive sampling of consecutive steps: a step is kept when it
+    deviates from the last kept step (initially `ref`) by one of the
+    thresholds. Each kept step needs one vectorized pass over the steps
+    after it. Returns (kept indices, features of the last kept step or
+    `ref` when nothing was kept).
+    """
+    kept = []
+    start = 0
+    while start < len(features[0]):
+        rest = tuple(a[start:] for a in features)
+        hits = np.flatnonzero(deviation_mask(rest, ref, energy_tol, force_tol, disp_tol))
+        if not len(hits):
+            break
+        i = start + int(hits[0])
+        kept.append(i)
+        ref = tuple(a[i] for a in features)
+        start = i + 1
+    return kept, ref
+
+class AdaptiveSelector(StepSelector):
+    """
+    Streaming adaptive sampling with the StepSelector interface. Per
+    geo_opt folder the first step is the reference (like the first two
+    steps of the every-Nth rule, it is not kept); records are buffered in
+    blocks of ADAPTIVE_BLOCK and run through adaptive_keep(), so only the
+    kept records stay in memory. A folder where nothing moved keeps its
+    last step, and the last step of the highest folder is always kept.
+    Records are expected in step order within each folder, as written by
+    the extractor.
+    """
+
+    def __init__(self, energy_tol=ENERGY_TOL, force_tol=FORCE_TOL, disp_tol=DISP_TOL, block=ADAPTIVE_BLOCK):
+        super().__init__()
+        self.tols = (energy_tol, force_tol, disp_tol)
+        self.block = block
+
+    def add(self, step_data):
+        gof = step_data.get("geo_opt_folder")
+        step = step_data.get("step", None)
+        # Guard against missing essentials
+        if gof is None or step is None:
+            return
+        if step_data.get(PRESELECTED_KEY):
+            self.preselected.append(step_data)
+            return
+        f = self.folders.get(gof)
+        if f is None:
+            f = self.folders[gof] = {"ref": None, "buffer": [], "kept": [], "last": None}
+        f["last"] = step_data
+        if f["ref"] is None:
+            f["ref"] = tuple(a[0] for a in step_features([step_data]))
+            return
+        f["buffer"].append(step_data)
+        if len(f["buffer"]) >= self.block:
+            self._flush(f)
+
+    def _flush(self, f):
+        if not f["buffer"]:
+            return
+        kept, f["ref"] = adaptive_keep(step_features(f["buffer"]), f["ref"], *self.tols)
+        f["kept"].extend(f["buffer"][i] for i in kept)
+        f["buffer"] = []
+
+    def selected(self):
+        highest_folder = self._highest(self.folders)
+        if highest_folder is not None:
+            for gof, f in self.folders.items():
+                self._flush(f)
+                chosen = list(f["kept"])
+                if not chosen or (gof == highest_folder and chosen[-1] is not f["last"]):
+                    chosen.append(f["last"])
+                yield from chosen
+        yield from self.preselected
+
+SAMPLING_POLICIES = ("every", "adaptive")
+
+def make_selector(policy="every", every=SELECT_EVERY, energy_tol=ENERGY_TOL, force_tol=FORCE_TOL, disp_tol=DISP_TOL):
+    """New streaming selector for a sampling policy (see SAMPLING_POLICIES)."""
+    if policy == "every":
+        return StepSelector(every)
+    if policy == "adaptive":
+        return AdaptiveSelector(energy_tol, force_tol, disp_tol)
+    raise ValueError(f"Unknown sampling policy {policy!r}; expected one of {', '.join(SAMPLING_POLICIES)}")
+
+def sampling_from_env():
+    """
+    make_selector() keyword arguments from the environment of the
+    combine/distribution scripts: SAMPLING=every|adaptive and, for the
+    adaptive policy, SAMPLING_ENERGY_TOL / SAMPLING_FORCE_TOL /
+    SAMPLING_DISP_TOL ('none' disables a test).
+    """
+    def tol(name, default):
+        value = os.environ.get(name)
+        if value is None:
+            return default
+        return None if value.lower() == "none" else float(value)
+
+    return {
+        "policy": os.environ.get("SAMPLING", "every"),
+        "energy_tol": tol("SAMPLING_ENERGY_TOL", ENERGY_TOL),
+        "force_tol": tol("SAMPLING_FORCE_TOL", FORCE_TOL),
+        "disp_tol": tol("SAMPLING_DISP_TOL", DISP_TOL),
+    }
+
+def select_steps(data, every=SELECT_EVERY, selector=None):
+    """
+    Apply the selection rules to all step records of one structure file
+    (a list or any iterable, e.g. trajectory.iter_steps()).
+    Yields the selected records folder by folder, each folder in step order.
+    Nothing is yielded when no geo_opt folder name is recognized.
+    selector: a fresh selector from make_selector() for another sampling
+    policy (default: StepSelector(every)).
+    """
+    if selector is None:
+        selector = StepSelector(every)
+    yield from selector.update(data).selected()
+
+# ---- Selection while parsing (extractor --select-every) ----
+
+def is_candidate_step(step, every=SELECT_EVERY):
+    """
+    True for a step index that select_steps_for_folder may keep as an
+    every-Nth step: step % every == 0, not one of the first two steps
+    (0 and 1 in a vasprun.xml). Any other step is only needed if it turns
+    out to be the last one.
+    """
+    return step >= 2 and step % every == 0
+
+def finalize_preselected(groups, every=SELECT_EVERY):
+    """
+    groups: {geo_opt_folder: records} of one structure, in listing order,
+    as parsed with --select-every: the candidate steps plus provisional
+    records (PROVISIONAL_KEY) for steps that may be the last of their file.
+    Applies the rest of the selection rules (fewer than `every` steps,
+    last step of the highest folder) and returns the selected records,
+    tagged with PRESELECTED_KEY, exactly as select_steps() would pick them
+    from the full trajectory.
+    """
+    n_steps = {gof: max(e["step"] for e in entries) + 1 for gof, entries in groups.items() if entries}
+    highest_folder = StepSelector._highest(n_steps)
+    selected = []
+    if highest_folder is None:
+        return selected
+    for gof, entries in groups.items():
+        if not entries:
+            continue
+        last_e = max(entries, key=lambda e: e["step"])
+        if n_steps[gof] < every:
+            chosen = [last_e]
+        else:
+            chosen = [e for e in entries if not e.get(PROVISIONAL_KEY)]
+            if gof == highest_folder and last_e not in chosen:
+                chosen.append(last_e)
+        for e in sorted(chosen, key=lambda e: e["step"]):
+            e.pop(PROVISIONAL_KEY, None)
+            e[PRESELECTED_KEY] = every
+            selected.append(e)
+    return selected
@@ -0,0 +1,106 @@
+"""
+Structures as flat NumPy arrays in one shared memory block, for the
+dedup workers (dedup.deduplicate).
+
+pack_structures() turns pymatgen structure dicts into
+
+  lattice   (n, 3, 3)  lattice matrices
+  pbc       (n, 3)     periodic boundary flags
+  offsets   (n + 1,)   first site of each structure in frac/species
+  frac      (sites, 3) fractional coordinates
+  species   (sites,)   index into a table of the distinct site species
+
+share() copies them into a multiprocessing SharedMemory block and
+attach() maps that block in a worker without copying, so tasks only
+carry row indices instead of pickled row dicts. structure_at() rebuilds
+the Structure that Structure.from_dict() gives for the fields
+StructureMatcher uses (lattice, species, fractional coordinates).
+"""
+
+import json
+from multiprocessing import shared_memory
+
+import numpy as np
+from pymatgen.core import Lattice, Structure
+from pymatgen.core.sites import PeriodicSite
+
+def pack_structures(sdicts):
+    """
+    (arrays, species_table, ok) for a list of structure dicts: ok[i] is
+    False when sdicts[i] has no usable lattice or sites (its lattice row
+    is NaN and it has no sites).
+    """
+    n = len(sdicts)
+    lattice = np.full((n, 3, 3), np.nan)
+    pbc = np.ones((n, 3), dtype=np.bool_)
+    ok = np.zeros(n, dtype=np.bool_)
+    counts = np.zeros(n, dtype=np.int64)
+    frac, species = [], []
+    table, codes = [], {}
+    for i, sd in enumerate(sdicts):
+        try:
+            latt = Lattice.from_dict(sd["lattice"])
+            abc = np.array([site["abc"] for site in sd["sites"]], dtype=np.float64).reshape(-1, 3)
+            keys = [json.dumps(site["species"], sort_keys=True) for site in sd["sites"]]
+        except Exception:
+            continue
+        for key in keys:
+            if key not in codes:
+                codes[key] = len(table)
+                table.append(key)
+        lattice[i] = latt.matrix
+        pbc[i] = latt.pbc
+        ok[i] = True
+        counts[i] = len(abc)
+        frac.append(abc)
+        species.append(np.array([codes[key] for key in keys], dtype=np.int32))
+    arrays = {
+        "lattice": lattice,
+        "pbc": pbc,
+        "offsets": np.concatenate(([0], np.cumsum(counts))),
+        "frac": np.concatenate(frac) if frac else np.empty((0, 3)),
+        "species": np.concatenate(species) if species else np.empty(0, dtype=np.int32),
+    }
+    return arrays, table, ok
+
+def share(arrays):
+    """Copy arrays into a new SharedMemory block: (block, layout for attach())."""
+    layout, size = {}, 0
+    for name, a in arrays.items():
+        size = -(-size // 16) * 16
+        layout[name] = (size, a.dtype.str, a.shape)
+        size += a.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, (offset, dtype, shape) in layout.items():
+        view = np.ndarray(shape, dtype, buffer=block.buf, offset=offset)
+        view[...] = arrays[name]
+        del view
+    return block, layout
+
+def attach(name, layout):
+    """(block, arrays) of a block made by share(); the arrays are views into it."""
+    block = shared_memory.SharedMemory(name=name)
+    arrays = {key: np.ndarray(shape, dtype, buffer=block.buf, offset=offset)
+              for key, (offset, dtype, shape) in layout.items()}
+    return block, arrays
+
+def species_objects(table):
+    """Site species (as PeriodicSite.from_dict builds them) for a species table; None if invalid."""
+    cell = Lattice.cubic(1.0)
+    out = []
+    for key in table:
+        try:
+            out.append(PeriodicSite.from_dict({"species": json.loads(key), "abc": [0.0, 0.0, 0.0]}, cell).species)
+        except Exception:
+            out.append(None)
+    return out
+
+def structure_at(arrays, species, i):
+    """Structure i of packed arrays (species: species_objects() of the table)."""
+    start, end = arrays["offsets"][i], arrays["offsets"][i + 1]
+    if end == start:
+        raise ValueError(f"Structure {i} has no sites")   # as Structure.from_dict
+    if any(species[k] is None for k in arrays["species"][start:end]):
+        raise ValueError(f"Structure {i} has an invalid site species")
+    latt = Lattice(arrays["lattice"][i], pbc=tuple(bool(p) for p in arrays["pbc"][i]))
+    return Structure(latt, [species[k] for k in arrays["species"][start:end]], arrays["frac"][start:end])
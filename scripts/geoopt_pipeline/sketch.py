@@ -0,0 +1,101 @@
+"""
+Mergeable quantile sketch (t-digest) for choosing filter thresholds from
+one streaming pass.
+
+A TDigest keeps at most a few `compression` weighted centroids, small at
+both tails (the k1 arcsine scale function), so extreme percentiles such
+as 0.1% / 99.9% stay accurate while memory is fixed. Values are added in
+NumPy batches; compression groups the sorted centroids by their position
+on the scale function in one vectorized pass instead of the usual
+one-by-one merge. Digests of partial data merge into the digest of the
+whole, so parallel workers can build one each.
+"""
+
+import numpy as np
+
+COMPRESSION = 1000
+BUFFER_FACTOR = 20   # values buffered (times compression) before compressing
+
+class TDigest:
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self._buffer = []
+        self._buffered = 0
+        self.n = 0
+        self.min = None
+        self.max = None
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        self.n += len(values)
+        vmin, vmax = float(values.min()), float(values.max())
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+        self._buffer.append(values)
+        self._buffered += len(values)
+        if self._buffered >= BUFFER_FACTOR * self.compression:
+            self._compress()
+        return self
+
+    def merge(self, other):
+        other._compress()
+        if other.n:
+            self._buffer.append((other.means, other.weights))
+            self._buffered += len(other.means)
+            self.n += other.n
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        means = [self.means]
+        weights = [self.weights]
+        for part in self._buffer:
+            if isinstance(part, tuple):
+                means.append(part[0])
+                weights.append(part[1])
+            else:
+                means.append(part)
+                weights.append(np.ones(len(part)))
+        self._buffer = []
+        self._buffered = 0
+        m = np.concatenate(means)
+        w = np.concatenate(weights)
+        order = np.argsort(m, kind="stable")
+        m, w = m[order], w[order]
+
+        # Centroid of each item: the unit interval of k1(q) = delta/(2 pi) asin(2q - 1)
+        # its mid quantile falls in, so centroids stay small near q = 0 and q = 1
+        total = w.sum()
+        q_mid = (np.cumsum(w) - w / 2) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * q_mid - 1, -1, 1))
+        bucket = np.floor(k)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+        self.weights = np.add.reduceat(w, starts)
+        self.means = np.add.reduceat(m * w, starts) / self.weights
+
+    def __len__(self):
+        return self.n
+
+    def quantile(self, q):
+        """Estimated value at quantile q (0..1); None when the digest is empty."""
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs):
+        self._compress()
+        if not self.n:
+            return [None] * len(qs)
+        w = self.weights
+        centers = np.cumsum(w) - w / 2
+        # Interpolate between centroid centers; the ends are pinned to the exact min/max
+        xs = np.concatenate(([0.0], centers, [self.n]))
+        ys = np.concatenate(([self.min], self.means, [self.max]))
+        return [float(np.interp(q * self.n, xs, ys)) for q in qs]
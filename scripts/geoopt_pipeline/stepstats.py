@@ -0,0 +1,110 @@
+"""
+Per-step statistics sidecar written by the extractor next to each
+structure's intermediate data (<structure>_intermediate_stats.csv), so
+ranges and energy distributions can be answered without parsing any
+force array again. One row per step record, in the same order:
+
+  geo_opt_folder, step
+  energy           eV, empty when missing
+  natoms           number of force vectors (0 when forces are missing)
+  fx_min ... fz_max  per-component force min/max, eV/Å
+  fmax_norm        largest atomic force norm, eV/Å
+  pressure         trace(stress) / 3, kB
+  stress_max_abs   largest |stress component|, kB
+  selected_every   N for steps already selected by the extractor
+                   (--select-every, selection.PRESELECTED_KEY), else empty
+
+Empty cells mean the quantity was not available for that step.
+iter_stats() gives the selected_every value under PRESELECTED_KEY, so a
+StepSelector fed with sidecar rows keeps pre-selected steps as they are,
+the same as for the records of the intermediate data.
+"""
+
+import csv
+import os
+
+import numpy as np
+
+from .fileio import strip_compression_suffix
+from .selection import PRESELECTED_KEY
+
+STATS_SUFFIX = "_intermediate_stats.csv"
+
+STATS_COLUMNS = ["geo_opt_folder", "step", "energy", "natoms",
+                 "fx_min", "fx_max", "fy_min", "fy_max", "fz_min", "fz_max",
+                 "fmax_norm", "pressure", "stress_max_abs", PRESELECTED_KEY]
+FLOAT_COLUMNS = STATS_COLUMNS[2:-1]
+
+def stats_path_for(output_path):
+    """<dir>/12_intermediate_data.json.gz -> <dir>/12_intermediate_stats.csv"""
+    name = os.path.basename(strip_compression_suffix(output_path))
+    stem = name.split("_intermediate_data")[0]
+    return os.path.join(os.path.dirname(output_path), stem + STATS_SUFFIX)
+
+def step_stats(step_data):
+    """Sidecar row (STATS_COLUMNS order) of one step record; None for missing values."""
+    forces = np.asarray(step_data.get("forces") or [], dtype=np.float64)
+    stress = np.asarray(step_data.get("stress") or [], dtype=np.float64)
+    row = [step_data.get("geo_opt_folder"), step_data.get("step"), step_data.get("energy")]
+    if forces.ndim == 2 and forces.shape[1] == 3 and len(forces):
+        lo, hi = forces.min(axis=0), forces.max(axis=0)
+        row += [len(forces), lo[0], hi[0], lo[1], hi[1], lo[2], hi[2],
+                float(np.sqrt((forces ** 2).sum(axis=1)).max())]
+    else:
+        row += [0] + [None] * 7
+    if stress.shape == (3, 3):
+        row += [float(np.trace(stress)) / 3, float(np.abs(stress).max())]
+    else:
+        row += [None, None]
+    row.append(step_data.get(PRESELECTED_KEY) or None)
+    return [float(v) if isinstance(v, np.floating) else v for v in row]
+
+def _cell(v):
+    return "" if v is None else repr(v) if isinstance(v, float) else v
+
+def write_stats(path, rows):
+    """Write sidecar rows (from step_stats) to path, replacing it atomically."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(STATS_COLUMNS)
+        for row in rows:
+            w.writerow([_cell(v) for v in row])
+    os.replace(tmp_path, path)
+
+def append_stats(path, rows):
+    """Append sidecar rows, creating the file (with header) when needed."""
+    new = not os.path.isfile(path) or os.path.getsize(path) == 0
+    with open(path, "a", newline="") as f:
+        w = csv.writer(f)
+        if new:
+            w.writerow(STATS_COLUMNS)
+        for row in rows:
+            w.writerow([_cell(v) for v in row])
+
+def iter_stats(path):
+    """
+    Sidecar rows as dicts: geo_opt_folder str, step int, other columns
+    float or None, selected_every int (0: not pre-selected; also for
+    sidecars written before the column existed).
+    """
+    with open(path, "r", newline="") as f:
+        for rec in csv.DictReader(f):
+            out = {"geo_opt_folder": rec["geo_opt_folder"], "step": int(rec["step"])}
+            for col in FLOAT_COLUMNS:
+                v = rec.get(col)
+                out[col] = float(v) if v else None
+            out[PRESELECTED_KEY] = int(rec.get(PRESELECTED_KEY) or 0)
+            yield out
+
+def list_stats_files(stats_dir):
+    return sorted(name for name in os.listdir(stats_dir) if name.endswith(STATS_SUFFIX))
+
+def load_stats(paths):
+    """Columns of several sidecars as float64 arrays (NaN for empty cells)."""
+    columns = {col: [] for col in FLOAT_COLUMNS}
+    for path in paths:
+        for rec in iter_stats(path):
+            for col in FLOAT_COLUMNS:
+                columns[col].append(np.nan if rec[col] is None else rec[col])
+    return {col: np.asarray(values, dtype=np.float64) for col, values in columns.items()}
@@ -0,0 +1,256 @@
+"""
+Compact binary trajectory format for the per-structure intermediate data.
+
+One NumPy .npz file per structure replaces the indent=4 JSON list of
+pymatgen Structure dicts. The species table is stored once and all
+per-step quantities are dense arrays:
+
+  species          (n_atoms,)             element symbols
+  geo_opt_folders  (n_folders,)           folder names, in extraction order
+  geo_opt_index    (n_steps,)             index into geo_opt_folders
+  step             (n_steps,)             step index inside its vasprun.xml
+  energy           (n_steps,)             eV, NaN when missing
+  lattice          (n_steps, 3, 3)        lattice matrix rows (Å)
+  lattice_abc      (n_steps, 3)           a, b, c as written by the extractor
+  lattice_angles   (n_steps, 3)           alpha, beta, gamma
+  volume           (n_steps,)
+  positions        (n_steps, n_atoms, 3)  fractional coordinates
+  forces           (n_steps, n_atoms, 3)  eV/Å
+  stress           (n_steps, 3, 3)        kB
+  has_positions / has_forces / has_stress (n_steps,) bool
+  selected_every   (n_steps,)             N for steps pre-selected by the
+                                          extractor (--select-every), else 0
+
+Steps whose arrays were missing in vasprun.xml (e.g. a truncated last
+calculation) are NaN-filled and flagged False in the has_* masks, so
+iter_trajectory_steps() gives back the same records as the JSON file.
+"""
+
+import os
+import json
+
+import numpy as np
+
+from .fileio import has_suffix, open_file
+from .geometry import frac_to_cart
+from .jsonstream import iter_json_array
+
+TRAJECTORY_SUFFIX = ".npz"
+
+def _as_block(rows, shape):
+    """rows -> float64 array of `shape`, or None if it does not fit."""
+    try:
+        arr = np.asarray(rows, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    return arr if arr.shape == shape else None
+
+def save_trajectory(path, steps, compress=False):
+    """
+    Write step records (dicts as produced by the extractor) to `path`.
+    Returns the number of steps; nothing is written when there are none.
+    The file is written to a temporary name and moved into place at the end.
+    compress=True uses np.savez_compressed (smaller, slower to load).
+    """
+    steps = list(steps)
+    if not steps:
+        return 0
+
+    species = None
+    for step_data in steps:
+        sites = step_data["structure"]["sites"]
+        if sites:
+            species = [site["label"] for site in sites]
+            break
+    n_atoms = len(species) if species else 0
+    n_steps = len(steps)
+
+    folders = []
+    folder_pos = {}
+    geo_opt_index = np.empty(n_steps, dtype=np.int32)
+    step = np.empty(n_steps, dtype=np.int64)
+    energy = np.full(n_steps, np.nan)
+    lattice = np.full((n_steps, 3, 3), np.nan)
+    lattice_abc = np.full((n_steps, 3), np.nan)
+    lattice_angles = np.full((n_steps, 3), np.nan)
+    volume = np.full(n_steps, np.nan)
+    positions = np.full((n_steps, n_atoms, 3), np.nan)
+    forces = np.full((n_steps, n_atoms, 3), np.nan)
+    stress = np.full((n_steps, 3, 3), np.nan)
+    has_positions = np.zeros(n_steps, dtype=bool)
+    has_forces = np.zeros(n_steps, dtype=bool)
+    has_stress = np.zeros(n_steps, dtype=bool)
+    selected_every = np.zeros(n_steps, dtype=np.int32)
+
+    for i, step_data in enumerate(steps):
+        gof = step_data["geo_opt_folder"]
+        if gof not in folder_pos:
+            folder_pos[gof] = len(folders)
+            folders.append(gof)
+        geo_opt_index[i] = folder_pos[gof]
+        step[i] = step_data["step"]
+        if step_data.get("energy") is not None:
+            energy[i] = step_data["energy"]
+        selected_every[i] = step_data.get("selected_every") or 0
+
+        lat = step_data["structure"]["lattice"]
+        lattice[i] = lat["matrix"]
+        lattice_abc[i] = (lat["a"], lat["b"], lat["c"])
+        lattice_angles[i] = (lat["alpha"], lat["beta"], lat["gamma"])
+        volume[i] = lat["volume"]
+
+        block = _as_block([site["abc"] for site in step_data["structure"]["sites"]], (n_atoms, 3))
+        if block is not None and step_data["structure"]["sites"]:
+            positions[i] = block
+            has_positions[i] = True
+        block = _as_block(step_data.get("forces") or [], (n_atoms, 3))
+        if block is not None and step_data.get("forces"):
+            forces[i] = block
+            has_forces[i] = True
+        block = _as_block(step_data.get("stress") or [], (3, 3))
+        if block is not None:
+            stress[i] = block
+            has_stress[i] = True
+
+    tmp_path = path + ".tmp"
+    savez = np.savez_compressed if compress else np.savez
+    with open(tmp_path, 'wb') as f:
+        savez(
+            f,
+            species=np.array(species or [], dtype=str),
+            geo_opt_folders=np.array(folders, dtype=str),
+            geo_opt_index=geo_opt_index,
+            step=step,
+            energy=energy,
+            lattice=lattice,
+            lattice_abc=lattice_abc,
+            lattice_angles=lattice_angles,
+            volume=volume,
+            positions=positions,
+            forces=forces,
+            stress=stress,
+            has_positions=has_positions,
+            has_forces=has_forces,
+            has_stress=has_stress,
+            selected_every=selected_every,
+        )
+    os.replace(tmp_path, path)
+    return n_steps
+
+def load_trajectory(path):
+    """Load a trajectory file into a dict of NumPy arrays."""
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+def build_structure_dict(species, matrix, frac, abc, angles, volume):
+    """
+    pymatgen Structure dict as written by the extractor, from the lattice
+    matrix, fractional coordinates (None/empty -> no sites), the stored
+    a, b, c / alpha, beta, gamma and volume.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if frac is not None and len(frac):
+        frac = np.asarray(frac, dtype=np.float64)
+        # Same conversion as the extractor, so xyz values are identical
+        xyz = frac_to_cart(frac, matrix)
+        sites = [
+            {
+                "species": [{"element": el, "occu": 1}],
+                "abc": abc_site,
+                "properties": {},
+                "label": el,
+                "xyz": cart,
+            }
+            for el, abc_site, cart in zip(species, frac.tolist(), xyz.tolist())
+        ]
+    else:
+        sites = []
+    a, b, c = abc
+    alpha, beta, gamma = angles
+    return {
+        "@module": "pymatgen.core.structure",
+        "@class": "Structure",
+        "charge": 0.0,
+        "lattice": {
+            "matrix": matrix.tolist(),
+            "pbc": [True, True, True],
+            "a": a,
+            "b": b,
+            "c": c,
+            "alpha": alpha,
+            "beta": beta,
+            "gamma": gamma,
+            "volume": volume,
+        },
+        "properties": {},
+        "sites": sites,
+    }
+
+def structure_dict(traj, i):
+    """Rebuild the pymatgen Structure dict of step i, as written by the extractor."""
+    return build_structure_dict(
+        traj["species"].tolist(),
+        traj["lattice"][i],
+        traj["positions"][i] if traj["has_positions"][i] else None,
+        traj["lattice_abc"][i].tolist(),
+        traj["lattice_angles"][i].tolist(),
+        float(traj["volume"][i]),
+    )
+
+def iter_trajectory_steps(path, with_structure=True):
+    """
+    Yield step records in the same layout as the intermediate JSON files
+    (geo_opt_folder, step, structure, forces, stress, energy).
+    with_structure=False skips rebuilding the Structure dict, for callers
+    that only need energies and forces.
+    """
+    traj = load_trajectory(path)
+    folders = traj["geo_opt_folders"].tolist()
+    # Files written before --select-every existed have no selected_every array
+    selected_every = traj.get("selected_every")
+    for i in range(len(traj["step"])):
+        e = traj["energy"][i]
+        record = {
+            "geo_opt_folder": folders[traj["geo_opt_index"][i]],
+            "step": int(traj["step"][i]),
+        }
+        if with_structure:
+            record["structure"] = structure_dict(traj, i)
+        record["forces"] = traj["forces"][i].tolist() if traj["has_forces"][i] else []
+        record["stress"] = traj["stress"][i].tolist() if traj["has_stress"][i] else []
+        record["energy"] = None if np.isnan(e) else float(e)
+        if selected_every is not None and selected_every[i] > 0:
+            record["selected_every"] = int(selected_every[i])
+        yield record
+
+def load_steps(path, with_structure=True):
+    """
+    Step records of an intermediate data file: a .json list written by the
+    extractor (optionally .gz/.xz/.bz2/.zst compressed) or a .npz
+    trajectory. Returns None for anything else.
+    """
+    if path.endswith(TRAJECTORY_SUFFIX):
+        return list(iter_trajectory_steps(path, with_structure=with_structure))
+    if not has_suffix(path, ".json"):
+        return None
+    with open_file(path, 'r') as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else None
+
+def iter_steps(path, with_structure=True):
+    """
+    Streaming counterpart of load_steps(): yield the step records one at a
+    time (incremental JSON parse, or one .npz step at a time). Yields
+    nothing for other files or a JSON document that is not a list.
+    with_structure=False drops each record's structure as soon as it is read.
+    """
+    if path.endswith(TRAJECTORY_SUFFIX):
+        yield from iter_trajectory_steps(path, with_structure=with_structure)
+        return
+    if not has_suffix(path, ".json"):
+        return
+    with open_file(path, 'r') as f:
+        for record in iter_json_array(f):
+            if not with_structure and isinstance(record, dict):
+                record.pop("structure", None)
+            yield record
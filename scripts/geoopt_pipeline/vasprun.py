@@ -0,0 +1,42 @@
+"""
+Low-level helpers for reading vasprun.xml elements (lxml).
+"""
+
+import warnings
+
+import numpy as np
+
+def decode_varray(varray, ncols=3):
+    """
+    Decode a <varray> element (rows of <v> text) into a float64 array of
+    shape (n_rows, ncols) with a single NumPy parse of the joined text,
+    instead of one float() call per value.
+
+    Returns an empty (0, ncols) array for a missing/empty varray. Raises
+    ValueError on malformed rows (e.g. VASP's '*****' overflow fields),
+    like the per-row float() parsing it replaces.
+    """
+    if varray is None:
+        return np.empty((0, ncols))
+    n_rows = len(varray)
+    out = np.empty((n_rows, ncols))
+    if n_rows == 0:
+        return out
+    text = " ".join(v.text or "" for v in varray)
+    with warnings.catch_warnings():
+        # NumPy flags unparseable text with a DeprecationWarning (ValueError in newer releases)
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            flat = np.fromstring(text, dtype=np.float64, sep=" ")
+        except (ValueError, DeprecationWarning):
+            flat = None
+    if flat is None or flat.size != n_rows * ncols:
+        # Slow path pins down the bad row with the same error float() gives
+        for i, v in enumerate(varray):
+            row = [float(x) for x in (v.text or "").split()]
+            if len(row) != ncols:
+                raise ValueError(f"varray row {i} has {len(row)} values, expected {ncols}")
+            out[i] = row
+        return out
+    out.reshape(-1)[:] = flat
+    return out
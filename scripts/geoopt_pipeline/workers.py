@@ -0,0 +1,15 @@
+"""
+Default number of worker processes (and compression threads) for the
+pipeline stages: SLURM_CPUS_PER_TASK, then SLURM_CPUS_ON_NODE, else all
+local cores.
+"""
+
+import os
+
+# Workers: default to SLURM cpus-per-task if present, else all local cores
+def default_workers():
+    for key in ("SLURM_CPUS_PER_TASK", "SLURM_CPUS_ON_NODE"):
+        v = os.environ.get(key)
+        if v and v.isdigit() and int(v) > 0:
+            return int(v)
+    return (os.cpu_count() or 4)
@@ -6,18 +6,40 @@ python plot_energy_force_hist.py \
         --energy-xlim -950 -600 \
         --force-xlim -0.2 0.2 \
         --energy-bins 50 \
-        --force-bins 0.01
+        --force-bin-width 0.01
+
+Only the Energy and Forces columns are read, in chunks; the force
+components are binned as they are read on the global grid of
+--force-bin-width (geoopt_pipeline.histogram), so memory does not grow
+with the number of atoms. --save-hist writes those bins (and the energy
+ones) as a long-form table; --hist-table plots from such a table, e.g.
+the output of the distribution script, without the dataset, so figures
+can be redrawn with other --energy-xlim/--force-xlim in seconds:
+
+python plot_energy_force_hist.py --save-hist hist.csv
+python plot_energy_force_hist.py --hist-table hist.csv --force-xlim -0.5 0.5
 """
 
 #!/usr/bin/env python3
 import argparse
 import os
 import json
+import csv
 import math
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator, FormatStrFormatter
 
+from geoopt_pipeline.columnar import energy_array, is_columnar, iter_batches, vec3_arrays
+from geoopt_pipeline.fileio import open_file
+from geoopt_pipeline.filters import CHUNK_ROWS, decode_plain_forces
+from geoopt_pipeline.histogram import TABLE_HEADER, StreamingHistogram, grid_rows, read_table, rebin
+
+# quantity names of the long-form table (as the distribution script writes them)
+ENERGY_QUANTITY = "energy_eV"
+FORCE_QUANTITIES = [("Fx", "Fx_eV_per_A"), ("Fy", "Fy_eV_per_A"), ("Fz", "Fz_eV_per_A")]
+
 def style_axes(ax):
     ax.grid(False)
     for spine in ax.spines.values():
@@ -45,17 +67,96 @@ def parse_force_components(forces_series):
                 Fx.append(fx); Fy.append(fy); Fz.append(fz)
     return Fx, Fy, Fz
 
-def bins_from_width(xmin, xmax, width):
-    if width is None or width <= 0:
-        return 50  # fallback
-    span = xmax - xmin
-    n = max(1, int(math.ceil(span / width)))
-    return n
+def force_chunk_components(cells):
+    """
+    (n, 3) array of the force vectors of a list of Forces JSON cells, with
+    the same result as parse_force_components(); cells in the combine
+    layout are decoded together with NumPy.
+    """
+    idx, _, values = decode_plain_forces(cells)
+    parts = [values.reshape(-1, 3)]
+    done = set(idx.tolist())
+    rest = [cell for i, cell in enumerate(cells) if i not in done]
+    if rest:
+        Fx, Fy, Fz = parse_force_components(pd.Series(rest, dtype=object))
+        parts.append(np.column_stack([Fx, Fy, Fz]).reshape(-1, 3))
+    return np.concatenate(parts)
+
+def iter_energy_forces(path, energy_col, forces_col, chunk_rows=CHUNK_ROWS):
+    """
+    (energies, forces) per chunk of a dataset: the numeric energies and the
+    (n, 3) force vectors. Only the two columns are read; .parquet/.arrow
+    files are read as arrays, without any JSON.
+    """
+    if is_columnar(path):
+        for batch in iter_batches(path, [energy_col, forces_col]):
+            energy, valid = energy_array(batch.column(energy_col))
+            energy = energy[valid]
+            _, forces = vec3_arrays(batch.column(forces_col))
+            yield energy[~np.isnan(energy)], forces
+        return
+    with open_file(path, "r", newline="") as f:
+        header = next(csv.reader(f), [])
+        for col in (energy_col, forces_col):
+            if col not in header:
+                raise ValueError(f"Column '{col}' not found. Available: {header}")
+        chunks = pd.read_csv(f, names=header, usecols=[energy_col, forces_col],
+                             dtype={forces_col: str}, chunksize=chunk_rows)
+        for chunk in chunks:
+            energies = pd.to_numeric(chunk[energy_col], errors="coerce").dropna()
+            yield energies.to_numpy(dtype=np.float64), force_chunk_components(chunk[forces_col].dropna().tolist())
+
+def load_dataset(path, energy_col, forces_col, force_bin_width):
+    """Energies (array) and one StreamingHistogram per force component."""
+    energies = []
+    hists = [StreamingHistogram(force_bin_width) for _ in FORCE_QUANTITIES]
+    for energy, forces in iter_energy_forces(path, energy_col, forces_col):
+        energies.append(energy)
+        for k, hist in enumerate(hists):
+            comp = forces[:, k]
+            hist.add(comp[np.isfinite(comp)])
+    energies = np.concatenate(energies) if energies else np.empty(0)
+    return energies, hists
+
+def save_hist(path, energies, energy_width, force_hists):
+    """
+    Long-form table (TABLE_HEADER) of the energies and the force
+    histograms, on the grid bins the force figure is drawn from, so
+    --hist-table gives the same bins back.
+    """
+    rows = []
+    energies = energies[np.isfinite(energies)]
+    if len(energies):
+        rows += grid_rows(ENERGY_QUANTITY, StreamingHistogram(energy_width).add(energies))
+    for (_, quantity), hist in zip(FORCE_QUANTITIES, force_hists):
+        if len(hist):
+            rows += grid_rows(quantity, hist)
+    with open_file(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(TABLE_HEADER)
+        w.writerows(rows)
+    print(f"Saved histogram table to {path}")
+
+def table_bins(table, quantity, width):
+    """(counts, width) of one quantity of a read_table() result, merged towards `width`."""
+    table_width, counts = table[quantity]
+    counts, actual = rebin(counts, table_width, width)
+    if not math.isclose(actual, width, rel_tol=1e-6):
+        print(f"[NOTE] {quantity}: bin width {width:g} is not a multiple of the table's "
+              f"{table_width:g}; plotting with {actual:g}")
+    return counts, actual
+
+def stairs_in(counts, width, xlim):
+    """(values, edges) of the grid bins of `width` that overlap xlim."""
+    first = math.floor(xlim[0] / width + 1e-9)
+    last = max(first + 1, math.ceil(xlim[1] / width - 1e-9))
+    keys = np.arange(first, last)
+    return np.array([counts.get(k, 0) for k in keys.tolist()]), np.append(keys, last) * width
 
 def main():
     ap = argparse.ArgumentParser(description="Publication-style histograms for Energy and component-wise Forces.")
     ap.add_argument("--csv", default="consolidated_data_10th_step_filtered_E-1050_to_-500__F-100_to_100.csv",
-                    help="Input CSV with 'Energy' and JSON 'Forces' columns.")
+                    help="Input CSV with 'Energy' and JSON 'Forces' columns (may be .gz/.xz/.bz2/.zst, or a .parquet/.arrow file).")
     ap.add_argument("--energy-col", default="Energy", help="Energy column name.")
     ap.add_argument("--forces-col", default="Forces", help="Forces JSON column name.")
     # Energy display controls
@@ -72,10 +173,18 @@ def main():
     # Output files
     ap.add_argument("--energy-out", default="energy_hist.png", help="Energy figure filename.")
     ap.add_argument("--forces-out", default="forces_hist.png", help="Forces figure filename.")
+    # Precomputed histograms
+    ap.add_argument("--hist-table", default=None,
+                    help="Plot from a long-form histogram table (quantity,bin_start,bin_end,count) "
+                         "instead of --csv, e.g. the distribution script's output.")
+    ap.add_argument("--save-hist", default=None,
+                    help="Also write the energy and force bins read from --csv to this table.")
     args = ap.parse_args()
 
-    if not os.path.exists(args.csv):
-        raise FileNotFoundError(f"No such file: {args.csv}")
+    source = args.hist_table or args.csv
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"No such file: {source}")
+    energy_width = (args.energy_xlim[1] - args.energy_xlim[0]) / args.energy_bins
 
     # Global typography
     plt.rcParams.update({
@@ -88,18 +197,31 @@ def main():
         "legend.fontsize": 13,
     })
 
-    df = pd.read_csv(args.csv)
+    if args.hist_table:
+        table = read_table(args.hist_table)
+        energies = None
+        force_bins = [table_bins(table, quantity, args.force_bin_width)
+                      for _, quantity in FORCE_QUANTITIES if quantity in table]
+        labels = [label for label, quantity in FORCE_QUANTITIES if quantity in table]
+    else:
+        energies, force_hists = load_dataset(args.csv, args.energy_col, args.forces_col, args.force_bin_width)
+        if args.save_hist:
+            save_hist(args.save_hist, energies, energy_width, force_hists)
+        force_bins = [(hist.bin_counts(), args.force_bin_width) for hist in force_hists if len(hist)]
+        labels = [label for (label, _), hist in zip(FORCE_QUANTITIES, force_hists) if len(hist)]
 
     # ---------- Energy ----------
-    if args.energy_col not in df.columns:
-        raise ValueError(f"Column '{args.energy_col}' not found. Available: {list(df.columns)}")
-    energies = pd.to_numeric(df[args.energy_col], errors="coerce").dropna()
-    if energies.empty:
-        raise ValueError("No numeric energy values found to plot.")
-
     fig = plt.figure(figsize=(6.2, 4.6))
     ax = plt.gca()
-    ax.hist(energies, bins=args.energy_bins, range=(args.energy_xlim[0], args.energy_xlim[1]))
+    if energies is None:
+        if ENERGY_QUANTITY not in table:
+            raise ValueError(f"No '{ENERGY_QUANTITY}' rows in {args.hist_table}.")
+        counts, width = table_bins(table, ENERGY_QUANTITY, energy_width)
+        ax.stairs(*stairs_in(counts, width, args.energy_xlim), fill=True)
+    else:
+        if not len(energies):
+            raise ValueError("No numeric energy values found to plot.")
+        ax.hist(energies, bins=args.energy_bins, range=(args.energy_xlim[0], args.energy_xlim[1]))
     ax.set_title("Energy Distribution")
     ax.set_xlabel("Energy (eV)")
     ax.set_ylabel("Count")
@@ -114,27 +236,13 @@ def main():
     print(f"Saved energy histogram to {args.energy_out}")
 
     # ---------- Forces (Fx, Fy, Fz) ----------
-    if args.forces_col not in df.columns:
-        raise ValueError(f"Column '{args.forces_col}' not found. Available: {list(df.columns)}")
-    Fx, Fy, Fz = parse_force_components(df[args.forces_col])
-    if not (Fx or Fy or Fz):
+    if not force_bins:
         raise ValueError("No parseable force components found to plot.")
 
-    # Compute number of bins from bin WIDTH and x-limits
-    f_bins = bins_from_width(args.force_xlim[0], args.force_xlim[1], args.force_bin_width)
-
     fig = plt.figure(figsize=(6.2, 4.6))
     ax = plt.gca()
-    for comp, label in [(Fx, "Fx"), (Fy, "Fy"), (Fz, "Fz")]:
-        if comp:
-            ax.hist(
-                comp,
-                bins=f_bins,
-                range=(args.force_xlim[0], args.force_xlim[1]),
-                histtype="step",
-                linewidth=2,
-                label=label
-            )
+    for (counts, width), label in zip(force_bins, labels):
+        ax.stairs(*stairs_in(counts, width, args.force_xlim), linewidth=2, label=label)
     ax.set_title("Force Component Distributions")
     ax.set_xlabel("Force component (eV/Å)")
     ax.set_ylabel("Count")
@@ -19,131 +19,37 @@ Fz (eV/Å),-4.427018e+01,4.585486e+01,vectors=1134539
 """
 
 #!/usr/bin/env python3
-import csv
-import json
 import argparse
-import math
-from typing import Optional, Tuple, Iterable, Any
+import os
 
-def parse_float(x: Any) -> Optional[float]:
-    try:
-        return float(x)
-    except Exception:
-        return None
-
-def iter_force_triplets(forces_field: str) -> Iterable[Tuple[float, float, float]]:
-    """
-    Yield (fx, fy, fz) tuples from a JSON-encoded forces field.
-    Accepts formats like:
-      [[fx, fy, fz], ...]  or  [{"fx":..,"fy":..,"fz":..}, ...]  or {"x":..,"y":..,"z":..}
-    """
-    try:
-        data = json.loads(forces_field)
-    except Exception:
-        return  # malformed JSON -> no yields
-
-    # Normalize to a list of triplets (even if it's a single dict)
-    if isinstance(data, dict):
-        data = [data]
-
-    if not isinstance(data, list):
-        return
-
-    for item in data:
-        fx = fy = fz = None
-        if isinstance(item, (list, tuple)) and len(item) >= 3:
-            fx, fy, fz = item[0], item[1], item[2]
-        elif isinstance(item, dict):
-            # try common keys
-            for kx, ky, kz in (("fx", "fy", "fz"), ("x", "y", "z")):
-                if kx in item and ky in item and kz in item:
-                    fx, fy, fz = item[kx], item[ky], item[kz]
-                    break
-        # Convert to floats if possible
-        fx = parse_float(fx)
-        fy = parse_float(fy)
-        fz = parse_float(fz)
-        if fx is not None and fy is not None and fz is not None:
-            yield (fx, fy, fz)
+from geoopt_pipeline.ranges import EnergyForceRanges
+from geoopt_pipeline.stepstats import list_stats_files
 
 def main():
     ap = argparse.ArgumentParser(description="Extract Energy and component-wise Force ranges from CSV.")
-    ap.add_argument("--csv", required=True, help="Path to input CSV (expects columns: Energy, Forces)")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--csv", help="Path to input CSV (expects columns: Energy, Forces; may be .gz/.xz/.bz2/.zst, or a .parquet/.arrow file)")
+    src.add_argument("--stats-dir",
+                     help="Instead of a CSV: folder with the extractor's *_intermediate_stats.csv sidecars "
+                          "(ranges of the extracted steps, without reading any force array)")
+    ap.add_argument("--selected", action="store_true",
+                    help="With --stats-dir: only the steps the every-10th combine selection keeps")
     ap.add_argument("--out-csv", default="energy_force_range_summary.csv",
                     help="Optional output CSV summary filename (default: energy_force_range_summary.csv)")
     args = ap.parse_args()
 
-    E_min = math.inf
-    E_max = -math.inf
-    n_energy = 0
-    n_energy_invalid = 0
-
-    Fx_min = math.inf; Fx_max = -math.inf
-    Fy_min = math.inf; Fy_max = -math.inf
-    Fz_min = math.inf; Fz_max = -math.inf
-    n_force_vecs = 0
-    n_rows_forces_missing = 0
-
-    with open(args.csv, "r", newline="") as f:
-        r = csv.DictReader(f)
-        # --- Energy ---
-        for row in r:
-            # ENERGY
-            e = parse_float(row.get("Energy", None))
-            if e is None:
-                n_energy_invalid += 1
-            else:
-                E_min = e if e < E_min else E_min
-                E_max = e if e > E_max else E_max
-                n_energy += 1
-
-            # FORCES
-            forces_field = row.get("Forces", "")
-            had_any = False
-            for fx, fy, fz in iter_force_triplets(forces_field):
-                had_any = True
-                Fx_min = fx if fx < Fx_min else Fx_min
-                Fx_max = fx if fx > Fx_max else Fx_max
-                Fy_min = fy if fy < Fy_min else Fy_min
-                Fy_max = fy if fy > Fy_max else Fy_max
-                Fz_min = fz if fz < Fz_min else Fz_min
-                Fz_max = fz if fz > Fz_max else Fz_max
-                n_force_vecs += 1
-            if not had_any:
-                n_rows_forces_missing += 1
-
-    # Print summary
-    print("=== Summary: Energy & Force Ranges ===")
-    if n_energy > 0:
-        print(f"Energy range (eV): min={E_min:.6f}, max={E_max:.6f}  | parsed={n_energy}, invalid/missing={n_energy_invalid}")
+    if args.stats_dir:
+        paths = [os.path.join(args.stats_dir, name) for name in list_stats_files(args.stats_dir)]
+        ranges = EnergyForceRanges().update_stats_files(paths, selected=args.selected)
     else:
-        print(f"Energy: no valid values found. invalid/missing rows={n_energy_invalid}")
+        # .parquet/.arrow inputs: only the Energy and Forces columns are read
+        ranges = EnergyForceRanges().update_file(args.csv)
 
-    if n_force_vecs > 0:
-        print(f"Force component ranges (eV/Å):")
-        print(f"  Fx: min={Fx_min:.6e}, max={Fx_max:.6e}")
-        print(f"  Fy: min={Fy_min:.6e}, max={Fy_max:.6e}")
-        print(f"  Fz: min={Fz_min:.6e}, max={Fz_max:.6e}")
-        print(f"Total force vectors parsed: {n_force_vecs}  | rows with no/invalid forces: {n_rows_forces_missing}")
-    else:
-        print(f"Forces: no valid vectors found. rows with no/invalid forces: {n_rows_forces_missing}")
+    # Print summary
+    ranges.print_summary()
 
     # Write a tiny CSV summary
-    with open(args.out_csv, "w", newline="") as fout:
-        w = csv.writer(fout)
-        w.writerow(["metric", "min", "max", "count_or_note"])
-        if n_energy > 0:
-            w.writerow(["Energy (eV)", f"{E_min:.6f}", f"{E_max:.6f}", f"parsed={n_energy}; invalid={n_energy_invalid}"])
-        else:
-            w.writerow(["Energy (eV)", "", "", f"parsed=0; invalid={n_energy_invalid}"])
-        if n_force_vecs > 0:
-            w.writerow(["Fx (eV/Å)", f"{Fx_min:.6e}", f"{Fx_max:.6e}", f"vectors={n_force_vecs}"])
-            w.writerow(["Fy (eV/Å)", f"{Fy_min:.6e}", f"{Fy_max:.6e}", f"vectors={n_force_vecs}"])
-            w.writerow(["Fz (eV/Å)", f"{Fz_min:.6e}", f"{Fz_max:.6e}", f"vectors={n_force_vecs}"])
-        else:
-            w.writerow(["Fx (eV/Å)", "", "", f"vectors=0"])
-            w.writerow(["Fy (eV/Å)", "", "", f"vectors=0"])
-            w.writerow(["Fz (eV/Å)", "", "", f"vectors=0"])
+    ranges.write_csv(args.out_csv)
 
     print(f"\nSummary CSV written to: {args.out_csv}")
 
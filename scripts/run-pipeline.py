@@ -0,0 +1,97 @@
+"""
+Run the post-extraction stages in one process, on in-memory rows:
+
+  combine (every 10th step)  ->  energy/force filter  ->
+  StructureMatcher dedup     ->  energy/force range summary
+
+Same results as running combine-to-csv-at-each-10th-step.py,
+filter-en-force.py, structure-matcher.py and range_energy_force_from_csv.py
+one after the other, but the structure/force JSON is parsed once instead
+of being written to and re-read from a CSV between every stage.
+The intermediate CSVs are only written with --write-intermediate.
+
+usage (from the folder holding phosphorus_based_int_str):
+
+python run-pipeline.py --workers 32
+"""
+
+#!/usr/bin/env python3
+import os
+import argparse
+
+from geoopt_pipeline.dataset import write_rows
+from geoopt_pipeline.dedup import SM_KW, PREFER_MORE_NEGATIVE_ENERGY, deduplicate, print_match_logs
+from geoopt_pipeline.filters import EMAX, EMIN, FMAX, FMIN, filter_rows, filtered_csv_name, new_filter_counts, print_filter_summary
+from geoopt_pipeline.ranges import EnergyForceRanges
+from geoopt_pipeline.records import combine_rows
+from geoopt_pipeline.selection import DISP_TOL, ENERGY_TOL, FORCE_TOL, SAMPLING_POLICIES
+from geoopt_pipeline.workers import default_workers
+
+COMBINED_CSV = "consolidated_data_10th_step.csv"
+
+def main():
+    ap = argparse.ArgumentParser(description="Combine, filter, deduplicate and summarize the intermediate data in one pass.")
+    ap.add_argument("--json-dir", default="phosphorus_based_int_str",
+                    help="Folder with the intermediate JSON/.npz files (default: phosphorus_based_int_str)")
+    ap.add_argument("--sampling", choices=SAMPLING_POLICIES, default="every",
+                    help="Step sampling: every 10th step (default) or adaptive (energy/force/position change)")
+    ap.add_argument("--energy-tol", type=float, default=ENERGY_TOL,
+                    help=f"Adaptive sampling: energy change from the last kept step, eV (default: {ENERGY_TOL})")
+    ap.add_argument("--force-tol", type=float, default=FORCE_TOL,
+                    help=f"Adaptive sampling: change of the max force norm, eV/Å (default: {FORCE_TOL})")
+    ap.add_argument("--disp-tol", type=float, default=DISP_TOL,
+                    help=f"Adaptive sampling: RMS atomic displacement, Å (default: {DISP_TOL})")
+    ap.add_argument("--emin", type=float, default=EMIN, help=f"Lowest energy kept, eV (default: {EMIN})")
+    ap.add_argument("--emax", type=float, default=EMAX, help=f"Highest energy kept, eV (default: {EMAX})")
+    ap.add_argument("--fmin", type=float, default=FMIN, help=f"Lowest force component kept, eV/Å (default: {FMIN})")
+    ap.add_argument("--fmax", type=float, default=FMAX, help=f"Highest force component kept, eV/Å (default: {FMAX})")
+    ap.add_argument("--workers", type=int, default=0,
+                    help="Worker processes for StructureMatcher (default: SLURM cpus-per-task / all local cores)")
+    ap.add_argument("--write-intermediate", action="store_true",
+                    help=f"Also write {COMBINED_CSV} and the filtered CSV, as the separate scripts do")
+    ap.add_argument("--output", default="consolidated_data_10th_step_after_str_mat.csv",
+                    help="Deduplicated dataset, CSV or .parquet/.arrow (default: consolidated_data_10th_step_after_str_mat.csv)")
+    ap.add_argument("--range-csv", default="energy_force_range_summary.csv",
+                    help="Range summary CSV (default: energy_force_range_summary.csv)")
+    args = ap.parse_args()
+
+    base_dir = os.getcwd()
+    json_dir = os.path.join(base_dir, args.json_dir)
+    n_workers = args.workers or default_workers()
+
+    # 1) combine
+    sampling = {"policy": args.sampling, "energy_tol": args.energy_tol,
+                "force_tol": args.force_tol, "disp_tol": args.disp_tol}
+    rows = list(combine_rows(json_dir, every_10th=True, sampling=sampling))
+    print(f"[combine] {len(rows)} rows selected from {json_dir}")
+    if args.write_intermediate:
+        write_rows(os.path.join(base_dir, COMBINED_CSV), rows)
+        print(f"Consolidated data saved to {COMBINED_CSV}")
+
+    # 2) energy / force filter
+    counts = new_filter_counts()
+    rows = list(filter_rows(rows, args.emin, args.emax, args.fmin, args.fmax, counts))
+    filtered_csv = filtered_csv_name(COMBINED_CSV, args.emin, args.emax, args.fmin, args.fmax)
+    if args.write_intermediate:
+        write_rows(os.path.join(base_dir, filtered_csv), rows)
+    print_filter_summary(COMBINED_CSV, filtered_csv if args.write_intermediate else "(in memory)",
+                         counts, args.emin, args.emax, args.fmin, args.fmax)
+
+    # 3) StructureMatcher dedup
+    n_rows = len(rows)
+    kept_all, logs_all = deduplicate(rows, n_workers, SM_KW, PREFER_MORE_NEGATIVE_ENERGY)
+    write_rows(args.output, kept_all)
+    print(f"[OK] Deduplicated: kept {len(kept_all)} of {n_rows} rows")
+    print(f"[OK] Output -> {args.output}")
+    print(f"[INFO] Workers: {n_workers}")
+
+    # 4) ranges of the final dataset
+    ranges = EnergyForceRanges().update(kept_all)
+    ranges.print_summary()
+    ranges.write_csv(args.range_csv)
+    print(f"\nSummary CSV written to: {args.range_csv}")
+
+    print_match_logs(logs_all)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the scripts import geoopt_pipeline from the scripts directory
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+
+def step_record(geo_opt_folder, step, rng):
+    """One step record as the extractor writes it: a 4-atom Ni2P2 cell, slightly perturbed."""
+    from pymatgen.core import Lattice, Structure
+    lattice = Lattice.from_parameters(*(3.9 + 0.05 * rng.random(3)), 90, 90, 90)
+    frac = [[0, 0, 0], [0.5, 0.5, 0], [0.25, 0.25, 0.5], [0.75, 0.75, 0.5]] + 0.01 * rng.random((4, 3))
+    structure = Structure(lattice, ["Ni", "Ni", "P", "P"], frac)
+    return {
+        "geo_opt_folder": geo_opt_folder,
+        "step": step,
+        "structure": structure.as_dict(),
+        "energy": -20.0 + rng.random(),
+        "forces": (rng.random((4, 3)) - 0.5).tolist(),
+        "stress": (rng.random((3, 3)) - 0.5).tolist(),
+    }
+
+@pytest.fixture
+def intermediate_dir(tmp_path):
+    """
+    Intermediate data files of three structures whose names list out of
+    natural order, with the geo_opt folders written out of order.
+    """
+    rng = np.random.default_rng(0)
+    json_dir = tmp_path / "phosphorus_based_int_str"
+    json_dir.mkdir()
+    for name, folders in [("10_NiP_intermediate_data", {"geo_opt_2": 12, "geo_opt": 25}),
+                          ("2_NiP_intermediate_data", {"geo_opt": 31}),
+                          ("3_NiP_intermediate_data", {"geo_opt_3": 4, "geo_opt": 22, "geo_opt_2": 15})]:
+        steps = [step_record(gof, s, rng) for gof, n in folders.items() for s in range(n)]
+        with open(json_dir / f"{name}.json", "w") as f:
+            json.dump(steps, f)
+    return str(json_dir)
+
+def load_script(filename):
+    """Import one of the hyphen-named scripts as a module."""
+    import importlib.util
+    name = os.path.splitext(filename)[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _varray(name, rows):
+    lines = "".join(f"   <v> {' '.join(f'{x:16.8f}' for x in row)} </v>\n" for row in rows)
+    return f'  <varray name="{name}" >\n{lines}  </varray>\n'
+
+def _structure(matrix, frac, name=None):
+    attr = f' name="{name}"' if name else ""
+    return (f" <structure{attr}>\n  <crystal>\n{_varray('basis', matrix)}"
+            f"   <i name=\"volume\">{abs(np.linalg.det(matrix)):16.8f}</i>\n  </crystal>\n"
+            f"{_varray('positions', frac)} </structure>\n")
+
+def vasprun_xml(species, n_steps, rng, energy0=-600.0, big_force_steps=(), converged_from=None):
+    """
+    Text of a synthetic vasprun.xml: n_steps ionic steps of a slowly
+    relaxing cell. From step converged_from on the geometry stays put.
+    """
+    n = len(species)
+    matrix = np.diag([5.0, 5.2, 5.4])
+    frac = rng.random((n, 3))
+    parts = ['<?xml version="1.0" encoding="ISO-8859-1"?>\n<modeling>\n <generator>\n'
+             '  <i name="program" type="string">vasp </i>\n </generator>\n'
+             f' <atominfo>\n  <atoms>{n}</atoms>\n  <types>{len(set(species))}</types>\n'
+             '  <array name="atoms" >\n   <dimension dim="1">ion</dimension>\n'
+             '   <field type="string">element</field>\n   <field type="int">atomtype</field>\n   <set>\n']
+    parts += [f"    <rc><c>{sp}</c><c>   {sorted(set(species)).index(sp) + 1}</c></rc>\n" for sp in species]
+    parts += ["   </set>\n  </array>\n </atominfo>\n", _structure(matrix, frac, "initialpos")]
+    for step in range(n_steps):
+        if converged_from is None or step < converged_from:
+            matrix = matrix + 0.02 * (rng.random((3, 3)) - 0.5) * np.eye(3)
+            frac = (frac + 0.02 * (rng.random((n, 3)) - 0.5)) % 1.0
+        forces = 2.0 * (rng.random((n, 3)) - 0.5)
+        if step in big_force_steps:
+            forces[0, 0] = 150.0
+        stress = 5.0 * (rng.random((3, 3)) - 0.5)
+        energy = energy0 - 0.5 * step / n_steps + 1e-4 * rng.random()
+        parts += [" <calculation>\n  <scstep>\n   <energy>\n"
+                  f"    <i name=\"e_fr_energy\"> {energy + 1.0:16.8f} </i>\n   </energy>\n  </scstep>\n",
+                  _structure(matrix, frac), _varray("forces", forces), _varray("stress", stress),
+                  "  <energy>\n"
+                  f"   <i name=\"e_fr_energy\"> {energy:16.8f} </i>\n"
+                  f"   <i name=\"e_wo_entrp\"> {energy:16.8f} </i>\n"
+                  f"   <i name=\"e_0_energy\"> {energy:16.8f} </i>\n  </energy>\n </calculation>\n"]
+    parts.append(_structure(matrix, frac, "finalpos") + "</modeling>\n")
+    return "".join(parts)
+
+# structure folder -> geo_opt folder -> vasprun_xml() keyword arguments
+VASPRUN_TREE = {
+    "1_Ni2P2": {"geo_opt": dict(n_steps=25, big_force_steps=(10,)), "geo_opt_2": dict(n_steps=13)},
+    "2_Ni3P": {"geo_opt": dict(n_steps=8, energy0=-1100.0)},
+    "10_NiP2": {"geo_opt": dict(n_steps=34, converged_from=15)},
+}
+SPECIES = {"1_Ni2P2": ["Ni", "Ni", "P", "P"], "2_Ni3P": ["Ni", "Ni", "Ni", "P"], "10_NiP2": ["Ni", "P", "P"]}
+
+@pytest.fixture(scope="session")
+def vasprun_tree(tmp_path_factory):
+    """Folder of structure folders with geo_opt*/vasprun.xml, as the extractor expects."""
+    rng = np.random.default_rng(1)
+    base = tmp_path_factory.mktemp("calculations")
+    for folder, geo_opts in VASPRUN_TREE.items():
+        for geo_opt, kwargs in geo_opts.items():
+            (base / folder / geo_opt).mkdir(parents=True)
+            (base / folder / geo_opt / "vasprun.xml").write_text(vasprun_xml(SPECIES[folder], rng=rng, **kwargs))
+    return base
+
+def vasprun_paths(base):
+    return sorted(str(p) for p in base.glob("*/geo_opt*/vasprun.xml"))
@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from geoopt_pipeline.columnar import iter_rows
+from geoopt_pipeline.dataset import write_rows
+from geoopt_pipeline.records import HEADERS, combine_rows
+
+@pytest.mark.parametrize("suffix", [".parquet", ".arrow"])
+def test_round_trip(intermediate_dir, tmp_path, suffix):
+    rows = list(combine_rows(intermediate_dir))
+    path = str(tmp_path / f"data{suffix}")
+    assert write_rows(path, rows) == len(rows)
+    back = list(iter_rows(path, HEADERS))
+    assert len(back) == len(rows)
+    for a, b in zip(rows, back):
+        assert (a["Directory"], a["Step"], a["Energy"]) == (b["Directory"], b["Step"], b["Energy"])
+        np.testing.assert_allclose(a["Forces"], b["Forces"])
+        np.testing.assert_allclose(a["Stress"], b["Stress"])
+        np.testing.assert_allclose(a["Structure"]["lattice"]["matrix"], b["Structure"]["lattice"]["matrix"])
+        np.testing.assert_allclose([s["abc"] for s in a["Structure"]["sites"]], [s["abc"] for s in b["Structure"]["sites"]])
+
+@pytest.mark.parametrize("field, value, message", [
+    ("Structure", "{not json", "Unparsable Structure"),
+    ("Structure", json.dumps({"sites": []}), "Unparsable Structure"),
+    ("Step", "N/A", "Step is not an integer"),
+    ("Forces", "[[1.0, 2.0]]", "Malformed Forces"),
+    ("Stress", "oops", "Malformed Stress"),
+])
+def test_malformed_row_names_directory_and_step(intermediate_dir, tmp_path, field, value, message):
+    rows = list(combine_rows(intermediate_dir))
+    rows[3] = dict(rows[3], **{field: value})
+    path = tmp_path / "data.parquet"
+    with pytest.raises(ValueError, match=message) as info:
+        write_rows(str(path), rows)
+    assert repr(rows[3]["Directory"]) in str(info.value)
+    assert not path.exists() and not (tmp_path / "data.parquet.tmp").exists()
+
+def test_empty_forces_are_written_as_empty_lists(intermediate_dir, tmp_path):
+    rows = [dict(r, Forces="[]", Stress=[]) for r in combine_rows(intermediate_dir)][:3]
+    path = str(tmp_path / "data.arrow")
+    write_rows(path, rows)
+    assert [r["Forces"] for r in iter_rows(path, ["Forces"])] == [[], [], []]
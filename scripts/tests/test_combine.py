@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import step_record
+from geoopt_pipeline.combine import combine_parallel, shard_path
+from geoopt_pipeline.dataset import write_rows
+from geoopt_pipeline.records import combine_rows, ordered_file_rows
+from geoopt_pipeline.selection import AdaptiveSelector, make_selector, select_steps
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+@pytest.mark.parametrize("every_10th", [True, False])
+def test_serial_parallel_and_sharded_combine_are_identical(intermediate_dir, tmp_path, every_10th):
+    serial = str(tmp_path / "serial.csv")
+    n = write_rows(serial, combine_rows(intermediate_dir, every_10th=every_10th))
+    assert n > 0
+
+    parallel = str(tmp_path / "parallel.csv")
+    assert combine_parallel(intermediate_dir, parallel, 2, every_10th=every_10th) == n
+    assert _read(parallel) == _read(serial)
+
+    sharded = str(tmp_path / "sharded.csv")
+    assert combine_parallel(intermediate_dir, sharded, 2, every_10th=every_10th, shards=2) == n
+    parts = [_read(shard_path(sharded, i, 2)) for i in range(2)]
+    header, _, _ = parts[0].partition(b"\n")
+    merged = parts[0] + b"".join(p[len(header) + 1:] for p in parts[1:])
+    assert merged == _read(serial)
+
+def test_rows_in_directory_folder_step_order(intermediate_dir):
+    rows = list(combine_rows(intermediate_dir, every_10th=False))
+    dirs = [r["Directory"] for r in rows]
+    assert list(dict.fromkeys(dirs)) == ["2_NiP_intermediate_data", "3_NiP_intermediate_data", "10_NiP_intermediate_data"]
+    steps = [r["Step"] for r in rows if r["Directory"] == "10_NiP_intermediate_data"]
+    assert steps == list(range(25)) + list(range(12))
+
+def test_streamed_rows_of_interleaved_folders(tmp_path):
+    # follow mode appends the new steps of each folder as they come
+    rng = np.random.default_rng(1)
+    chunks = [("geo_opt_2", range(0, 3)), ("geo_opt", range(0, 5)), ("geo_opt_3", range(0, 2)),
+              ("geo_opt_2", range(3, 6)), ("geo_opt", range(5, 7))]
+    steps = [step_record(gof, s, rng) for gof, part in chunks for s in part]
+    expected = sorted(steps, key=lambda d: (d["geo_opt_folder"], d["step"]))
+    steps.insert(4, {"geo_opt_folder": "geo_opt", "step": 99})   # no structure: no row
+    with open(tmp_path / "1_NiP_intermediate_data.json", "w") as f:
+        json.dump(steps, f)
+    rows = list(ordered_file_rows(str(tmp_path), "1_NiP_intermediate_data.json", every_10th=False))
+    assert [(r["Energy"], r["Step"]) for r in rows] == [(d["energy"], d["step"]) for d in expected]
+
+def _trajectory(gof, energies, frac, fmax=0.1):
+    """Step records of one geo_opt folder: a 4-atom cubic cell, energies (n,), frac (n, 4, 3)."""
+    lattice = {"matrix": (4.0 * np.eye(3)).tolist()}
+    return [{"geo_opt_folder": gof, "step": i, "energy": float(e),
+             "forces": [[fmax, 0.0, 0.0]] * 4,
+             "structure": {"lattice": lattice, "sites": [{"abc": list(map(float, abc))} for abc in f]}}
+            for i, (e, f) in enumerate(zip(energies, frac))]
+
+def _relaxation(gof, n_moving, n_tail, rng):
+    """Large moves for n_moving steps, then a converged tail of n_tail steps."""
+    n = n_moving + n_tail
+    energy = -20.0 - 0.5 * np.minimum(np.arange(n), n_moving) - 1e-4 * rng.random(n)
+    shift = 0.05 * np.minimum(np.arange(n), n_moving)[:, None, None]     # 0.2 Å per step
+    frac = 0.25 * np.arange(4)[None, :, None] + shift + 1e-5 * rng.random((n, 4, 3))
+    return _trajectory(gof, energy, frac)
+
+def test_adaptive_keeps_few_converged_steps():
+    rng = np.random.default_rng(2)
+    steps = _relaxation("geo_opt", 10, 60, rng)
+    kept = [s["step"] for s in select_steps(steps, selector=make_selector("adaptive"))]
+    assert kept[:10] == list(range(1, 11))
+    # the converged tail only keeps its last step (last of the highest folder)
+    assert kept[10:] == [69]
+    every = [s["step"] for s in select_steps(steps)]
+    assert len([k for k in every if k > 10]) > len(kept[10:])
+
+@pytest.mark.parametrize("block", [1, 3, 7, 64])
+def test_adaptive_blocks_keep_the_same_steps(block):
+    rng = np.random.default_rng(3)
+    steps = []
+    for gof in ("geo_opt", "geo_opt_2"):
+        n = 150
+        energy = -20.0 + np.cumsum(0.03 * rng.standard_normal(n))
+        frac = 0.25 * np.arange(4)[None, :, None] + np.cumsum(0.004 * rng.standard_normal((n, 4, 3)), axis=0)
+        steps += _trajectory(gof, energy, frac, fmax=0.3)
+    one_block = list(select_steps(steps, selector=AdaptiveSelector(block=len(steps))))
+    assert 10 < len(one_block) < len(steps)
+    assert list(select_steps(steps, selector=AdaptiveSelector(block=block))) == one_block
+
+@pytest.mark.parametrize("folders", [("geo_opt", "geo_opt_2"), ("geo_opt_2", "geo_opt")])
+def test_adaptive_keeps_last_step_of_highest_folder(folders):
+    rng = np.random.default_rng(4)
+    steps = []
+    for gof in folders:
+        steps += _relaxation(gof, 5, 20, rng)
+    selected = list(select_steps(steps, selector=make_selector("adaptive")))
+    kept = {gof: [s["step"] for s in selected if s["geo_opt_folder"] == gof] for gof in folders}
+    # both folders keep their moves; only the highest one adds its converged last step
+    assert kept["geo_opt"] == [1, 2, 3, 4, 5]
+    assert kept["geo_opt_2"] == [1, 2, 3, 4, 5, 24]
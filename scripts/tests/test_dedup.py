@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from pymatgen.analysis.structure_matcher import StructureMatcher
+from pymatgen.core import Lattice, Structure
+
+from geoopt_pipeline import dedup
+
+SPECIES = ["Ni", "Ni", "Ni", "P", "P", "P"]
+
+def _base(rng):
+    lattice = Lattice.from_parameters(*(4.0 + rng.random(3)), *(85 + 10 * rng.random(3)))
+    return Structure(lattice, SPECIES, rng.random((len(SPECIES), 3)))
+
+def _variant(s, kind, rng):
+    if kind == "permuted":
+        order = rng.permutation(len(s))
+        return Structure(s.lattice, [s.species[k] for k in order], s.frac_coords[order])
+    if kind == "translated":
+        return Structure(s.lattice, s.species, s.frac_coords + rng.random(3))
+    if kind == "sheared":
+        # same crystal, other basis: (a, b, c) -> (a, a + b, c)
+        basis = np.array([[1, 0, 0], [1, 1, 0], [0, 0, 1]]) @ s.lattice.matrix
+        return Structure(Lattice(basis), s.species, s.cart_coords, coords_are_cartesian=True)
+    if kind == "strained":
+        strain = np.eye(3) + 1e-3 * (rng.random((3, 3)) - 0.5)
+        noise = 2e-3 * (rng.random((len(s), 3)) - 0.5)
+        return Structure(Lattice(s.lattice.matrix @ strain), s.species, s.cart_coords @ strain + noise,
+                         coords_are_cartesian=True)
+    raise ValueError(kind)
+
+def _structures(seed):
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(4):
+        base = _base(rng)
+        out.append(base)
+        for kind in ("permuted", "translated", "sheared", "strained"):
+            out.append(_variant(base, kind, rng))
+        out.append(_variant(_variant(_variant(base, "sheared", rng), "permuted", rng), "translated", rng))
+    order = rng.permutation(len(out))
+    energies = (-20.0 + rng.random(len(out))).tolist()
+    return [out[k] for k in order], energies
+
+@pytest.mark.parametrize("seed", range(3))
+def test_prefilter_keeps_the_same_rows(monkeypatch, seed):
+    structures, energies = _structures(seed)
+    matcher = StructureMatcher(**dedup.SM_KW)
+    monkeypatch.setattr(dedup, "PREFILTER", False)
+    expected = dedup.dedup_group(structures, energies, matcher)
+    monkeypatch.setattr(dedup, "PREFILTER", True)
+    assert dedup.dedup_group(structures, energies, matcher) == expected
+    # every variant matched its base structure
+    assert len(expected[0]) == 4
+
+@pytest.mark.parametrize("seed", [3, 4, 5])
+def test_prefilter_keeps_sheared_arrangements(monkeypatch, seed):
+    # same cell, sites sheared by (a, b, c) -> (a, b, a + c): fit() matches
+    # them through that basis of the long cell, not through the identity map
+    rng = np.random.default_rng(seed)
+    lattice = Lattice(np.diag([3.0, 8.0, 40.0]))
+    species = ["Ni"] * 8 + ["P"] * 16
+    frac = rng.random((len(species), 3))
+    shear = np.array([[1, 0, 0], [0, 1, 0], [1, 0, 1]])
+    structures = [Structure(lattice, species, frac),
+                  Structure(lattice, species, frac @ shear @ lattice.matrix, coords_are_cartesian=True)]
+    matcher = StructureMatcher(**dedup.SM_KW)
+    assert matcher.fit(structures[1], structures[0])
+    monkeypatch.setattr(dedup, "PREFILTER", False)
+    expected = dedup.dedup_group(structures, [-1.0, -2.0], matcher)
+    monkeypatch.setattr(dedup, "PREFILTER", True)
+    assert dedup.dedup_group(structures, [-1.0, -2.0], matcher) == expected
+    assert expected[0] == [1]
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from conftest import load_script, vasprun_paths
+from geoopt_pipeline.selection import PRESELECTED_KEY, finalize_preselected, select_steps
+from geoopt_pipeline.trajectory import iter_steps, save_trajectory
+
+pytestmark = pytest.mark.filterwarnings("ignore::FutureWarning")
+
+@pytest.fixture(scope="module")
+def extractor():
+    return load_script("extract-all-intermediate-info.py")
+
+def test_streamed_json_is_byte_identical(extractor, vasprun_tree, tmp_path):
+    for i, path in enumerate(vasprun_paths(vasprun_tree)):
+        out = tmp_path / f"{i}_intermediate_data.json"
+        n = extractor.write_steps_json(str(out), extractor.iter_vasprun_steps(path))
+        steps = extractor.process_vasprun(path)
+        assert n == len(steps) > 0
+        assert out.read_text() == json.dumps(steps, indent=4)
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_npz_round_trip(extractor, vasprun_tree, tmp_path, compress):
+    steps = [s for path in vasprun_paths(vasprun_tree) for s in extractor.process_vasprun(path)]
+    out = str(tmp_path / "1_intermediate_data.npz")
+    assert save_trajectory(out, steps[:25], compress=compress) == 25
+    assert list(iter_steps(out)) == steps[:25]
+
+@pytest.mark.parametrize("select_every", [None, 10])
+def test_split_parse_equals_serial_parse(extractor, vasprun_tree, select_every):
+    path = vasprun_paths(vasprun_tree)[0]
+    tasks = extractor.plan_file_chunks(path, 3, min_chunk_bytes=1, select_every=select_every)
+    assert len(tasks) == 3
+    split = []
+    for idx, (state, start, end) in enumerate(tasks):
+        _, _, steps, error = extractor._extract_calculation_range(path, idx, state, start, end)
+        assert error is None
+        split += steps
+    serial = list(extractor.iter_vasprun_steps(path, select_every))
+    if select_every:
+        # chunk borders add provisional steps; the final selection drops them again
+        split = finalize_preselected({"geo_opt": split}, select_every)
+        serial = finalize_preselected({"geo_opt": serial}, select_every)
+    assert split == serial
+
+def test_select_every_equals_post_hoc_selection(extractor, vasprun_tree):
+    for folder in sorted(vasprun_tree.iterdir()):
+        paths = sorted(str(p) for p in folder.glob("geo_opt*/vasprun.xml"))
+        full = [s for path in paths for s in extractor.process_vasprun(path)]
+        groups = {}
+        for path in paths:
+            for s in extractor.iter_vasprun_steps(path, 10):
+                groups.setdefault(s["geo_opt_folder"], []).append(s)
+        preselected = finalize_preselected(groups, 10)
+        assert all(s.pop(PRESELECTED_KEY) == 10 for s in preselected)
+        assert preselected == list(select_steps(full))
+
+def _grow(path, data, pieces):
+    """Write data to path in `pieces` appends, yielding after each one."""
+    cuts = [len(data) * k // pieces for k in range(pieces + 1)]
+    with open(path, "wb") as f:
+        for start, end in zip(cuts, cuts[1:]):
+            f.write(data[start:end])
+            f.flush()
+            yield
+
+def test_follow_reads_a_growing_file(extractor, vasprun_tree, tmp_path):
+    source = vasprun_paths(vasprun_tree)[0]
+    path = tmp_path / "geo_opt" / "vasprun.xml"
+    path.parent.mkdir()
+    entry = {"offset": 0, "step_index": 0}
+    steps = []
+    for _ in _grow(path, open(source, "rb").read(), 9):
+        extractor.read_new_steps(str(path), entry, steps.extend, block_size=4096)
+    assert steps == extractor.process_vasprun(source)
+    assert entry["step_index"] == len(steps)
+
+def test_follow_rebuilds_replaced_and_truncated_files(extractor, vasprun_tree, tmp_path):
+    sources = vasprun_paths(vasprun_tree)
+    base, out = tmp_path / "calculations", tmp_path / "out"
+    (base / "1_Ni2P2" / "geo_opt").mkdir(parents=True)
+    out.mkdir()
+    path = base / "1_Ni2P2" / "geo_opt" / "vasprun.xml"
+    output = out / "1_Ni2P2_intermediate_data.json"
+    state = {"version": 1, "folders": {}}
+
+    def poll():
+        n, failures = extractor.poll_folder("1_Ni2P2", str(base), str(out), state)
+        assert not failures
+        return n
+
+    data = open(sources[0], "rb").read()
+    path.write_bytes(data[:len(data) // 2])
+    assert poll() > 0
+    path.write_bytes(data)
+    poll()
+    assert json.loads(output.read_text()) == extractor.process_vasprun(sources[0])
+
+    # replaced by another file (new inode)
+    other = tmp_path / "other.xml"
+    other.write_bytes(open(sources[1], "rb").read())
+    other.replace(path)
+    poll()
+    assert json.loads(output.read_text()) == extractor.process_vasprun(sources[1])
+
+    # truncated in place: restarted job, only its complete steps are kept
+    with open(path, "r+b") as f:
+        f.truncate(path.stat().st_size // 3)
+    poll()
+    n_complete = path.read_bytes().count(b"</calculation>")
+    assert 0 < n_complete
+    assert json.loads(output.read_text()) == extractor.process_vasprun(sources[1])[:n_complete]
+
+def test_follow_skips_compressed_files(extractor, vasprun_tree, tmp_path, capsys):
+    import gzip
+    base, out = tmp_path / "calculations", tmp_path / "out"
+    (base / "1_Ni2P2" / "geo_opt").mkdir(parents=True)
+    out.mkdir()
+    with gzip.open(base / "1_Ni2P2" / "geo_opt" / "vasprun.xml.gz", "wb") as f:
+        f.write(open(vasprun_paths(vasprun_tree)[0], "rb").read())
+    state = {"version": 1, "folders": {}}
+    for _ in range(2):
+        assert extractor.poll_folder("1_Ni2P2", str(base), str(out), state) == (0, [])
+    assert capsys.readouterr().out.count("Not following compressed") == 1
@@ -0,0 +1,48 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+
+from conftest import load_script
+from geoopt_pipeline.histogram import StreamingHistogram, read_table
+
+FORCE_WIDTH = 0.01
+
+@pytest.fixture(scope="module")
+def plotter():
+    return load_script("plot-energy-force-hist.py")
+
+def _dataset(path, rng):
+    """CSV with Energy and Forces columns; returns (energies, (n, 3) force vectors)."""
+    energies = -800.0 + 60.0 * rng.standard_normal(300)
+    forces = [np.round(0.08 * rng.standard_normal((int(n), 3)), 4) for n in rng.integers(2, 9, len(energies))]
+    forces[0][0] = [0.0, 0.05, -0.1]   # values on bin edges
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["Energy", "Forces", "Directory"])
+        for e, fv in zip(energies, forces):
+            w.writerow([repr(float(e)), json.dumps(fv.tolist()), "1_NiP"])
+    return energies, np.concatenate(forces)
+
+def _nonzero(counts):
+    return {k: c for k, c in counts.items() if c}
+
+@pytest.mark.parametrize("width", [FORCE_WIDTH, 0.03])
+def test_table_gives_the_bins_of_the_csv(plotter, tmp_path, width):
+    energies, forces = _dataset(tmp_path / "data.csv", np.random.default_rng(6))
+    energy_width = 550.0 / 80
+    loaded, force_hists = plotter.load_dataset(str(tmp_path / "data.csv"), "Energy", "Forces", FORCE_WIDTH)
+    plotter.save_hist(str(tmp_path / "hist.csv"), loaded, energy_width, force_hists)
+    table = read_table(str(tmp_path / "hist.csv"))
+
+    counts, actual = plotter.table_bins(table, plotter.ENERGY_QUANTITY, energy_width)
+    assert actual == pytest.approx(energy_width)
+    assert _nonzero(counts) == StreamingHistogram(energy_width).add(energies).bin_counts()
+    for k, (_, quantity) in enumerate(plotter.FORCE_QUANTITIES):
+        # the bins the CSV figure is drawn from
+        assert force_hists[k].bin_counts() == StreamingHistogram(FORCE_WIDTH).add(forces[:, k]).bin_counts()
+        counts, actual = plotter.table_bins(table, quantity, width)
+        assert actual == pytest.approx(width)
+        assert _nonzero(counts) == StreamingHistogram(width).add(forces[:, k]).bin_counts()
+        assert sum(counts.values()) == len(forces)
@@ -0,0 +1,31 @@
+import io
+import json
+
+import pytest
+
+from geoopt_pipeline.jsonstream import iter_json_array
+
+DATA = [{"s": "é\\n\"x" * k, "x": [1.5e-7, -3, 12345.25], "t": True, "f": False, "n": None, "u": "é中"}
+        for k in range(40)]
+
+class CountingReader(io.StringIO):
+    def __init__(self, text):
+        super().__init__(text)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+@pytest.mark.parametrize("chunk_chars", [1, 2, 3, 7, 64, 1 << 20])
+def test_chunk_borders(chunk_chars):
+    for text in (json.dumps(DATA), json.dumps(DATA, indent=4), json.dumps(DATA, ensure_ascii=False)):
+        assert list(iter_json_array(io.StringIO(text), chunk_chars)) == DATA
+
+def test_corruption_is_raised_without_reading_the_rest():
+    text = json.dumps(DATA)
+    cut = len(text) // 4
+    f = CountingReader(text[:cut] + " x " + text[cut:])
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(f, 64))
+    assert f.reads < len(text) // 64 // 2
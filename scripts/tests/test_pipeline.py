@@ -0,0 +1,76 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SCRIPTS_DIR
+from geoopt_pipeline.filters import FILTER_COUNTERS, FilterSweep, filter_csv
+
+COMBINED = "consolidated_data_10th_step.csv"
+FILTERED = "consolidated_data_10th_step_filtered_E-1050_to_-500__F-100_to_100.csv"
+DEDUPED = "consolidated_data_10th_step_after_str_mat.csv"
+RANGES = "energy_force_range_summary.csv"
+
+def run(script, *args, cwd, **env):
+    """Run one of the scripts in cwd like a user would; returns its stdout."""
+    proc = subprocess.run([sys.executable, "-W", "ignore", os.path.join(SCRIPTS_DIR, script), *map(str, args)],
+                          cwd=cwd, env={**os.environ, **env}, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout
+
+def extract(vasprun_tree, work, *args):
+    """Extract a copy of the vasprun tree; the output folder is named as the combine step expects."""
+    shutil.copytree(vasprun_tree, work)
+    run("extract-all-intermediate-info.py", *args, cwd=work)
+    os.rename(work / "all_intermediate_information", work / "phosphorus_based_int_str")
+    return work
+
+@pytest.fixture(scope="module")
+def staged(vasprun_tree, tmp_path_factory):
+    """The pipeline run stage by stage with the separate scripts."""
+    work = extract(vasprun_tree, tmp_path_factory.mktemp("staged") / "run")
+    run("combine-to-csv-at-each-10th-step.py", cwd=work)
+    run("filter-en-force.py", cwd=work)
+    run("structure-matcher.py", cwd=work, INPUT_CSV=FILTERED, N_WORKERS="1")
+    run("range_energy_force_from_csv.py", "--csv", DEDUPED, cwd=work)
+    return work
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_fused_pipeline_matches_staged_scripts(staged, tmp_path):
+    out = run("run-pipeline.py", "--json-dir", staged / "phosphorus_based_int_str",
+              "--workers", 1, "--write-intermediate", cwd=tmp_path)
+    assert "Deduplicated: kept" in out
+    for name in (COMBINED, FILTERED, DEDUPED, RANGES):
+        assert _read(tmp_path / name) == _read(staged / name), name
+
+def test_stages_drop_and_merge_rows(staged):
+    n_lines = [len(_read(staged / name).splitlines()) for name in (COMBINED, FILTERED, DEDUPED)]
+    # the energy window drops 2_Ni3P, the force window one step of 1_Ni2P2,
+    # dedup the converged steps of 10_NiP2
+    assert n_lines[0] > n_lines[1] > n_lines[2] > 1
+
+def test_select_every_combines_to_the_same_csv(vasprun_tree, staged, tmp_path):
+    work = extract(vasprun_tree, tmp_path / "run", "--select-every", 10)
+    run("combine-to-csv-at-each-10th-step.py", cwd=work)
+    assert _read(work / COMBINED) == _read(staged / COMBINED)
+    run("range_energy_force_from_csv.py", "--stats-dir", work / "phosphorus_based_int_str", "--selected",
+        "--out-csv", "pre.csv", cwd=work)
+    run("range_energy_force_from_csv.py", "--stats-dir", staged / "phosphorus_based_int_str", "--selected",
+        "--out-csv", "full.csv", cwd=work)
+    assert _read(work / "pre.csv") == _read(work / "full.csv")
+
+def test_sweep_equals_single_filters(staged):
+    grid = dict(emins=[-1200.0, -1050.0, -610.0], emaxs=[-500.0, -600.2], fmins=[-100.0, -1.0], fmaxs=[100.0, 200.0])
+    sweep = FilterSweep(grid["emins"], grid["emaxs"], grid["fmins"], grid["fmaxs"])
+    filter_csv(str(staged / COMBINED), None, sweep=sweep, chunk_rows=7)
+    table = sweep.table()
+    assert len(table) == len(sweep.windows) > 1
+    for t in table:
+        counts = filter_csv(str(staged / COMBINED), None, t["emin"], t["emax"], t["fmin"], t["fmax"])
+        assert {k: t[k] for k in FILTER_COUNTERS} == counts
+    assert len({t["kept"] for t in table}) > 2
@@ -0,0 +1,29 @@
+import numpy as np
+
+from geoopt_pipeline.sketch import TDigest
+
+def test_tdigest_rank_error_after_chunks_and_merge():
+    rng = np.random.default_rng(5)
+    # two separated modes, one of them skewed
+    data = np.concatenate([rng.lognormal(0.0, 1.0, 150_000), rng.normal(-3.0, 0.1, 50_000)])
+    rng.shuffle(data)
+    digests = []
+    for part in np.array_split(data, 4):
+        digest = TDigest()
+        for chunk in np.split(part, np.sort(rng.integers(0, len(part), 30))):
+            digest.add(chunk)
+        digests.append(digest)
+    merged = digests[0]
+    for digest in digests[1:]:
+        merged.merge(digest)
+    assert merged.n == len(data)
+    assert (merged.min, merged.max) == (data.min(), data.max())
+
+    qs = np.array([0.001, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999])
+    values = np.sort(data)
+    ranks = np.searchsorted(values, merged.quantiles(qs)) / len(values)
+    exact = np.searchsorted(values, np.quantile(data, qs)) / len(values)
+    error = np.abs(ranks - exact)
+    assert error.max() < 1e-3
+    # tails stay accurate relative to their distance from 0 / 1
+    assert (error < 0.2 * np.minimum(qs, 1 - qs)).all()
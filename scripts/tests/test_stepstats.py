@@ -0,0 +1,39 @@
+import json
+import os
+
+from geoopt_pipeline.ranges import EnergyForceRanges
+from geoopt_pipeline.selection import PRESELECTED_KEY, select_steps
+from geoopt_pipeline.stepstats import iter_stats, step_stats, write_stats
+
+def _write_sidecars(intermediate_dir, out_dir, preselect):
+    paths = []
+    for name in sorted(os.listdir(intermediate_dir)):
+        with open(os.path.join(intermediate_dir, name)) as f:
+            steps = json.load(f)
+        if preselect:
+            # what the extractor writes with --select-every 10
+            steps = [dict(s, **{PRESELECTED_KEY: 10}) for s in select_steps(steps)]
+        path = os.path.join(out_dir, name.replace("_intermediate_data.json", "_intermediate_stats.csv"))
+        write_stats(path, map(step_stats, steps))
+        paths.append(path)
+    return paths
+
+def _summary(ranges):
+    return (ranges.n_energy, ranges.n_force_vecs, ranges.E_min, ranges.E_max, ranges.Fx_min, ranges.Fz_max)
+
+def test_selected_keeps_preselected_sidecar_rows(intermediate_dir, tmp_path):
+    (tmp_path / "full").mkdir()
+    (tmp_path / "pre").mkdir()
+    full = _write_sidecars(intermediate_dir, str(tmp_path / "full"), preselect=False)
+    pre = _write_sidecars(intermediate_dir, str(tmp_path / "pre"), preselect=True)
+    assert all(r[PRESELECTED_KEY] == 10 for r in iter_stats(pre[0]))
+
+    expected = _summary(EnergyForceRanges().update_stats_files(full, selected=True))
+    assert _summary(EnergyForceRanges().update_stats_files(pre, selected=True)) == expected
+    assert _summary(EnergyForceRanges().update_stats_files(pre)) == expected
+
+def test_sidecar_without_selected_every_column(tmp_path):
+    path = tmp_path / "1_intermediate_stats.csv"
+    path.write_text("geo_opt_folder,step,energy,natoms\ngeo_opt,0,-1.5,4\n")
+    rec, = iter_stats(str(path))
+    assert rec[PRESELECTED_KEY] == 0 and rec["energy"] == -1.5 and rec["fmax_norm"] is None